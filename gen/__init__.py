@@ -301,6 +301,13 @@ def do_gen_package(config, package_filename):
         # Make the package top level directory readable by users other than the owner (root).
         os.chmod(tmpdir, 0o755)
 
+        # Directory modes would otherwise depend on the umask. Together with
+        # make_tar normalizing order, owners and mtimes the same config always
+        # gives the same package bytes.
+        for root, dirs, _ in os.walk(tmpdir):
+            for name in dirs:
+                os.chmod(os.path.join(root, name), 0o755)
+
         make_tar(package_filename, tmpdir)
 
     log.info("Package filename: %s", package_filename)
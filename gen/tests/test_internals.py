@@ -1,5 +1,6 @@
 import pytest
 
+import gen
 import gen.internals
 from gen.exceptions import ValidationError
 from gen.internals import Scope, Source, Target
@@ -119,3 +120,13 @@ def test_resolve_late():
     assert resolver.late == {'c'}
 
     # TODO(cmaloney): Test resolved from late variables
+
+
+def test_do_gen_package_reproducible(tmpdir):
+    config = {'package': [
+        {'path': '/etc/foo.conf', 'content': 'foo'},
+        {'path': 'bin/bar', 'content': 'bar', 'permissions': '0755'},
+    ]}
+    gen.do_gen_package(config, str(tmpdir.join('a.tar.xz')))
+    gen.do_gen_package(config, str(tmpdir.join('b.tar.xz')))
+    assert tmpdir.join('a.tar.xz').read_binary() == tmpdir.join('b.tar.xz').read_binary()
@@ -9,6 +9,7 @@ Each package contains a pkginfo.json. That contains a list of requires as well a
 environment variables from the package.
 
 """
+import errno
 import grp
 import json
 import os
@@ -16,18 +17,18 @@ import os.path
 import pwd
 import re
 import shutil
-import tempfile
 from collections import Iterable
 from itertools import chain
 from subprocess import CalledProcessError, check_call, check_output
 from typing import Union
 
-from pkgpanda.constants import (DCOS_SERVICE_CONFIGURATION_FILE,
+from pkgpanda.constants import (ACTIVE_ROLES_FILE,
+                                DCOS_SERVICE_CONFIGURATION_FILE,
                                 RESERVED_UNIT_NAMES,
                                 STATE_DIR_ROOT)
 from pkgpanda.exceptions import (InstallError, PackageError, PackageNotFound,
                                  ValidationError)
-from pkgpanda.util import (download, extract_tarball, if_exists, load_json, write_json, write_string)
+from pkgpanda.util import (download_extract_tarball, if_exists, load_json, write_json, write_string)
 
 # TODO(cmaloney): Can we switch to something like a PKGBUILD from ArchLinux and
 # then just do the mutli-version stuff ourself and save a lot of re-implementation?
@@ -291,7 +292,7 @@ def validate_compatible(packages, roles):
 
 
 # TODO(cmaloney): Add a github fetcher, useful for grabbing config tarballs.
-def requests_fetcher(base_url, id_str, target, work_dir):
+def requests_fetcher(base_url, id_str, target, work_dir, session=None):
     assert base_url
     assert type(id_str) == str
     id = PackageId(id_str)
@@ -300,11 +301,9 @@ def requests_fetcher(base_url, id_str, target, work_dir):
     # all the logic can go away, we gain integrity checking, etc.
     base_url = base_url.rstrip('/')
     url = base_url + "/packages/{0}/{1}.tar.xz".format(id.name, id_str)
-    # TODO(cmaloney): Use a private tmp directory so there is no chance of a user
-    # intercepting the tarball + other validation data locally.
-    with tempfile.NamedTemporaryFile(suffix=".tar.xz") as file:
-        download(file.name, url, work_dir, rm_on_error=False)
-        extract_tarball(file.name, target)
+    # The tarball is streamed straight into tar, so it never lands on disk
+    # where a local user could tamper with it between download and extraction.
+    download_extract_tarball(url, target, work_dir, session=session)
 
 
 class Repository:
@@ -424,35 +423,94 @@ class ConflictingFile(ValidationError):
         self.ex = ex
 
 
-# Create folders and symlink files inside the folders. Allows multiple
-# packages to have the same folder and provide it publicly.
-def symlink_tree(src, dest):
-    for name in os.listdir(src):
-        src_path = os.path.join(src, name)
-        dest_path = os.path.join(dest, name)
-        # Symlink files and symlinks directly. For directories make a
-        # real directory and symlink everything inside.
-        # NOTE: We could relax this and follow symlinks, but then we
-        # need to be careful about recursive filesystem layouts.
-        if os.path.isdir(src_path) and not os.path.islink(src_path):
-            if os.path.exists(dest_path):
-                # We can only merge a directory into a directory.
-                # We won't merge into a symlink directory because that could
-                # result in a package editing inside another package.
-                if not os.path.isdir(dest_path) and not os.path.islink(dest_path):
+class SymlinkFarm:
+    """Folders to create and files to symlink inside them, gathered from many source trees.
+
+    Allows multiple packages to have the same folder and provide it publicly.
+    Every source tree is scanned once with add_tree(), which finds conflicting
+    files before anything is written. write() then creates everything in one
+    pass.
+    """
+
+    def __init__(self):
+        # Destination path -> source path.
+        self.dirs = dict()
+        self.links = dict()
+
+    def add_tree(self, src, dest):
+        """Plan a real directory in dest for each directory in src and a symlink for everything else."""
+        pending = [(src, dest)]
+        while pending:
+            src_dir, dest_dir = pending.pop()
+            for entry in os.scandir(src_dir):
+                dest_path = os.path.join(dest_dir, entry.name)
+                # Symlink files and symlinks directly. For directories make a
+                # real directory and symlink everything inside.
+                # NOTE: We could relax this and follow symlinks, but then we
+                # need to be careful about recursive filesystem layouts.
+                if entry.is_dir(follow_symlinks=False):
+                    # We can only merge a directory into a directory.
+                    # We won't merge into a symlink directory because that could
+                    # result in a package editing inside another package.
+                    if dest_path in self.links:
+                        raise ValidationError(
+                            "Can't merge a file `{0}` and directory (or symlink) `{1}` with the same name."
+                            .format(entry.path, dest_path))
+                    self.dirs.setdefault(dest_path, entry.path)
+                    pending.append((entry.path, dest_path))
+                else:
+                    self.add_link(entry.path, dest_path)
+
+    def add_link(self, src, dest):
+        if dest in self.links or dest in self.dirs:
+            raise ConflictingFile(src, dest, FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest))
+        self.links[dest] = src
+
+    def write(self, merge=False):
+        """Create the planned directories and symlinks.
+
+        The destination roots must exist. If merge is set they may already have
+        contents, which are checked for conflicts before anything is written.
+        """
+        if merge:
+            for path, src in self.dirs.items():
+                if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
                     raise ValidationError(
                         "Can't merge a file `{0}` and directory (or symlink) `{1}` with the same name."
-                        .format(src_path, dest_path))
-            else:
-                os.makedirs(dest_path)
+                        .format(src, path))
+            for dest, src in self.links.items():
+                if os.path.lexists(dest):
+                    raise ConflictingFile(src, dest, FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest))
 
-            # Recurse into the directory symlinking everything so long as the directory isn't
-            symlink_tree(src_path, dest_path)
-        else:
+        # Parents before their children.
+        for path in sorted(self.dirs, key=lambda path: path.count('/')):
             try:
-                os.symlink(src_path, dest_path)
-            except FileNotFoundError as ex:
-                raise ConflictingFile(src_path, dest_path, ex) from ex
+                os.mkdir(path)
+            except FileExistsError:
+                if not merge:
+                    raise
+        for dest, src in self.links.items():
+            os.symlink(src, dest)
+
+
+def unlink_tree(src, dest):
+    """Undo a written SymlinkFarm.add_tree(src, dest).
+
+    Removes the symlinks to src's files from dest, leaving any directories in
+    place. Returns the directories under dest which were visited, deepest
+    first, so the caller can remove those left empty.
+    """
+    visited = []
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+                visited += unlink_tree(src_path, dest_path)
+                visited.append(dest_path)
+        elif os.path.islink(dest_path) and os.readlink(dest_path) == src_path:
+            os.remove(dest_path)
+    return visited
 
 
 # Manages a systemd-sysusers user set.
@@ -678,7 +736,17 @@ class Install:
             ]))
     # Builds new working directories for the new active set, then swaps it into place as atomically as possible.
 
-    def activate(self, packages):
+    def activate(self, packages, incremental=False):
+        """Make packages the active set.
+
+        If incremental is set and the tree archived as .old by the last
+        activation is intact, that tree is reused as the new one: only the
+        symlinks of packages which differ between its package set and packages
+        are removed and added, rather than building every symlink again. The
+        swap into place is the same either way. The archived tree is only
+        reused if it was built with the same roles, which each activation
+        records in the etc directory of the tree.
+        """
         # Ensure the new set is reasonable.
         validate_compatible(packages, self.__roles)
 
@@ -692,23 +760,38 @@ class Install:
 
         old_names = [name + ".old" for name in active_names]
 
-        # Remove all pre-existing new and old directories
-        for name in chain(new_names, old_names):
-            if os.path.exists(name):
-                if os.path.isdir(name):
-                    shutil.rmtree(name)
-                else:
-                    os.remove(name)
-
-        # Make the directories for the new config
-        for name in new_dirs:
-            os.makedirs(name)
-
-        def symlink_all(src, dest):
-            if not os.path.isdir(src):
-                return
-
-            symlink_tree(src, dest)
+        to_link = None
+        emptied_dirs = []
+        if incremental:
+            to_link, emptied_dirs = self._reuse_old_tree(packages, new_dirs)
+        reused = to_link is not None
+
+        if not reused:
+            # Remove all pre-existing new and old directories
+            for name in chain(new_names, old_names):
+                if os.path.exists(name):
+                    if os.path.isdir(name):
+                        shutil.rmtree(name)
+                    else:
+                        os.remove(name)
+
+            # Make the directories for the new config
+            for name in new_dirs:
+                os.makedirs(name)
+
+            to_link = packages
+
+        # Add the folders of each package. Everything is checked for conflicts
+        # before the first symlink is made.
+        farm = SymlinkFarm()
+        for package in to_link:
+            self._link_package(package, new_dirs, farm)
+        farm.write(merge=reused)
+
+        # Directories only the removed packages had go with them.
+        for path in emptied_dirs:
+            if os.path.isdir(path) and not os.listdir(path) and not self._provides_dir(packages, new_dirs, path):
+                os.rmdir(path)
 
         # Set the new LD_LIBRARY_PATH, PATH.
         env_contents = env_header.format("/opt/mesosphere" if self.__fake_path else self.__root)
@@ -736,40 +819,8 @@ class Install:
 
             return list(map(lambda name: os.path.splitext(name)[0], service_files))
 
-        # Add the folders, config in each package.
+        # Add the config of each package.
         for package in packages:
-            # Package folders
-            # NOTE: Since active is at the end of the folder list it will be
-            # removed by the zip. This is the desired behavior, since it will be
-            # populated later.
-            # Do the basename since some well known dirs are full paths (dcos.target.wants)
-            # while inside the packages they are always top level directories.
-            for new, dir_name in zip(new_dirs, self.__well_known_dirs):
-                dir_name = os.path.basename(dir_name)
-                pkg_dir = os.path.join(package.path, dir_name)
-
-                assert os.path.isabs(new)
-                assert os.path.isabs(pkg_dir)
-
-                try:
-                    symlink_all(pkg_dir, new)
-
-                    # Symlink all applicable role-based config
-                    for role in self.__roles:
-                        role_dir = os.path.join(package.path, "{0}_{1}".format(dir_name, role))
-                        symlink_all(role_dir, new)
-
-                except ConflictingFile as ex:
-                    raise ValidationError("Two packages are trying to install the same file {0} or "
-                                          "two roles in the set of roles {1} are causing a package "
-                                          "to try activating multiple versions of the same file. "
-                                          "One of the package files is {2}.".format(ex.dest,
-                                                                                    self.__roles,
-                                                                                    ex.src))
-
-            # Add to the active folder
-            os.symlink(package.path, os.path.join(self._make_abs("active.new"), package.name))
-
             # Add to the environment and environment.export contents
 
             env_contents += "# package: {0}\n".format(package.id)
@@ -821,6 +872,7 @@ class Install:
 
         dcos_service_configuration_file = os.path.join(self._make_abs("etc.new"), DCOS_SERVICE_CONFIGURATION_FILE)
         write_json(dcos_service_configuration_file, dcos_service_configuration)
+        write_json(os.path.join(self._make_abs("etc.new"), ACTIVE_ROLES_FILE), sorted(self.__roles))
 
         # Write out the new environment file.
         new_env = self._make_abs("environment.new")
@@ -836,6 +888,97 @@ class Install:
 
         self.swap_active(".new")
 
+    def _get_package_dirs(self, package_path, new_dirs):
+        """Yield (directory in package_path, new_dirs entry it is symlinked into) for each well known dir."""
+        # NOTE: Since active is at the end of the folder list it will be
+        # removed by the zip.
+        # Do the basename since some well known dirs are full paths (dcos.target.wants)
+        # while inside the packages they are always top level directories.
+        for new, dir_name in zip(new_dirs, self.__well_known_dirs):
+            dir_name = os.path.basename(dir_name)
+            # Role-based config comes after the package's own dir.
+            for pkg_dir_name in [dir_name] + ["{0}_{1}".format(dir_name, role) for role in self.__roles]:
+                pkg_dir = os.path.join(package_path, pkg_dir_name)
+                assert os.path.isabs(new)
+                assert os.path.isabs(pkg_dir)
+                if os.path.isdir(pkg_dir):
+                    yield pkg_dir, new
+
+    def _link_package(self, package, new_dirs, farm):
+        try:
+            for pkg_dir, new in self._get_package_dirs(package.path, new_dirs):
+                farm.add_tree(pkg_dir, new)
+
+            # Add to the active folder
+            farm.add_link(package.path, os.path.join(self._make_abs("active.new"), package.name))
+        except ConflictingFile as ex:
+            raise ValidationError("Two packages are trying to install the same file {0} or "
+                                  "two roles in the set of roles {1} are causing a package "
+                                  "to try activating multiple versions of the same file. "
+                                  "One of the package files is {2}.".format(ex.dest,
+                                                                            self.__roles,
+                                                                            ex.src))
+
+    def _provides_dir(self, packages, new_dirs, path):
+        """Whether any of packages has the directory which is path in the new tree."""
+        for package in packages:
+            for pkg_dir, new in self._get_package_dirs(package.path, new_dirs):
+                if path.startswith(new + '/') and os.path.isdir(pkg_dir + path[len(new):]):
+                    return True
+        return False
+
+    def _reuse_old_tree(self, packages, new_dirs):
+        """Turn the tree archived as .old into the .new tree for packages, as far as the symlinks go.
+
+        Returns the packages which still need to be linked in and the
+        directories left empty by the removed packages. If the .old tree can't
+        be used, e.g. it is missing, a swap into place didn't finish or it was
+        built with other roles, returns (None, []) and nothing is changed.
+        """
+        active_names = self.get_active_names()
+        if os.path.exists(self._make_abs("install_progress")):
+            return None, []
+        if not all(os.path.exists(name + ".old") for name in active_names):
+            return None, []
+        try:
+            old_roles = load_json(os.path.join(self._make_abs("etc.old"), ACTIVE_ROLES_FILE))
+        except (OSError, ValueError):
+            # Built before the roles were recorded.
+            return None, []
+        if old_roles != sorted(self.__roles):
+            return None, []
+
+        old_active = self._make_abs("active.old")
+        old_paths = {
+            os.path.realpath(os.path.join(old_active, name)): name
+            for name in os.listdir(old_active)}
+        new_paths = {os.path.realpath(package.path) for package in packages}
+
+        removed = {path: name for path, name in old_paths.items() if path not in new_paths}
+        # Finding the symlinks to remove means walking the removed packages.
+        if not all(os.path.isdir(path) for path in removed):
+            return None, []
+
+        for name in active_names:
+            new_name = name + ".new"
+            if os.path.isdir(new_name):
+                shutil.rmtree(new_name)
+            elif os.path.exists(new_name):
+                os.remove(new_name)
+            os.rename(name + ".old", new_name)
+
+        emptied_dirs = []
+        new_active = self._make_abs("active.new")
+        for path, name in removed.items():
+            # The symlinks in the tree point at the package path as it was given, which may not be the real path.
+            package_path = os.readlink(os.path.join(new_active, name))
+            for pkg_dir, new in self._get_package_dirs(package_path, new_dirs):
+                emptied_dirs += unlink_tree(pkg_dir, new)
+            os.remove(os.path.join(new_active, name))
+        emptied_dirs.sort(key=lambda path: path.count('/'), reverse=True)
+
+        return [package for package in packages if os.path.realpath(package.path) not in old_paths], emptied_dirs
+
     def recover_swap_active(self):
         state_filename = self._make_abs("install_progress")
         if not os.path.exists(state_filename):
@@ -1,9 +1,12 @@
+import concurrent.futures
 import logging
 import os
 import sys
 import tempfile
 from subprocess import CalledProcessError, check_call
 
+import requests
+
 from gen import do_gen_package, resolve_late_package
 from pkgpanda import PackageId, requests_fetcher
 from pkgpanda.constants import (DCOS_SERVICE_CONFIGURATION_PATH,
@@ -18,8 +21,55 @@ WantedBy=multi-user.target
 
 log = logging.getLogger(__name__)
 
+# Number of packages downloaded and extracted at the same time when fetching
+# several packages at once.
+fetch_jobs = 8
+
+
+def _make_session(jobs):
+    """requests.Session whose connection pool is large enough for jobs concurrent downloads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-def activate_packages(install, repository, package_ids, systemd, block_systemd):
+
+def add_packages(repository, fetcher, package_ids, jobs=None, on_added=None):
+    """Add every package in package_ids to repository using fetcher, up to jobs (default fetch_jobs) at a time.
+
+    Packages already in the repository are skipped. Each package is still
+    extracted next to its final location and renamed into place by
+    Repository.add, so a failed or interrupted fetch never leaves a partial
+    package behind. on_added(package_id) is called as each package lands. If
+    any package fails, the rest are still attempted and then the first error
+    is raised.
+    """
+    to_add = []
+    for package_id in package_ids:
+        PackageId(package_id)
+        if package_id not in to_add and not os.path.exists(repository.package_path(package_id)):
+            to_add.append(package_id)
+
+    def add(package_id):
+        repository.add(fetcher, package_id, warn_added=False)
+        if on_added:
+            on_added(package_id)
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or fetch_jobs) as executor:
+        futures = {executor.submit(add, package_id): package_id for package_id in to_add}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as ex:
+                print("Unable to fetch package {0}: {1}".format(futures[future], ex))
+                errors.append(ex)
+    if errors:
+        raise errors[0]
+
+
+def activate_packages(install, repository, package_ids, systemd, block_systemd, incremental=False):
     """Replace the active package set with package_ids.
 
     install: pkgpanda.Install
@@ -27,9 +77,10 @@ def activate_packages(install, repository, package_ids, systemd, block_systemd):
     package_ids: sequence of package IDs to activate
     systemd: start/stop systemd services
     block_systemd: if systemd, block waiting for systemd services to come up
+    incremental: only relink the packages which changed (see Install.activate)
 
     """
-    install.activate(repository.load_packages(package_ids))
+    install.activate(repository.load_packages(package_ids), incremental)
     if systemd:
         _start_dcos_target(block_systemd)
 
@@ -61,8 +112,9 @@ def swap_active_package(install, repository, package_id, systemd, block_systemd)
 
     packages_by_name[new_id.name] = new_id
     new_active = list(map(str, packages_by_name.values()))
-    # Activate with the new package name
-    activate_packages(install, repository, new_active, systemd, block_systemd)
+    # Activate with the new package name. Only the swapped package changes, so
+    # there is no need to rebuild every symlink.
+    activate_packages(install, repository, new_active, systemd, block_systemd, incremental=True)
 
 
 def fetch_package(repository, repository_url, package_id, work_dir):
@@ -92,6 +144,30 @@ def fetch_package(repository, repository_url, package_id, work_dir):
         sys.stdout.flush()
 
 
+def fetch_packages(repository, repository_url, package_ids, work_dir, jobs=None):
+    """Fetch package_ids from repository_url into repository, up to jobs (default fetch_jobs) at a time.
+
+    repository: pkgpanda.Repository
+    repository_url: URL for remote package repository
+    package_ids: package IDs to fetch
+    work_dir: location for temporary files, used only if repository_url is a file URL with a relative path
+
+    """
+    if len(package_ids) == 1:
+        fetch_package(repository, repository_url, package_ids[0], work_dir)
+        return
+
+    session = _make_session(jobs or fetch_jobs)
+
+    def fetcher(id_, target):
+        return requests_fetcher(repository_url, id_, target, work_dir, session=session)
+
+    def on_added(package_id):
+        print("Fetched: {0}".format(package_id))
+
+    add_packages(repository, fetcher, package_ids, jobs, on_added)
+
+
 def add_package_file(repository, package_filename):
     """Add a package to the repository from a file.
 
@@ -195,11 +271,12 @@ def _do_bootstrap(install, repository):
     # These files should be set by the environment which initially builds
     # the host (cloud-init).
     repository_url = if_exists(load_string, install.get_config_filename("setup-flags/repository-url"))
+    session = _make_session(fetch_jobs)
 
     def fetcher(id, target):
         if repository_url is None:
             raise ValidationError("ERROR: Non-local package {} but no repository url given.".format(id))
-        return requests_fetcher(repository_url, id, target, os.getcwd())
+        return requests_fetcher(repository_url, id, target, os.getcwd(), session=session)
 
     setup_pkg_dir = install.get_config_filename("setup-packages")
     if os.path.exists(setup_pkg_dir):
@@ -254,8 +331,7 @@ def _do_bootstrap(install, repository):
 
         # Ensure all packages are local
         print("Ensuring all packages in active set {} are local".format(",".join(to_activate)))
-        for package in to_activate:
-            repository.add(fetcher, package)
+        add_packages(repository, fetcher, to_activate)
     else:
         print("Calculated active packages from bootstrap tarball")
         to_activate = list(install.get_active())
@@ -272,14 +348,13 @@ def _do_bootstrap(install, repository):
 
             for package_id_str in cluster_packages:
                 # Validate the package ids
-                pkg_id = PackageId(package_id_str)
+                PackageId(package_id_str)
 
-                # Fetch the packages if not local
-                if not repository.has_package(package_id_str):
-                    repository.add(fetcher, package_id_str)
+            # Fetch the packages which aren't local
+            add_packages(repository, fetcher, cluster_packages)
 
-                # Add the package to the set to activate
-                setup_packages_to_activate.append(package_id_str)
+            # Add the packages to the set to activate
+            setup_packages_to_activate += cluster_packages
         else:
             print("No cluster-packages specified")
 
@@ -0,0 +1,5 @@
+"""Micro-benchmarks for pkgpanda internals.
+
+Each module is runnable with `python -m pkgpanda.benchmarks.<name>`. They are not
+part of the test suite.
+"""
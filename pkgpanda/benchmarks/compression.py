@@ -0,0 +1,81 @@
+"""Compare pack time, unpack time and size of package tarballs across compression codecs.
+
+Repacks every package tarball found under the given directories (by default the
+package cache of the tree in the current directory) with each codec.
+
+Usage: python -m pkgpanda.benchmarks.compression [--codecs=xz,zstd,...] [directory ...]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pkgpanda.util
+
+
+def find_tarballs(directories):
+    tarballs = []
+    for directory in directories:
+        for root, _, names in os.walk(directory):
+            tarballs += [os.path.join(root, name) for name in names if name.endswith('.tar.xz')]
+    return sorted(tarballs)
+
+
+def timed(fn):
+    start = time.monotonic()
+    fn()
+    return time.monotonic() - start
+
+
+def run(tarballs, codecs, work_dir):
+    totals = {codec: [0.0, 0.0, 0] for codec in codecs}
+    for tarball in tarballs:
+        contents = os.path.join(work_dir, 'contents')
+        pkgpanda.util.extract_tarball(tarball, contents)
+        print(os.path.basename(tarball))
+        for codec in codecs:
+            packed = os.path.join(work_dir, 'packed.tar.xz')
+            unpacked = os.path.join(work_dir, 'unpacked')
+            pack_time = timed(lambda: pkgpanda.util.make_tar(packed, contents, codec))
+            unpack_time = timed(lambda: pkgpanda.util.extract_tarball(packed, unpacked))
+            size = os.path.getsize(packed)
+            print("  {:<10} pack {:8.2f}s  unpack {:8.2f}s  {:10.1f} MiB".format(
+                codec, pack_time, unpack_time, size / 2**20))
+            total = totals[codec]
+            total[0] += pack_time
+            total[1] += unpack_time
+            total[2] += size
+            os.remove(packed)
+            shutil.rmtree(unpacked)
+        shutil.rmtree(contents)
+
+    print("Total over {} packages".format(len(tarballs)))
+    for codec in codecs:
+        pack_time, unpack_time, size = totals[codec]
+        print("  {:<10} pack {:8.2f}s  unpack {:8.2f}s  {:10.1f} MiB".format(
+            codec, pack_time, unpack_time, size / 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directories', nargs='*', default=['packages/cache/packages'],
+                        help="Directories to search for package tarballs")
+    parser.add_argument('--codecs', default='xz,zstd',
+                        help="Comma separated codecs to compare, as accepted by mkpanda --compression")
+    options = parser.parse_args()
+
+    codecs = options.codecs.split(',')
+    for codec in codecs:
+        pkgpanda.util.get_compress_program(codec)
+
+    tarballs = find_tarballs(options.directories)
+    if not tarballs:
+        parser.error("No package tarballs found in {}. Build the tree first.".format(', '.join(options.directories)))
+
+    with tempfile.TemporaryDirectory(prefix='pkgpanda-compression-bench') as work_dir:
+        run(tarballs, codecs, work_dir)
+
+
+if __name__ == '__main__':
+    main()
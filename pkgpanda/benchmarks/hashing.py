@@ -0,0 +1,86 @@
+"""Compare file hashing throughput of pkgpanda.util against the original 4 KiB, one file at a time hasher.
+
+Usage: python -m pkgpanda.benchmarks.hashing [--files=N] [--size=BYTES] [--workers=N] [directory]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import pkgpanda.util
+
+
+def sha1_serial_4k(filename):
+    """The original pkgpanda.util.sha1 implementation."""
+    hasher = hashlib.sha1()
+
+    with open(filename, 'rb') as fh:
+        while 1:
+            buf = fh.read(4096)
+            if not buf:
+                break
+            hasher.update(buf)
+
+    return hasher.hexdigest()
+
+
+def make_files(directory, count, size):
+    filenames = []
+    for i in range(count):
+        filename = os.path.join(directory, str(i))
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(size))
+        filenames.append(filename)
+    return filenames
+
+
+def list_files(directory):
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def timed(name, total_bytes, fn):
+    start = time.monotonic()
+    result = fn()
+    elapsed = time.monotonic() - start
+    print("{:<36} {:8.3f}s {:10.1f} MiB/s".format(name, elapsed, total_bytes / elapsed / 2**20))
+    return result
+
+
+def run(filenames, workers):
+    total_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    print("Hashing {} files, {:.1f} MiB".format(len(filenames), total_bytes / 2**20))
+
+    # Warm the page cache so the first run isn't penalized for disk reads.
+    for filename in filenames:
+        sha1_serial_4k(filename)
+
+    original = timed("original (4 KiB, serial)", total_bytes,
+                     lambda: {filename: sha1_serial_4k(filename) for filename in filenames})
+    large = timed("sha1 (large buffer, serial)", total_bytes,
+                  lambda: {filename: pkgpanda.util.sha1(filename) for filename in filenames})
+    parallel = timed("sha1_files (large buffer, threads)", total_bytes,
+                     lambda: pkgpanda.util.sha1_files(filenames, workers))
+    assert original == large == parallel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', nargs='?',
+                        help="Hash every file in this directory instead of generating synthetic files")
+    parser.add_argument('--files', type=int, default=64, help="Number of synthetic files to generate")
+    parser.add_argument('--size', type=int, default=16 * 2**20, help="Size of each synthetic file in bytes")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Threads used by pkgpanda.util.sha1_files. Defaults to the number of CPUs")
+    options = parser.parse_args()
+
+    if options.directory:
+        run(list_files(options.directory), options.workers)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='pkgpanda-hash-bench') as directory:
+        run(make_files(directory, options.files, options.size), options.workers)
+
+
+if __name__ == '__main__':
+    main()
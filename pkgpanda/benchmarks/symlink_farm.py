@@ -0,0 +1,151 @@
+"""Compare building the active symlink farm with the original recursive symlink_tree against SymlinkFarm.
+
+Builds a synthetic repository of packages with overlapping bin, lib, etc and
+include folders (plus role specific ones), then times:
+
+  - symlinking every package with the original listdir based symlink_tree
+  - the same with SymlinkFarm
+  - a full Install.activate, and an incremental one upgrading one package
+
+Usage: python -m pkgpanda.benchmarks.symlink_farm [--packages=N] [--files=N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from pkgpanda import ConflictingFile, Install, Repository, SymlinkFarm
+from pkgpanda.exceptions import ValidationError
+
+well_known_dirs = ['bin', 'etc', 'include', 'lib']
+roles = ['master']
+
+
+def symlink_tree_listdir(src, dest):
+    """The original pkgpanda.symlink_tree implementation."""
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            if os.path.exists(dest_path):
+                if not os.path.isdir(dest_path) and not os.path.islink(dest_path):
+                    raise ValidationError(
+                        "Can't merge a file `{0}` and directory (or symlink) `{1}` with the same name."
+                        .format(src_path, dest_path))
+            else:
+                os.makedirs(dest_path)
+
+            symlink_tree_listdir(src_path, dest_path)
+        else:
+            try:
+                os.symlink(src_path, dest_path)
+            except FileNotFoundError as ex:
+                raise ConflictingFile(src_path, dest_path, ex) from ex
+
+
+def write_file(path, contents=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def make_package(repository, name, version, files):
+    """Write a package with about `files` files spread over the well known folders."""
+    path = os.path.join(repository, '{}--{}'.format(name, version))
+    write_file(os.path.join(path, 'pkginfo.json'), '{}')
+    per_dir = max(1, files // 6)
+    for i in range(per_dir):
+        write_file(os.path.join(path, 'bin', '{}-{}'.format(name, i)))
+        write_file(os.path.join(path, 'lib', 'lib{}-{}.so'.format(name, i)))
+        # Folders shared by every package, a few levels deep.
+        write_file(os.path.join(path, 'lib', 'python3.5', 'site-packages', name, '{}.py'.format(i)))
+        write_file(os.path.join(path, 'include', name, '{}.h'.format(i)))
+        write_file(os.path.join(path, 'etc', name, '{}.conf'.format(i)))
+        write_file(os.path.join(path, 'etc_master', name + '-master', '{}.conf'.format(i)))
+    return '{}--{}'.format(name, version)
+
+
+def make_repository(directory, packages, files):
+    repository = os.path.join(directory, 'repository')
+    ids = [make_package(repository, 'package{}'.format(i), '1', files) for i in range(packages)]
+    # Later versions of the first package, to upgrade to.
+    upgrades = [make_package(repository, 'package0', str(version), files) for version in (2, 3)]
+    write_file(os.path.join(directory, 'config', 'roles', roles[0]))
+    return repository, ids, upgrades
+
+
+def timed(name, fn):
+    start = time.monotonic()
+    fn()
+    elapsed = time.monotonic() - start
+    print("{:<40} {:8.3f}s".format(name, elapsed))
+
+
+def package_dirs(repository, ids):
+    for pkg_id in ids:
+        for dir_name in well_known_dirs:
+            for pkg_dir_name in [dir_name] + ['{}_{}'.format(dir_name, role) for role in roles]:
+                pkg_dir = os.path.join(repository, pkg_id, pkg_dir_name)
+                if os.path.isdir(pkg_dir):
+                    yield pkg_dir, dir_name
+
+
+def make_dests(directory):
+    for dir_name in well_known_dirs:
+        os.makedirs(os.path.join(directory, dir_name))
+
+
+def run(directory, packages, files):
+    repository, ids, upgrades = make_repository(directory, packages, files)
+    symlinks = sum(len(names) for pkg_id in ids for _, _, names in os.walk(os.path.join(repository, pkg_id)))
+    print("{} packages, {} files".format(len(ids), symlinks))
+
+    listdir_dest = os.path.join(directory, 'listdir')
+    make_dests(listdir_dest)
+
+    def listdir():
+        for pkg_dir, dir_name in package_dirs(repository, ids):
+            symlink_tree_listdir(pkg_dir, os.path.join(listdir_dest, dir_name))
+    timed("original symlink_tree", listdir)
+
+    farm_dest = os.path.join(directory, 'farm')
+    make_dests(farm_dest)
+
+    def farm():
+        farm = SymlinkFarm()
+        for pkg_dir, dir_name in package_dirs(repository, ids):
+            farm.add_tree(pkg_dir, os.path.join(farm_dest, dir_name))
+        farm.write()
+    timed("SymlinkFarm", farm)
+
+    def make_install(name):
+        return Install(os.path.join(directory, name), os.path.join(directory, 'config'), True, False, False,
+                       fake_path=True, skip_systemd_dirs=True)
+
+    repo = Repository(repository)
+    full = make_install('full')
+    incremental = make_install('incremental')
+    sets = [ids, [upgrades[0]] + ids[1:], [upgrades[1]] + ids[1:]]
+    for install in (full, incremental):
+        for package_ids in sets[:2]:
+            install.activate(repo.load_packages(package_ids))
+
+    timed("Install.activate", lambda: full.activate(repo.load_packages(sets[2])))
+    timed("Install.activate upgrading one package",
+          lambda: incremental.activate(repo.load_packages(sets[2]), incremental=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--packages', type=int, default=100, help="Number of synthetic packages")
+    parser.add_argument('--files', type=int, default=600, help="Number of files in each synthetic package")
+    parser.add_argument('--directory', default=None,
+                        help="Where to build the synthetic repository. Defaults to a temporary directory")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='pkgpanda-symlink-bench', dir=options.directory) as directory:
+        run(directory, options.packages, options.files)
+
+
+if __name__ == '__main__':
+    main()
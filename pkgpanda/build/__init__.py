@@ -1,27 +1,36 @@
+import collections.abc
+import concurrent.futures
 import copy
 import json
 import multiprocessing
+import os
 import os.path
 import random
 import shutil
 import string
+import sys
 import tempfile
-from contextlib import contextmanager
+import time
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from os import chdir, getcwd, mkdir
 from os.path import exists
-from subprocess import CalledProcessError, check_call, check_output
+from stat import S_ISDIR
+from subprocess import CalledProcessError, check_call, check_output, DEVNULL
+
+import requests
 
 import pkgpanda.build.constants
 import pkgpanda.build.src_fetchers
+import pkgpanda.build.timing
 from pkgpanda import expand_require as expand_require_exceptions
 from pkgpanda import Install, PackageId, Repository
-from pkgpanda.actions import add_package_file
+from pkgpanda.build.timing import timer
 from pkgpanda.constants import RESERVED_UNIT_NAMES
 from pkgpanda.exceptions import FetchError, PackageError, ValidationError
 from pkgpanda.util import (check_forbidden_services, download_atomic,
-                           hash_checkout, load_json, load_string, logger,
-                           make_file, make_tar, rewrite_symlinks, write_json,
-                           write_string)
+                           extract_tarball, file_lock, hash_checkout,
+                           load_json, load_string, logger, make_file, make_tar,
+                           rewrite_symlinks, write_json, write_string)
 
 
 class BuildError(Exception):
@@ -41,13 +50,8 @@ class DockerCmd:
         self.environment = dict()
         self.container = str()
 
-    def run(self, name, cmd):
-        container_name = "{}-{}".format(
-            name, ''.join(
-                random.choice(string.ascii_lowercase) for _ in range(10)
-            )
-        )
-        docker = ["docker", "run", "--name={}".format(container_name)]
+    def _run_args(self, container_name):
+        docker = ["--name={}".format(container_name)]
         for host_path, container_path in self.volumes.items():
             docker += ["-v", "{0}:{1}".format(host_path, container_path)]
 
@@ -55,10 +59,41 @@ class DockerCmd:
             docker += ["-e", "{0}={1}".format(k, v)]
 
         docker.append(self.container)
-        docker += cmd
-        check_call(docker)
+        return docker
+
+    @staticmethod
+    def _container_name(name):
+        return "{}-{}".format(
+            name, ''.join(
+                random.choice(string.ascii_lowercase) for _ in range(10)
+            )
+        )
+
+    def run(self, name, cmd):
+        container_name = DockerCmd._container_name(name)
+        check_call(["docker", "run"] + self._run_args(container_name) + cmd)
         DockerCmd.clean(container_name)
 
+    def start(self, name):
+        """Start a container which stays up doing nothing so commands can be exec'd in it.
+
+        Returns the name of the container, which must be removed with
+        DockerCmd.remove() once done with.
+        """
+        container_name = DockerCmd._container_name(name)
+        check_call(["docker", "run", "-d"] + self._run_args(container_name) + ["sleep", "infinity"],
+                   stdout=DEVNULL)
+        return container_name
+
+    @staticmethod
+    def exec(container_name, cmd):
+        check_call(["docker", "exec", container_name] + cmd)
+
+    @staticmethod
+    def remove(name):
+        """Stops and cleans up the specified container"""
+        check_call(["docker", "rm", "-f", "-v", name], stdout=DEVNULL)
+
     @staticmethod
     def clean(name):
         """Cleans up the specified container"""
@@ -238,15 +273,87 @@ class PackageSet:
                                  "but is excluded according to the treeinfo.json.".format(package_name))
 
 
+class Buildinfos(collections.abc.Mapping):
+    """Mapping from (name, variant) to buildinfo, loading each buildinfo file on first access."""
+
+    def __init__(self):
+        self._package_folders = dict()
+        self._buildinfos = dict()
+
+    def add(self, pkg_tuple, package_folder):
+        self._package_folders[pkg_tuple] = package_folder
+
+    def reload(self, pkg_tuple):
+        """Forget the loaded buildinfo of pkg_tuple so it is read again on next access."""
+        self._buildinfos.pop(pkg_tuple, None)
+
+    def __getitem__(self, pkg_tuple):
+        if pkg_tuple not in self._buildinfos:
+            self._buildinfos[pkg_tuple] = load_buildinfo(self._package_folders[pkg_tuple], pkg_tuple[1])
+        return self._buildinfos[pkg_tuple]
+
+    def __iter__(self):
+        return iter(self._package_folders)
+
+    def __len__(self):
+        return len(self._package_folders)
+
+
+class PackageVariants(collections.abc.Mapping):
+    """Mapping from variant to buildinfo for the variants of one package in a Buildinfos."""
+
+    def __init__(self, buildinfos, name):
+        self._buildinfos = buildinfos
+        self._name = name
+        self._variants = list()
+
+    def add(self, variant):
+        self._variants.append(variant)
+
+    def __getitem__(self, variant):
+        if variant not in self._variants:
+            raise KeyError(variant)
+        return self._buildinfos[(self._name, variant)]
+
+    def __iter__(self):
+        return iter(self._variants)
+
+    def __len__(self):
+        return len(self._variants)
+
+
+# Bumped whenever the format of cache/package_index.json changes.
+package_index_version = 1
+
+# Number of concurrent requests made to a PackageStore's repository_url.
+remote_fetch_jobs = 16
+
+# Partial downloads (see download_atomic) untouched for this many seconds are
+# no longer being written to and get removed by gc_cache().
+partial_download_max_age = 60 * 60
+
+
 class PackageStore:
 
-    def __init__(self, packages_dir, repository_url):
+    def __init__(self, packages_dir, repository_url, compression='xz', cache_storage=None, cache_storage_prefix=''):
         self._builders = {}
+        self._compression = compression
+        self._cache_storage = cache_storage
+        self._cache_storage_prefix = cache_storage_prefix
         self._repository_url = repository_url.rstrip('/') if repository_url is not None else None
         self._packages_dir = packages_dir.rstrip('/')
+        self._hash_cache = None
+        self._extracted_repository = None
+        self._session = None
+        # Ids of packages and bootstraps known to not be in the repository_url.
+        self._remote_misses = set()
+        # Ids of docker images, looked up once per PackageStore.
+        self._docker_ids = dict()
+        # Container used to clean up builds, see builder_session().
+        self._cleaner_container = None
 
         # Load all possible packages, making a dictionary from (name, variant) -> buildinfo
-        self._packages = dict()
+        self._packages = Buildinfos()
         self._packages_by_name = dict()
         self._package_folders = dict()
 
@@ -256,20 +363,21 @@ class PackageStore:
         self._upstream_dir = self._packages_dir + "/cache/upstream/checkout"
         self._upstream = None
         self._upstream_package_dir = self._upstream_dir + "/packages"
-        # TODO(cmaloney): Make it so the upstream directory can be kept around
-        check_call(['rm', '-rf', self._upstream_dir])
         upstream_config = self._packages_dir + '/upstream.json'
         if os.path.exists(upstream_config):
             try:
+                upstream_src_info = load_optional_json(upstream_config)
                 self._upstream = get_src_fetcher(
-                    load_optional_json(upstream_config),
-                    self._packages_dir + '/cache/upstream',
+                    copy.deepcopy(upstream_src_info),
+                    self.get_source_cache_dir(),
                     packages_dir)
-                self._upstream.checkout_to(self._upstream_dir)
+                self._checkout_upstream(upstream_src_info)
                 if os.path.exists(self._upstream_package_dir + "/upstream.json"):
                     raise Exception("Support for upstreams which have upstreams is not currently implemented")
             except Exception as ex:
                 raise BuildError("Error fetching upstream: {}".format(ex))
+        else:
+            check_call(['rm', '-rf', self._upstream_dir, self._upstream_dir + '.id'])
 
         # Iterate through the packages directory finding all packages. Note this package dir comes
         # first, then we ignore duplicate definitions of the same package
@@ -277,12 +385,20 @@ class PackageStore:
         if self._upstream:
             package_dirs.append(self._upstream_package_dir)
 
+        # Which variants each package folder has is kept in an index, only
+        # listing folders again when their mtime changed. buildinfo files are
+        # parsed on first use.
+        index_filename = self._packages_dir + '/cache/package_index.json'
+        index = self._load_package_index(index_filename)
+        new_index = dict()
+        now = time.time()
         for directory in package_dirs:
             for name in os.listdir(directory):
                 package_folder = directory + '/' + name
 
                 # Ignore files / non-directories
-                if not os.path.isdir(package_folder):
+                folder_stat = os.stat(package_folder)
+                if not S_ISDIR(folder_stat.st_mode):
                     continue
 
                 # If we've already found this package, it means 1+ versions have been defined. Use
@@ -290,36 +406,102 @@ class PackageStore:
                 if name in self._packages_by_name:
                     continue
 
-                builder_folder = os.path.join(directory, name, 'docker')
-                if os.path.exists(builder_folder):
-                    self._builders[name] = builder_folder
+                entry = index.get(package_folder)
+                if entry is None or entry['mtime_ns'] != folder_stat.st_mtime_ns:
+                    entry = {
+                        'mtime_ns': folder_stat.st_mtime_ns,
+                        'builder': os.path.exists(package_folder + '/docker'),
+                        'variants': sorted(pkgpanda.util.variant_str(variant) for variant in
+                                           get_variants_from_filesystem(package_folder, 'buildinfo.json'))}
+                # Folders which aren't packages (such as cache, which holds the
+                # index itself) aren't indexed, so changes to them never cause
+                # the index to be rewritten.
+                if not entry['builder'] and not entry['variants']:
+                    continue
+
+                # Folders changed within the mtime granularity of the filesystem
+                # could change again without their mtime changing, so they
+                # aren't indexed until later.
+                if now - folder_stat.st_mtime > HashCache.RACY_SECONDS:
+                    new_index[package_folder] = entry
 
-                # Search the directory for buildinfo.json files, record the variants
-                for variant in get_variants_from_filesystem(package_folder, 'buildinfo.json'):
+                if entry['builder']:
+                    self._builders[name] = package_folder + '/docker'
+
+                # Record the variants found in the directory
+                for variant in map(pkgpanda.util.variant_object, entry['variants']):
                     # Only adding the default dictionary once we know we have a package.
-                    self._packages_by_name.setdefault(name, dict())
+                    self._packages_by_name.setdefault(name, PackageVariants(self._packages, name))
 
-                    buildinfo = load_buildinfo(package_folder, variant)
-                    self._packages[(name, variant)] = buildinfo
-                    self._packages_by_name[name][variant] = buildinfo
+                    self._packages.add((name, variant), package_folder)
+                    self._packages_by_name[name].add(variant)
 
                     if name in self._package_folders:
                         assert self._package_folders[name] == package_folder
                     else:
                         self._package_folders[name] = package_folder
 
+        if new_index != index:
+            self._write_package_index(index_filename, new_index)
+
+    @staticmethod
+    def _load_package_index(filename):
+        try:
+            index = load_json(filename)
+        except (OSError, ValueError):
+            return dict()
+        if not isinstance(index, dict) or index.get('version') != package_index_version:
+            return dict()
+        return index['folders']
+
+    @staticmethod
+    def _write_package_index(filename, folders):
+        # Written to a temporary file and renamed so concurrent readers never
+        # see a partial index. Failing to write it only costs speed.
+        try:
+            check_call(['mkdir', '-p', os.path.dirname(filename)])
+            temp_filename = '{}.tmp-{}'.format(filename, os.getpid())
+            write_json(temp_filename, {'version': package_index_version, 'folders': folders})
+            os.rename(temp_filename, filename)
+        except (OSError, CalledProcessError) as ex:
+            print("WARNING: Unable to write package index {}: {}".format(filename, ex))
+
+    def _checkout_upstream(self, src_info):
+        """Check out the upstream into cache/upstream/checkout, unless it already is.
+
+        The checkout is kept between runs along with the id of what is in it,
+        written only once the checkout is complete, so it is only redone when
+        upstream.json or the source it points at change.
+        """
+        id_filename = self._upstream_dir + '.id'
+        upstream_id = {'src_info': src_info, 'id': self._upstream.get_id()}
+        check_call(['mkdir', '-p', os.path.dirname(self._upstream_dir)])
+        with file_lock(self._upstream_dir + '.lock'):
+            if os.path.isdir(self._upstream_dir) and os.path.exists(id_filename):
+                if load_optional_json(id_filename) == upstream_id:
+                    return
+            check_call(['rm', '-rf', self._upstream_dir, id_filename])
+            self._upstream.checkout_to(self._upstream_dir)
+            write_json(id_filename, upstream_id)
+
     def get_package_folder(self, name):
         return self._package_folders[name]
 
     def get_bootstrap_cache_dir(self):
         return self._packages_dir + "/cache/bootstrap"
 
+    def get_source_cache_dir(self):
+        return self._packages_dir + "/cache/sources"
+
     def get_complete_cache_dir(self):
         return self._packages_dir + "/cache/complete"
 
     def get_buildinfo(self, name, variant):
         return self._packages[(name, variant)]
 
+    def reload_buildinfo(self, name, variant):
+        self._packages.reload((name, variant))
+
     def get_last_complete_set(self):
         def get_last_complete(variant):
             complete_latest = (
@@ -338,6 +520,9 @@ class PackageStore:
     def get_last_build_filename(self, name, variant):
         return self.get_package_cache_folder(name) + '/{}latest'.format(pkgpanda.util.variant_prefix(variant))
 
+    def get_build_log_filename(self, name, variant):
+        return self.get_package_cache_folder(name) + '/{}build.log'.format(pkgpanda.util.variant_prefix(variant))
+
     def get_package_path(self, pkg_id):
         return self.get_package_cache_folder(pkg_id.name) + '/{}.tar.xz'.format(pkg_id)
 
@@ -355,6 +540,96 @@ class PackageStore:
     def get_all_package_sets(self):
         return [self.get_package_set(variant) for variant in sorted(self.list_trees(), key=pkgpanda.util.variant_str)]
 
+    @property
+    def hash_cache(self):
+        if self._hash_cache is None:
+            self._hash_cache = HashCache(self._packages_dir + '/cache/file_hashes.json')
+        return self._hash_cache
+
+    @property
+    def extracted_repository(self):
+        """Repository of extracted package tarballs shared by all builds.
+
+        Entries are keyed by package id, so they never need to be invalidated,
+        and are only ever mounted read-only into build containers.
+        """
+        if self._extracted_repository is None:
+            path = self._packages_dir + '/cache/extracted'
+            check_call(['mkdir', '-p', path])
+            self._extracted_repository = Repository(path)
+        return self._extracted_repository
+
+    def extract_package(self, pkg_id: PackageId):
+        """Extract the built tarball of pkg_id into the extracted_repository if it isn't there already.
+
+        Returns the path of the extracted package.
+        """
+        repository = self.extracted_repository
+        pkg_id_str = str(pkg_id)
+
+        def fetch(_, target):
+            extract_tarball(self.get_package_path(pkg_id), target)
+
+        # Parallel builds commonly share dependencies. The lock makes sure only
+        # one of them extracts a given package and the rest reuse it. Locks
+        # live outside the repository so they aren't listed as packages.
+        lock_dir = self._packages_dir + '/cache/extracted.locks'
+        check_call(['mkdir', '-p', lock_dir])
+        with file_lock(lock_dir + '/' + pkg_id_str):
+            repository.add(fetch, pkg_id_str, warn_added=False)
+            # Mark both as recently used for gc_cache().
+            os.utime(self.get_package_path(pkg_id))
+            os.utime(repository.package_path(pkg_id_str))
+        return repository.package_path(pkg_id_str)
+
+    def get_docker_id(self, docker_name):
+        """Return the id of the docker image docker_name, pulling it if needed.
+
+        Builder images don't change during a build, so each is only looked up once.
+        """
+        if docker_name not in self._docker_ids:
+            self._docker_ids[docker_name] = get_or_pull_docker_id(docker_name)
+        return self._docker_ids[docker_name]
+
+    @contextmanager
+    def builder_session(self):
+        """Keep a container running for the duration of the context which builds are cleaned up with.
+
+        Removing the root-owned src/ and result/ of a build needs docker.
+        Exec'ing into one long-lived container is much faster than starting a
+        new container before and after every build.
+        """
+        cmd = DockerCmd()
+        cmd.volumes = {self._package_cache_dir: "/pkg/:rw"}
+        cmd.container = "ubuntu:14.04.4"
+        check_call(['mkdir', '-p', self._package_cache_dir])
+        self._cleaner_container = cmd.start("package-cleaner")
+        try:
+            yield
+        finally:
+            DockerCmd.remove(self._cleaner_container)
+            self._cleaner_container = None
+
+    def clean_build(self, name):
+        """Remove src/ and result/ of the last build of package name."""
+        if self._cleaner_container is not None:
+            DockerCmd.exec(self._cleaner_container, [
+                "rm", "-rf", "/pkg/{}/src".format(name), "/pkg/{}/result".format(name)])
+            return
+
+        # Run a docker container to remove src/ and result/
+        cmd = DockerCmd()
+        cmd.volumes = {
+            self.get_package_cache_folder(name): "/pkg/:rw",
+        }
+        cmd.container = "ubuntu:14.04.4"
+        cmd.run("package-cleaner", ["rm", "-rf", "/pkg/src", "/pkg/result"])
+
+    @property
+    def compression(self):
+        """Codec new package and bootstrap tarballs are compressed with. See pkgpanda.util.make_tar."""
+        return self._compression
+
     @property
     def packages(self):
         return self._packages
@@ -371,10 +646,36 @@ class PackageStore:
     def packages_dir(self):
         return self._packages_dir
 
+    @property
+    def repository_url(self):
+        return self._repository_url
+
+    def __getstate__(self):
+        # The HTTP session (and its open connections) stays with the process which made it.
+        state = self.__dict__.copy()
+        state['_session'] = None
+        # Storage provider clients generally can't be pickled. Publishing is
+        # done by the process which owns the PackageStore.
+        state['_cache_storage'] = None
+        return state
+
+    @property
+    def session(self):
+        """requests.Session used for all requests to the repository_url, so connections get reused."""
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=remote_fetch_jobs)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        return self._session
+
     def try_fetch_by_id(self, pkg_id: PackageId):
         if self._repository_url is None:
             return False
 
+        if str(pkg_id) in self._remote_misses:
+            return False
+
         # TODO(cmaloney): Use storage providers to download instead of open coding.
         pkg_path = "{}.tar.xz".format(pkg_id)
         url = self._repository_url + '/packages/{0}/{1}'.format(pkg_id.name, pkg_path)
@@ -382,16 +683,20 @@ class PackageStore:
             directory = self.get_package_cache_folder(pkg_id.name)
             # TODO(cmaloney): Move to some sort of logging mechanism?
             print("Attempting to download", pkg_id, "from", url, "to", directory)
-            download_atomic(directory + '/' + pkg_path, url, directory)
+            download_atomic(directory + '/' + pkg_path, url, directory, self.session)
             assert os.path.exists(directory + '/' + pkg_path)
             return directory + '/' + pkg_path
         except FetchError:
+            self._remote_misses.add(str(pkg_id))
             return False
 
     def try_fetch_bootstrap_and_active(self, bootstrap_id):
         if self._repository_url is None:
             return False
 
+        if bootstrap_id in self._remote_misses:
+            return False
+
         try:
             bootstrap_name = '{}.bootstrap.tar.xz'.format(bootstrap_id)
             active_name = '{}.active.json'.format(bootstrap_id)
@@ -400,14 +705,113 @@ class PackageStore:
             active_url = self._repository_url + '/bootstrap/' + active_name
             print("Attempting to download", bootstrap_name, "from", bootstrap_url)
             dest_dir = self.get_bootstrap_cache_dir()
+            check_call(['mkdir', '-p', dest_dir])
             # Normalize to no trailing slash for repository_url
-            download_atomic(dest_dir + '/' + bootstrap_name, bootstrap_url, self._packages_dir)
+            download_atomic(dest_dir + '/' + bootstrap_name, bootstrap_url, self._packages_dir, self.session)
             print("Attempting to download", active_name, "from", active_url)
-            download_atomic(dest_dir + '/' + active_name, active_url, self._packages_dir)
+            download_atomic(dest_dir + '/' + active_name, active_url, self._packages_dir, self.session)
             return True
         except FetchError:
+            self._remote_misses.add(bootstrap_id)
+            return False
+
+    def _publish(self, path, local_path, overwrite=False):
+        full_path = self._cache_storage_prefix + path
+        try:
+            if not overwrite and self._cache_storage.exists(full_path):
+                print("Not uploading {}, it is already in the build cache".format(full_path))
+                return
+            print("Uploading {} to the build cache as {}".format(local_path, full_path))
+            self._cache_storage.upload(full_path, local_path=local_path)
+        except Exception as ex:
+            # The build itself succeeded, other builds will just have to build it too.
+            logger.warning("Unable to upload {} to the build cache: {}".format(full_path, ex))
+
+    def publish_package(self, name, variant):
+        """Upload the last build of a package to the cache_storage so other builders can download it.
+
+        cache_storage is a release.storage provider whose contents under
+        cache_storage_prefix are served at repository_url. The tarball is
+        uploaded (unless already there) before the last_build file which points
+        at it, so readers never see a last_build for a package which isn't
+        there yet. Providers must make each individual upload atomic.
+        """
+        if self._cache_storage is None:
+            return
+        last_build = self.get_last_build_filename(name, variant)
+        pkg_id = PackageId(load_string(last_build))
+        self._publish('packages/{}/{}.tar.xz'.format(pkg_id.name, pkg_id), self.get_package_path(pkg_id))
+        self._publish(
+            'packages/{}/{}'.format(name, os.path.basename(last_build)),
+            last_build,
+            overwrite=True)
+
+    def publish_bootstrap(self, variant, bootstrap_id):
+        """Upload a bootstrap tarball, its active.json and bootstrap.latest to the cache_storage.
+
+        See publish_package.
+        """
+        if self._cache_storage is None:
+            return
+        bootstrap_dir = self.get_bootstrap_cache_dir()
+        for filename in [bootstrap_id + '.bootstrap.tar.xz', bootstrap_id + '.active.json']:
+            self._publish('bootstrap/' + filename, bootstrap_dir + '/' + filename)
+        latest_name = '{}bootstrap.latest'.format(pkgpanda.util.variant_prefix(variant))
+        self._publish('bootstrap/' + latest_name, bootstrap_dir + '/' + latest_name, overwrite=True)
+
+    def _remote_exists(self, path):
+        url = self._repository_url + '/' + path
+        if url.startswith('file://'):
+            return os.path.exists(url[len('file://'):])
+        try:
+            r = self.session.head(url, allow_redirects=True, timeout=pkgpanda.util.download_timeout)
+            return r.status_code == 200
+        except requests.exceptions.RequestException:
             return False
 
+    def find_remote(self, pkg_ids=(), bootstrap_ids=(), jobs=None):
+        """Return the subset of pkg_ids and bootstrap_ids available from the repository_url.
+
+        Only checks for existence, nothing is downloaded. Up to jobs (default
+        remote_fetch_jobs) requests are made at the same time.
+        """
+        if self._repository_url is None:
+            return set()
+
+        paths = dict()
+        for pkg_id in pkg_ids:
+            paths['packages/{}/{}.tar.xz'.format(pkg_id.name, pkg_id)] = str(pkg_id)
+        for bootstrap_id in bootstrap_ids:
+            paths['bootstrap/{}.bootstrap.tar.xz'.format(bootstrap_id)] = bootstrap_id
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or remote_fetch_jobs) as executor:
+            exists = dict(zip(paths, executor.map(self._remote_exists, paths)))
+        return {paths[path] for path in paths if exists[path]}
+
+    def try_fetch_many(self, pkg_ids, bootstrap_ids=(), jobs=None):
+        """Download every package in pkg_ids and bootstrap in bootstrap_ids which isn't in the cache yet.
+
+        Up to jobs (default remote_fetch_jobs) downloads run at the same time.
+        Ids not found in the repository_url are remembered so later
+        try_fetch_by_id / try_fetch_bootstrap_and_active calls for them return
+        False right away. Returns the set of ids which were downloaded.
+        """
+        if self._repository_url is None:
+            return set()
+
+        fetched = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or remote_fetch_jobs) as executor:
+            futures = dict()
+            for pkg_id in pkg_ids:
+                if not os.path.exists(self.get_package_path(pkg_id)):
+                    futures[executor.submit(self.try_fetch_by_id, pkg_id)] = str(pkg_id)
+            for bootstrap_id in bootstrap_ids:
+                if not os.path.exists(self.get_bootstrap_cache_dir() + '/{}.bootstrap.tar.xz'.format(bootstrap_id)):
+                    futures[executor.submit(self.try_fetch_bootstrap_and_active, bootstrap_id)] = bootstrap_id
+            for future in concurrent.futures.as_completed(futures):
+                if future.result():
+                    fetched.add(futures[future])
+        return fetched
+
 
 def expand_require(require):
     try:
@@ -420,12 +824,91 @@ def get_docker_id(docker_name):
     return check_output(["docker", "inspect", "-f", "{{ .Id }}", docker_name]).decode('utf-8').strip()
 
 
-def hash_files_in_folder(directory):
+def get_or_pull_docker_id(docker_name):
+    try:
+        return get_docker_id(docker_name)
+    except CalledProcessError:
+        # docker pull the container and try again
+        check_call(['docker', 'pull', docker_name])
+        return get_docker_id(docker_name)
+
+
+class HashCache:
+    """Persistent cache of file sha1s keyed by (path, size, mtime_ns, inode).
+
+    Files whose stat information hasn't changed since they were last hashed
+    reuse the stored digest rather than being re-read. Files modified within
+    RACY_SECONDS of being hashed aren't stored, since a second write inside the
+    same mtime granularity wouldn't be noticed.
+    """
+
+    RACY_SECONDS = 2
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._entries = self._load()
+        self._dirty = False
+
+    def _load(self):
+        try:
+            entries = load_json(self._filename)
+        except (OSError, ValueError):
+            # Missing or corrupt manifest, start over. It is only a cache.
+            return dict()
+        if not isinstance(entries, dict):
+            return dict()
+        return entries
+
+    def sha1_files(self, paths):
+        """Return a dictionary from path to sha1 for every path in paths.
+
+        Files not in the cache are hashed concurrently.
+        """
+        result = dict()
+        misses = dict()
+        for path in paths:
+            abs_path = os.path.abspath(path)
+            stat = os.stat(abs_path)
+            key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+            entry = self._entries.get(abs_path)
+            if entry is not None and entry[:3] == key:
+                result[path] = entry[3]
+            else:
+                misses[abs_path] = (path, key, stat)
+
+        for abs_path, digest in pkgpanda.util.sha1_files(misses.keys()).items():
+            path, key, stat = misses[abs_path]
+            if time.time() - stat.st_mtime > self.RACY_SECONDS:
+                self._entries[abs_path] = key + [digest]
+                self._dirty = True
+            result[path] = digest
+
+        return result
+
+    def save(self):
+        """Write the manifest, merging in entries saved by others since it was loaded."""
+        if not self._dirty:
+            return
+        entries = self._load()
+        entries.update(self._entries)
+        self._entries = entries
+
+        check_call(['mkdir', '-p', os.path.dirname(self._filename)])
+        tmp_filename = '{}.tmp-{}'.format(self._filename, os.getpid())
+        write_json(tmp_filename, entries)
+        os.rename(tmp_filename, self._filename)
+        self._dirty = False
+
+
+def hash_files_in_folder(directory, hash_cache=None):
     """Given a relative path, hashes all files inside that folder and subfolders
 
     Returns a dictionary from filename to the hash of that file. If that whole
     dictionary is hashed, you get a hash of all the contents of the folder.
 
+    If a HashCache is given, unchanged files reuse their previously computed
+    hash and the cache is saved afterwards.
+
     This is split out from calculating the whole folder hash so that the
     behavior in different walking corner cases can be more easily tested.
     """
@@ -434,14 +917,16 @@ def hash_files_in_folder(directory):
         "Got path: {}".format(directory)
     directory = directory.rstrip('/')
     file_hash_dict = {}
+    # Map of path to the key it is stored under in file_hash_dict. All the
+    # files are hashed together at the end so they can be hashed concurrently.
+    files = {}
     # TODO(cmaloney): Disallow symlinks as they're hard to hash, people can symlink / copy in their
     # build steps if needed.
     for root, dirs, filenames in os.walk(directory):
         assert not root.startswith('/')
         for name in filenames:
             path = root + '/' + name
-            base = path[len(directory) + 1:]
-            file_hash_dict[base] = pkgpanda.util.sha1(path)
+            files[path] = path[len(directory) + 1:]
 
         # If the directory has files inside of it, then it'll be picked up implicitly. by the files
         # or folders inside of it. If it contains nothing, it wouldn't be picked up but the existence
@@ -453,6 +938,15 @@ def hash_files_in_folder(directory):
             if path:
                 file_hash_dict[root[len(directory) + 1:]] = ""
 
+    if hash_cache is None:
+        file_hashes = pkgpanda.util.sha1_files(files.keys())
+    else:
+        file_hashes = hash_cache.sha1_files(files.keys())
+        hash_cache.save()
+
+    for path, digest in file_hashes.items():
+        file_hash_dict[files[path]] = digest
+
     return file_hash_dict
 
 
@@ -464,16 +958,16 @@ def as_cwd(path):
     chdir(start_dir)
 
 
-def hash_folder_abs(directory, work_dir):
+def hash_folder_abs(directory, work_dir, hash_cache=None):
     assert directory.startswith(work_dir), "directory must be inside work_dir: {} {}".format(directory, work_dir)
     assert not work_dir[-1] == '/', "This code assumes no trailing slash on the work_dir"
 
     with as_cwd(work_dir):
-        return hash_folder(directory[len(work_dir) + 1:])
+        return hash_folder(directory[len(work_dir) + 1:], hash_cache)
 
 
-def hash_folder(directory):
-    return hash_checkout(hash_files_in_folder(directory))
+def hash_folder(directory, hash_cache=None):
+    return hash_checkout(hash_files_in_folder(directory, hash_cache))
 
 
 # Try to read json from the given file. If it is an empty file, then return an
@@ -543,6 +1037,7 @@ def make_bootstrap_tarball(package_store, packages, variant):
 
     if (os.path.exists(bootstrap_name)):
         print("Bootstrap already up to date, not recreating")
+        os.utime(bootstrap_name)
         return mark_latest()
 
     check_call(['mkdir', '-p', bootstrap_cache_dir])
@@ -565,13 +1060,14 @@ def make_bootstrap_tarball(package_store, packages, variant):
     repository = Repository(os.path.join(pkgpanda_root, "packages"))
 
     # Fetch all the packages to the root
-    for pkg_path in packages:
-        filename = os.path.basename(pkg_path)
-        pkg_id = filename[:-len(".tar.xz")]
+    with timer.phase('bootstrap extract'):
+        for pkg_path in packages:
+            filename = os.path.basename(pkg_path)
+            pkg_id = filename[:-len(".tar.xz")]
 
-        def local_fetcher(id, target):
-            shutil.unpack_archive(pkg_path, target, "gztar")
-        repository.add(local_fetcher, pkg_id, False)
+            def local_fetcher(id, target, pkg_path=pkg_path):
+                extract_tarball(pkg_path, target)
+            repository.add(local_fetcher, pkg_id, False)
 
     # Activate the packages inside the repository.
     # Do generate dcos.target.wants inside the root so that we don't
@@ -586,7 +1082,8 @@ def make_bootstrap_tarball(package_store, packages, variant):
         skip_systemd_dirs=True,
         manage_users=False,
         manage_state_dir=False)
-    install.activate(repository.load_packages(pkg_ids))
+    with timer.phase('bootstrap activate'):
+        install.activate(repository.load_packages(pkg_ids))
 
     # Mark the tarball as a bootstrap tarball/filesystem so that
     # dcos-setup.service will fire.
@@ -598,7 +1095,8 @@ def make_bootstrap_tarball(package_store, packages, variant):
     # Rewrite all the symlinks to point to /opt/mesosphere
     rewrite_symlinks(work_dir, work_dir, "/")
 
-    make_tar(bootstrap_name, pkgpanda_root)
+    with timer.phase('bootstrap make tar'):
+        make_tar(bootstrap_name, pkgpanda_root, package_store.compression)
 
     shutil.rmtree(work_dir)
 
@@ -609,31 +1107,382 @@ def make_bootstrap_tarball(package_store, packages, variant):
     return mark_latest()
 
 
-def build_tree_variants(package_store, mkbootstrap):
+def get_package_sources(name, buildinfo):
+    """Return the sources dictionary of a package, expanding single_source."""
+    if 'sources' in buildinfo:
+        if 'single_source' in buildinfo:
+            raise BuildError('Both sources and single_source cannot be specified at the same time')
+        return buildinfo['sources']
+    elif 'single_source' in buildinfo:
+        return {name: buildinfo['single_source']}
+    return dict()
+
+
+def prefetch_sources(package_store, build_order, jobs):
+    """Fetch the sources of every (name, variant) in build_order into the source cache.
+
+    Downloads run jobs at a time, and each download is verified against its
+    sha1, so the builds afterwards don't wait on the network.
+    """
+    fetchers = dict()
+    for name, variant in build_order:
+        buildinfo = package_store.get_buildinfo(name, variant)
+        for src_name, src_info in sorted(get_package_sources(name, buildinfo).items()):
+            # Sources shared by multiple packages / variants only need to be fetched once.
+            key = json.dumps(src_info, sort_keys=True)
+            if key in fetchers:
+                continue
+            fetchers[key] = (name, get_src_fetcher(
+                src_info,
+                package_store.get_source_cache_dir(),
+                package_store.get_package_folder(name)))
+
+    errors = []
+    with logger.scope("Prefetching {} sources".format(len(fetchers))):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(fetcher.fetch): (name, fetcher) for name, fetcher in fetchers.values()}
+            for future in concurrent.futures.as_completed(futures):
+                name, fetcher = futures[future]
+                try:
+                    future.result()
+                except Exception as ex:
+                    errors.append("{}: {}".format(name, ex))
+
+    if errors:
+        raise BuildError("Unable to prefetch sources:\n" + "\n".join(sorted(errors)))
+
+
+def get_referenced_ids(package_store):
+    """Return the ids of the packages and bootstraps referenced by the package cache.
+
+    These are the ones in any complete.latest.json, any bootstrap.latest (and
+    the packages active in it) and the last build of every package variant.
+    """
+    referenced = set()
+
+    complete_cache_dir = package_store.get_complete_cache_dir()
+    if os.path.exists(complete_cache_dir):
+        for filename in os.listdir(complete_cache_dir):
+            if filename.endswith('complete.latest.json'):
+                complete = load_json(complete_cache_dir + '/' + filename)
+                referenced.update(complete['packages'])
+                if complete.get('bootstrap'):
+                    referenced.add(complete['bootstrap'])
+
+    bootstrap_dir = package_store.get_bootstrap_cache_dir()
+    if os.path.exists(bootstrap_dir):
+        for filename in os.listdir(bootstrap_dir):
+            if filename.endswith('bootstrap.latest'):
+                bootstrap_id = load_string(bootstrap_dir + '/' + filename)
+                referenced.add(bootstrap_id)
+                active = bootstrap_dir + '/' + bootstrap_id + '.active.json'
+                if os.path.exists(active):
+                    referenced.update(load_json(active))
+
+    package_cache_dir = package_store.packages_dir + '/cache/packages'
+    if os.path.exists(package_cache_dir):
+        for name in os.listdir(package_cache_dir):
+            for filename in os.listdir(package_cache_dir + '/' + name):
+                if filename.endswith('latest'):
+                    referenced.add(load_string(package_cache_dir + '/' + name + '/' + filename))
+
+    return referenced
+
+
+def _get_size(path):
+    if not os.path.isdir(path):
+        return os.lstat(path).st_size
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            size += os.lstat(os.path.join(root, filename)).st_size
+    return size
+
+
+def list_cache_entries(package_store):
+    """Return (last use time, size in bytes, id, paths) of every built package and bootstrap in the cache.
+
+    Package tarballs, packages extracted for use as build dependencies and
+    bootstrap tarballs (with their active.json) are separate entries. The
+    list is sorted least recently used first.
+    """
+    entries = list()
+
+    def add_entry(artifact_id, paths):
+        entries.append((
+            max(os.stat(path).st_mtime for path in paths),
+            sum(_get_size(path) for path in paths),
+            artifact_id,
+            paths))
+
+    package_cache_dir = package_store.packages_dir + '/cache/packages'
+    if os.path.exists(package_cache_dir):
+        for name in os.listdir(package_cache_dir):
+            for filename in os.listdir(package_cache_dir + '/' + name):
+                if filename.endswith('.tar.xz') and PackageId.is_id(filename[:-len('.tar.xz')]):
+                    add_entry(filename[:-len('.tar.xz')], [package_cache_dir + '/' + name + '/' + filename])
+
+    extracted_dir = package_store.packages_dir + '/cache/extracted'
+    if os.path.exists(extracted_dir):
+        for pkg_id in os.listdir(extracted_dir):
+            if PackageId.is_id(pkg_id):
+                add_entry(pkg_id, [extracted_dir + '/' + pkg_id])
+
+    bootstrap_dir = package_store.get_bootstrap_cache_dir()
+    if os.path.exists(bootstrap_dir):
+        for filename in os.listdir(bootstrap_dir):
+            if filename.endswith('.bootstrap.tar.xz'):
+                bootstrap_id = filename[:-len('.bootstrap.tar.xz')]
+                paths = [bootstrap_dir + '/' + filename]
+                if os.path.exists(bootstrap_dir + '/' + bootstrap_id + '.active.json'):
+                    paths.append(bootstrap_dir + '/' + bootstrap_id + '.active.json')
+                add_entry(bootstrap_id, paths)
+
+    return sorted(entries, key=lambda entry: entry[:3])
+
+
+def list_partial_downloads(package_store):
+    """Return the paths of the partial downloads of packages and bootstraps left in the cache."""
+    directories = [package_store.get_bootstrap_cache_dir()]
+    package_cache_dir = package_store.packages_dir + '/cache/packages'
+    if os.path.exists(package_cache_dir):
+        directories += [package_cache_dir + '/' + name for name in os.listdir(package_cache_dir)]
+
+    paths = list()
+    for directory in directories:
+        if os.path.isdir(directory):
+            paths += sorted(directory + '/' + filename for filename in os.listdir(directory)
+                            if filename.endswith('.tmp'))
+    return paths
+
+
+def gc_cache(package_store, max_size):
+    """Remove least recently used packages and bootstraps until the cache is at most max_size bytes.
+
+    Nothing returned by get_referenced_ids() is ever removed, so the cache may
+    stay above max_size. Extracted packages in use by a build are skipped.
+    Partial downloads nothing has written to for partial_download_max_age
+    seconds are always removed. Returns the paths removed.
+    """
+    removed = list()
+    now = time.time()
+    for path in list_partial_downloads(package_store):
+        try:
+            if now - os.stat(path).st_mtime > partial_download_max_age:
+                os.remove(path)
+                removed.append(path)
+                # The validator download() keeps alongside to resume it.
+                if os.path.exists(path + '.validator'):
+                    os.remove(path + '.validator')
+                    removed.append(path + '.validator')
+        except FileNotFoundError:
+            continue
+        except OSError as ex:
+            print("WARNING: Unable to remove {}: {}".format(path, ex))
+
+    referenced = get_referenced_ids(package_store)
+    entries = list_cache_entries(package_store)
+    total = sum(size for _, size, _, _ in entries)
+    lock_dir = package_store.packages_dir + '/cache/extracted.locks'
+    for _, size, artifact_id, paths in entries:
+        if total <= max_size:
+            break
+        if artifact_id in referenced:
+            continue
+        try:
+            if os.path.isdir(paths[0]):
+                # Extracted package, only remove it if no build is using it.
+                check_call(['mkdir', '-p', lock_dir])
+                with file_lock(lock_dir + '/' + artifact_id, blocking=False):
+                    shutil.rmtree(paths[0])
+            else:
+                for path in paths:
+                    os.remove(path)
+        except BlockingIOError:
+            continue
+        except OSError as ex:
+            print("WARNING: Unable to remove {}: {}".format(paths[0], ex))
+            continue
+        total -= size
+        removed += paths
+    return removed
+
+
+class _UnknownId(Exception):
+    pass
+
+
+def get_package_ids(package_store, build_order, resolve_docker_id=None):
+    """Compute the PackageId every (name, variant) in build_order will be built as without building anything.
+
+    build_order must list every package after its dependencies. If
+    resolve_docker_id raises _UnknownId the id of that package (and everything
+    depending on it) is None.
+    """
+    pkg_ids = dict()
+
+    def resolve_dependency(name, variant):
+        if pkg_ids[(name, variant)] is None:
+            raise _UnknownId()
+        return str(pkg_ids[(name, variant)])
+
+    for name, variant in build_order:
+        try:
+            pkg_ids[(name, variant)] = describe_build(
+                package_store, name, variant, resolve_dependency, resolve_docker_id).pkg_id
+        except _UnknownId:
+            pkg_ids[(name, variant)] = None
+    return pkg_ids
+
+
+def try_fetch_tree(package_store, build_order, package_sets, mkbootstrap):
+    """Download every package (and bootstrap) of a tree build which is already in the repository_url.
+
+    All the package ids get computed up front so the repository can be checked
+    for all of them at once instead of one at a time as the build progresses.
+    """
+    with logger.scope("Fetching already built packages from repository-url"):
+        pkg_ids = get_package_ids(package_store, build_order)
+        bootstrap_ids = list()
+        if mkbootstrap:
+            for package_set in package_sets:
+                bootstrap_ids.append(hash_checkout(
+                    [str(pkg_ids[pkg_tuple]) for pkg_tuple in package_set.bootstrap_packages]))
+        fetched = package_store.try_fetch_many(pkg_ids.values(), bootstrap_ids)
+        print("Downloaded {} packages / bootstraps".format(len(fetched)))
+
+
+def build_tree_variants(package_store, mkbootstrap, jobs=1):
     """ Builds all possible tree variants in a given package store
     """
-    result = dict()
     tree_variants = get_variants_from_filesystem(package_store.packages_dir, 'treeinfo.json')
     if len(tree_variants) == 0:
         raise Exception('No treeinfo.json can be found in {}'.format(package_store.packages_dir))
-    for variant in tree_variants:
-        result[variant] = pkgpanda.build.build_tree(package_store, mkbootstrap, variant)
-    return result
+    # All the trees are built together so packages they share are only
+    # resolved, fetched and checked once.
+    results = build_tree(package_store, mkbootstrap, sorted(tree_variants, key=pkgpanda.util.variant_str), jobs)
+    return {variant: {variant: results[variant]} for variant in tree_variants}
 
 
-def build_tree(package_store, mkbootstrap, tree_variant):
-    """Build packages and bootstrap tarballs for one or all tree variants.
+def _build_logged(package_store, name, variant, log_filename):
+    """Run build() with everything written to stdout / stderr, including by
+    subprocesses (docker), sent to log_filename.
 
-    Returns a dict mapping tree variants to bootstrap IDs.
+    Used by the parallel scheduler so the output of builds running at the same
+    time doesn't get interleaved.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+    try:
+        # Line buffered so python and subprocess output stay in order in the log.
+        with open(log_filename, 'w', buffering=1) as log, redirect_stdout(log), redirect_stderr(log):
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+            try:
+                # Timings are recorded in this worker process, hand them back
+                # to the scheduler along with the result.
+                timer.take_records()
+                return build(package_store, name, variant, True), timer.take_records()
+            finally:
+                os.dup2(saved_stdout, 1)
+                os.dup2(saved_stderr, 2)
+    finally:
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+
+
+def build_packages_parallel(package_store, build_order, jobs):
+    """Build every (name, variant) tuple in build_order using up to `jobs` worker processes.
+
+    A package is started once all of its requires have been built. Variants of
+    one package share its src and result folders, so they are never built at
+    the same time. Ready packages are started in build_order order so the
+    schedule is stable. Once a build fails no new builds are started, the ones
+    already running are waited for, and then a BuildError is raised.
+
+    The output of each build goes to the package's build log in the package
+    cache folder rather than the console.
+
+    Returns a dict mapping package name -> variant -> built package path.
+    """
+    requires = {
+        pkg_tuple: set(expand_require(require) for require in package_store.packages[pkg_tuple]['requires'])
+        for pkg_tuple in build_order}
+
+    waiting = list(build_order)
+    done = set()
+    running = dict()
+    failures = list()
+    built_packages = dict()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        while waiting or running:
+            if not failures:
+                running_names = {name for name, _ in running.values()}
+                for pkg_tuple in [t for t in waiting if requires[t] <= done]:
+                    if len(running) >= jobs:
+                        break
+                    if pkg_tuple[0] in running_names:
+                        continue
+                    running_names.add(pkg_tuple[0])
+                    waiting.remove(pkg_tuple)
+                    log_filename = package_store.get_build_log_filename(*pkg_tuple)
+                    print("Starting build of package {} variant {}. Log: {}".format(
+                        pkg_tuple[0], pkgpanda.util.variant_name(pkg_tuple[1]), log_filename))
+                    future = executor.submit(_build_logged, package_store, pkg_tuple[0], pkg_tuple[1], log_filename)
+                    running[future] = pkg_tuple
+
+            if not running:
+                # Either a failure stopped scheduling, or nothing is buildable
+                # which can't happen since build_order is a valid topological
+                # order of a DAG.
+                assert failures, "Programming error: no package can be scheduled: {}".format(waiting)
+                break
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name, variant = pkg_tuple = running.pop(future)
+                log_filename = package_store.get_build_log_filename(name, variant)
+                try:
+                    built_packages.setdefault(name, dict())[variant], records = future.result()
+                    timer.add_records(records)
+                except Exception as ex:
+                    failures.append((pkg_tuple, ex))
+                    print("Build of package {} variant {} failed. Log: {}".format(
+                        name, pkgpanda.util.variant_name(variant), log_filename))
+                    if os.path.exists(log_filename):
+                        print(load_string(log_filename))
+                    continue
+                print("Built package {} variant {}".format(name, pkgpanda.util.variant_name(variant)))
+                package_store.publish_package(name, variant)
+                done.add(pkg_tuple)
+
+    if failures:
+        (name, variant), ex = failures[0]
+        raise BuildError("Building package {} variant {} failed: {}".format(
+            name, pkgpanda.util.variant_name(variant), ex)) from ex
+
+    return built_packages
 
-    If tree_variant is None, builds all available tree variants.
 
+def get_tree_package_sets(package_store, tree_variants):
+    """Return the PackageSets of the given tree variants (all of them if tree_variants is None)."""
+    if tree_variants is None:
+        return package_store.get_all_package_sets()
+    return [package_store.get_package_set(variant) for variant in tree_variants]
+
+
+def get_build_order(package_store, package_sets):
+    """Return every (name, variant) needed by package_sets, each after all of its requires.
+
+    Only the packages (and package variants) of the trees, as listed in their
+    treeinfo, plus their requires are included. Everything else in the package
+    store is left out.
     """
     # TODO(cmaloney): Add support for circular dependencies. They are doable
     # long as there is a pre-built version of enough of the packages.
-
-    # TODO(cmaloney): Make it so when we're building a treeinfo which has a
-    # explicit package list we don't build all the other packages.
     build_order = list()
     visited = set()
     built = set()
@@ -689,27 +1538,206 @@ def build_tree(package_store, mkbootstrap, tree_variant):
                 continue
             visit(pkg_tuple)
 
-    if tree_variant:
-        package_sets = [package_store.get_package_set(tree_variant)]
-    else:
-        package_sets = package_store.get_all_package_sets()
+    # Build all required packages for the requested tree variants.
+    for package_set in package_sets:
+        visit_packages(package_set.all_packages | package_set.bootstrap_packages)
 
-    with logger.scope("resolve package graph"):
-        # Build all required packages for all tree variants.
-        for package_set in package_sets:
-            visit_packages(package_set.all_packages)
+    return build_order
 
-    built_packages = dict()
-    for (name, variant) in build_order:
-        built_packages.setdefault(name, dict())
 
-        # Run the build, store the built package path for later use.
-        # TODO(cmaloney): Only build the requested variants, rather than all variants.
-        built_packages[name][variant] = build(
-            package_store,
-            name,
-            variant,
-            True)
+def get_package_inputs(package_store, name, variant):
+    """Return the absolute paths whose contents go into the id of package name variant.
+
+    Directories stand for everything inside them. Sources fetched from
+    elsewhere are pinned by sha1 / ref in the buildinfo, so only local
+    (git_local) sources are included.
+    """
+    package_dir = package_store.get_package_folder(name)
+    buildinfo = package_store.get_buildinfo(name, variant)
+    inputs = [
+        package_dir + '/' + pkgpanda.util.variant_prefix(variant) + 'buildinfo.json',
+        package_dir + '/' + buildinfo['build_script'],
+        package_dir + '/extra',
+        os.path.abspath(pkgpanda.build.constants.__file__)]
+
+    for src_info in get_package_sources(name, buildinfo).values():
+        if src_info.get('kind') == 'git_local':
+            inputs.append(package_dir + '/' + src_info['rel_path'])
+
+    # The docker image the package is built in.
+    builders = {'dcos-builder': os.path.dirname(pkgpanda.__file__) + '/docker/dcos-builder'}
+    builders.update(package_store.builders)
+    for builder_name, builder_folder in builders.items():
+        if buildinfo['docker'] == 'dcos/dcos-builder:{}_dockerdir-latest'.format(builder_name):
+            inputs.append(builder_folder)
+
+    return [os.path.normpath(os.path.abspath(path)) for path in inputs]
+
+
+def get_affected_by_changes(package_store, changed_paths):
+    """Find every package and bootstrap whose id changes when changed_paths change.
+
+    changed_paths are files (or directories) relative to the current
+    directory, for instance from `git diff --name-only --relative`. Packages
+    are affected if one of their inputs (see get_package_inputs) changed, or
+    if they require an affected package. A tree's bootstrap is affected if its
+    treeinfo changed or it contains an affected package.
+
+    Returns a dict with 'packages', a sorted list of (name, variant), and
+    'bootstraps', a list of tree variants.
+    """
+    changed_paths = [os.path.normpath(os.path.abspath(path)) for path in changed_paths]
+
+    def is_changed(path):
+        return any(changed == path or changed.startswith(path + '/') or path.startswith(changed + '/')
+                   for changed in changed_paths)
+
+    dependents = dict()
+    for pkg_tuple, buildinfo in package_store.packages.items():
+        for require in buildinfo['requires']:
+            dependents.setdefault(expand_require(require), set()).add(pkg_tuple)
+
+    # Walk the reverse requires edges out from the directly changed packages.
+    affected = set()
+    to_visit = [pkg_tuple for pkg_tuple in package_store.packages
+                if any(is_changed(path) for path in get_package_inputs(package_store, *pkg_tuple))]
+    while to_visit:
+        pkg_tuple = to_visit.pop()
+        if pkg_tuple in affected:
+            continue
+        affected.add(pkg_tuple)
+        to_visit.extend(dependents.get(pkg_tuple, set()))
+
+    bootstraps = list()
+    for variant in sorted(package_store.list_trees(), key=pkgpanda.util.variant_str):
+        treeinfo = package_store.packages_dir + '/' + pkgpanda.util.variant_prefix(variant) + 'treeinfo.json'
+        bootstrap_packages = package_store.get_package_set(variant).bootstrap_packages
+        if is_changed(os.path.abspath(treeinfo)) or bootstrap_packages & affected:
+            bootstraps.append(variant)
+
+    return {
+        'packages': sorted(affected, key=lambda pkg_tuple: (pkg_tuple[0], pkgpanda.util.variant_str(pkg_tuple[1]))),
+        'bootstraps': bootstraps
+    }
+
+
+def plan_tree(package_store, tree_variants):
+    """Work out what build_tree would do for tree_variants without building or downloading anything.
+
+    Every PackageId is computed in build order. Sources aren't checked out,
+    and docker images are only looked at (once each), never pulled.
+
+    Returns a dict with:
+      'packages': [{'name', 'variant', 'id', 'status'}, ...] in build order
+      'bootstraps': [{'variant', 'id', 'status'}, ...] one per tree variant
+
+    status is 'local' if it is in the local cache, 'remote' if it can be
+    downloaded from the repository_url, 'build' if it must be built, or
+    'unknown' if the id can't be computed because the docker image of the
+    package (or of one of its dependencies) isn't available locally.
+    """
+    package_sets = get_tree_package_sets(package_store, tree_variants)
+    build_order = get_build_order(package_store, package_sets)
+
+    docker_ids = dict()
+
+    def resolve_docker_id(docker_name):
+        if docker_name not in docker_ids:
+            try:
+                docker_ids[docker_name] = get_docker_id(docker_name)
+            except (CalledProcessError, OSError):
+                docker_ids[docker_name] = None
+        if docker_ids[docker_name] is None:
+            raise _UnknownId()
+        return docker_ids[docker_name]
+
+    pkg_ids = get_package_ids(package_store, build_order, resolve_docker_id)
+
+    bootstrap_ids = dict()
+    for package_set in package_sets:
+        bootstrap_pkg_ids = [pkg_ids[pkg_tuple] for pkg_tuple in package_set.bootstrap_packages]
+        if None in bootstrap_pkg_ids:
+            bootstrap_ids[package_set.variant] = None
+        else:
+            bootstrap_ids[package_set.variant] = hash_checkout([str(pkg_id) for pkg_id in bootstrap_pkg_ids])
+
+    known_pkg_ids = [pkg_id for pkg_id in pkg_ids.values() if pkg_id is not None]
+    known_bootstrap_ids = [bootstrap_id for bootstrap_id in bootstrap_ids.values() if bootstrap_id is not None]
+    local = {str(pkg_id) for pkg_id in known_pkg_ids if os.path.exists(package_store.get_package_path(pkg_id))}
+    bootstrap_dir = package_store.get_bootstrap_cache_dir()
+    local |= {bootstrap_id for bootstrap_id in known_bootstrap_ids
+              if os.path.exists(bootstrap_dir + '/' + bootstrap_id + '.bootstrap.tar.xz')}
+    remote = package_store.find_remote(
+        [pkg_id for pkg_id in known_pkg_ids if str(pkg_id) not in local],
+        [bootstrap_id for bootstrap_id in known_bootstrap_ids if bootstrap_id not in local])
+
+    def get_status(id_str):
+        if id_str is None:
+            return 'unknown'
+        elif id_str in local:
+            return 'local'
+        elif id_str in remote:
+            return 'remote'
+        return 'build'
+
+    pkg_id_strs = {pkg_tuple: str(pkg_id) if pkg_id is not None else None for pkg_tuple, pkg_id in pkg_ids.items()}
+    return {
+        'packages': [{
+            'name': name,
+            'variant': variant,
+            'id': pkg_id_strs[(name, variant)],
+            'status': get_status(pkg_id_strs[(name, variant)])
+        } for name, variant in build_order],
+        'bootstraps': [{
+            'variant': package_set.variant,
+            'id': bootstrap_ids[package_set.variant],
+            'status': get_status(bootstrap_ids[package_set.variant])
+        } for package_set in package_sets]
+    }
+
+
+def build_tree(package_store, mkbootstrap, tree_variants, jobs=1):
+    """Build packages and bootstrap tarballs for the given tree variants.
+
+    Returns a dict mapping tree variants to bootstrap IDs.
+
+    tree_variants is a list of tree variants (None being the default tree). If
+    it is None, builds all available tree variants. Only the package variants
+    used by the requested trees are built.
+
+    If jobs is greater than one, packages which don't depend on each other are
+    built at the same time by up to `jobs` workers.
+
+    How long each phase of the build took is written to
+    cache/timing.latest.json, see pkgpanda.build.timing.get_report.
+
+    """
+    # Only time this build.
+    timer.take_records()
+
+    package_sets = get_tree_package_sets(package_store, tree_variants)
+    with logger.scope("resolve package graph"), timer.phase('tree resolve package graph'):
+        build_order = get_build_order(package_store, package_sets)
+
+    if package_store.repository_url is not None:
+        with timer.phase('tree download from cache'):
+            try_fetch_tree(package_store, build_order, package_sets, mkbootstrap)
+
+    with package_store.builder_session(), timer.phase('tree build packages'):
+        if jobs > 1:
+            built_packages = build_packages_parallel(package_store, build_order, jobs)
+        else:
+            built_packages = dict()
+            for (name, variant) in build_order:
+                built_packages.setdefault(name, dict())
+
+                # Run the build, store the built package path for later use.
+                built_packages[name][variant] = build(
+                    package_store,
+                    name,
+                    variant,
+                    True)
+                package_store.publish_package(name, variant)
 
     # Build bootstrap tarballs for all tree variants.
     def make_bootstrap(package_set):
@@ -719,19 +1747,22 @@ def build_tree(package_store, mkbootstrap, tree_variant):
                 package_paths.append(built_packages[name][pkg_variant])
 
             if mkbootstrap:
-                return make_bootstrap_tarball(
+                bootstrap_id = make_bootstrap_tarball(
                     package_store,
                     list(sorted(package_paths)),
                     package_set.variant)
+                package_store.publish_bootstrap(package_set.variant, bootstrap_id)
+                return bootstrap_id
 
-    # Build bootstraps and and package lists for all variants.
-    # TODO(cmaloney): Allow distinguishing between "build all" and "build the default one".
+    # Build bootstraps and and package lists for all requested variants.
     complete_cache_dir = package_store.get_complete_cache_dir()
     check_call(['mkdir', '-p', complete_cache_dir])
     results = {}
     for package_set in package_sets:
+        with timer.phase('tree bootstrap'):
+            bootstrap_id = make_bootstrap(package_set)
         info = {
-            'bootstrap': make_bootstrap(package_set),
+            'bootstrap': bootstrap_id,
             'packages': sorted(
                 load_string(package_store.get_last_build_filename(*pkg_tuple))
                 for pkg_tuple in package_set.all_packages)}
@@ -740,6 +1771,13 @@ def build_tree(package_store, mkbootstrap, tree_variant):
             info)
         results[package_set.variant] = info
 
+    requires = {
+        pkg_tuple: set(expand_require(require) for require in package_store.packages[pkg_tuple]['requires'])
+        for pkg_tuple in build_order}
+    report = pkgpanda.build.timing.get_report(timer.take_records(), requires, build_order)
+    pkgpanda.build.timing.log_report(report)
+    write_json(package_store.packages_dir + '/cache/timing.latest.json', report)
+
     return results
 
 
@@ -763,6 +1801,110 @@ def build_package_variants(package_store, name, clean_after_build=True, recursiv
     return results
 
 
+def get_input_snapshot(package_store, pkg_tuples):
+    """Return {pkg_tuple: {path: (mtime, size)}} for every file among the inputs of pkg_tuples.
+
+    See get_package_inputs. Comparing two snapshots shows which packages
+    changed without hashing anything. Local git sources are only used as of
+    their HEAD commit, so for those the commit is recorded instead.
+    """
+    snapshot = dict()
+    for pkg_tuple in pkg_tuples:
+        files = dict()
+        for path in get_package_inputs(package_store, *pkg_tuple):
+            if os.path.exists(path + '/.git'):
+                files[path] = check_output(['git', '-C', path, 'rev-parse', 'HEAD']).decode().strip()
+            elif os.path.isdir(path):
+                for root, dirs, filenames in os.walk(path):
+                    for filename in filenames:
+                        try:
+                            file_stat = os.lstat(os.path.join(root, filename))
+                        except FileNotFoundError:
+                            # Removed since it was listed, e.g. an editor's temporary file.
+                            continue
+                        files[os.path.join(root, filename)] = (file_stat.st_mtime_ns, file_stat.st_size)
+            elif os.path.exists(path):
+                file_stat = os.lstat(path)
+                files[path] = (file_stat.st_mtime_ns, file_stat.st_size)
+        snapshot[pkg_tuple] = files
+    return snapshot
+
+
+def get_watched_packages(package_store, name, variants, recursive):
+    """Return the (name, variant) whose changes require rebuilding name variants.
+
+    With recursive that includes all of their requires, which build() then
+    rebuilds as needed.
+    """
+    watched = set((name, variant) for variant in variants)
+    to_visit = list(watched) if recursive else list()
+    while to_visit:
+        pkg_tuple = to_visit.pop()
+        for require in package_store.get_buildinfo(*pkg_tuple)['requires']:
+            require_tuple = expand_require(require)
+            if require_tuple not in watched and require_tuple in package_store.packages:
+                watched.add(require_tuple)
+                to_visit.append(require_tuple)
+    return watched
+
+
+def watch_package(package_store, name, variants, clean_after_build, recursive, interval=1.0):
+    """Build variants of package name, then rebuild them every time their inputs change.
+
+    Inputs are polled every interval seconds. Only packages whose id changed
+    get rebuilt; everything else (sources, extracted dependencies, docker
+    image ids) is reused from the caches and the in memory package_store.
+    Inputs which can't be read, e.g. a half written buildinfo.json, are
+    reported and checked again on the next poll; once they can be read again
+    every watched package is rebuilt. Runs until interrupted.
+    """
+    watched = set((name, variant) for variant in variants)
+    last_error = None
+
+    def build_all():
+        for variant in variants:
+            try:
+                print("Built:", build(package_store, name, variant, clean_after_build, recursive))
+            except BuildError as ex:
+                print("ERROR: {}".format(ex))
+        print("Watching for changes. Press Ctrl-C to stop.")
+
+    def get_snapshot():
+        nonlocal watched, last_error
+        try:
+            # Changed buildinfos may require different packages.
+            watched = get_watched_packages(package_store, name, variants, recursive)
+            snapshot = get_input_snapshot(package_store, watched)
+        except (BuildError, OSError, CalledProcessError) as ex:
+            # Only reported once rather than on every poll.
+            if str(ex) != last_error:
+                print("ERROR: Unable to check the inputs of {} for changes: {}".format(name, ex))
+                last_error = str(ex)
+            return None
+        last_error = None
+        return snapshot
+
+    build_all()
+    snapshot = get_snapshot()
+    while True:
+        time.sleep(interval)
+        new_snapshot = get_snapshot()
+        if new_snapshot is None:
+            continue
+        changed = sorted(
+            (pkg_tuple for pkg_tuple in watched
+             if snapshot is None or new_snapshot[pkg_tuple] != snapshot.get(pkg_tuple)),
+            key=lambda pkg_tuple: (pkg_tuple[0], pkgpanda.util.variant_str(pkg_tuple[1])))
+        snapshot = new_snapshot
+        if not changed:
+            continue
+        for pkg_tuple in changed:
+            print("Changed: {} variant {}".format(pkg_tuple[0], pkgpanda.util.variant_name(pkg_tuple[1])))
+            package_store.reload_buildinfo(*pkg_tuple)
+        build_all()
+        snapshot = get_snapshot()
+
+
 class IdBuilder():
 
     def __init__(self, buildinfo):
@@ -812,25 +1954,33 @@ def build(package_store: PackageStore, name: str, variant, clean_after_build, re
         return _build(package_store, name, variant, clean_after_build, recursive)
 
 
-def _build(package_store, name, variant, clean_after_build, recursive):
+class BuildDescription:
+    """Everything needed to build a package, and the PackageId it will be built as.
+
+    Computed from the buildinfo without fetching sources or building anything.
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def describe_build(package_store, name, variant, resolve_dependency, resolve_docker_id=None):
+    """Compute the BuildDescription of package name variant.
+
+    resolve_dependency(name, variant) must return the package id string the
+    given dependency is (or will be) built as. resolve_docker_id(docker_name)
+    returns the id of the docker image, by default PackageStore.get_docker_id.
+    """
     assert isinstance(package_store, PackageStore)
-    tmpdir = tempfile.TemporaryDirectory(prefix="pkgpanda_repo")
-    repository = Repository(tmpdir.name)
 
     package_dir = package_store.get_package_folder(name)
 
     def src_abs(name):
         return package_dir + '/' + name
 
-    def cache_abs(filename):
-        return package_store.get_package_cache_folder(name) + '/' + filename
-
     # Build pkginfo over time, translating fields from buildinfo.
     pkginfo = {}
 
-    # Build up the docker command arguments over time, translating fields as needed.
-    cmd = DockerCmd()
-
     assert (name, variant) in package_store.packages, \
         "Programming error: name, variant should have been validated to be valid before calling build()."
 
@@ -860,10 +2010,7 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     fetchers = dict()
     try:
         for src_name, src_info in sorted(sources.items()):
-            # TODO(cmaloney): Switch to a unified top level cache directory shared by all packages
-            cache_dir = package_store.get_package_cache_folder(name) + '/' + src_name
-            check_call(['mkdir', '-p', cache_dir])
-            fetcher = get_src_fetcher(src_info, cache_dir, package_dir)
+            fetcher = get_src_fetcher(src_info, package_store.get_source_cache_dir(), package_dir)
             fetchers[src_name] = fetcher
             checkout_ids[src_name] = fetcher.get_id()
     except ValidationError as ex:
@@ -889,23 +2036,15 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     # Add the "extra" folder inside the package as an additional source if it
     # exists
     if os.path.exists(extra_dir):
-        extra_id = hash_folder_abs(extra_dir, package_dir)
+        extra_id = hash_folder_abs(extra_dir, package_dir, package_store.hash_cache)
         builder.add('extra_source', extra_id)
         final_buildinfo['extra_source'] = extra_id
 
     # Figure out the docker name.
     docker_name = builder.take('docker')
-    cmd.container = docker_name
 
     # Add the id of the docker build environment to the build_ids.
-    try:
-        docker_id = get_docker_id(docker_name)
-    except CalledProcessError:
-        # docker pull the container and try again
-        check_call(['docker', 'pull', docker_name])
-        docker_id = get_docker_id(docker_name)
-
-    builder.update('docker', docker_id)
+    builder.update('docker', (resolve_docker_id or package_store.get_docker_id)(docker_name))
 
     # TODO(cmaloney): The environment variables should be generated during build
     # not live in buildinfo.json.
@@ -940,15 +2079,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
             raise BuildError("group in buildinfo.json didn't meet the validation rules. {}".format(ex))
         pkginfo['group'] = group
 
-    # Packages need directories inside the fake install root (otherwise docker
-    # will try making the directories on a readonly filesystem), so build the
-    # install root now, and make the package directories in it as we go.
-    install_dir = tempfile.mkdtemp(prefix="pkgpanda-")
-
-    active_packages = list()
     active_package_ids = set()
     active_package_variants = dict()
-    auto_deps = set()
 
     # Final package has the same requires as the build.
     requires = builder.take('requires')
@@ -987,38 +2119,12 @@ def _build(package_store, name, variant, clean_after_build, recursive):
 
         active_package_variants[requires_name] = requires_variant
 
-        # Figure out the last build of the dependency, add that as the
-        # fully expanded dependency.
-        requires_last_build = package_store.get_last_build_filename(requires_name, requires_variant)
-        if not os.path.exists(requires_last_build):
-            if recursive:
-                # Build the dependency
-                build(package_store, requires_name, requires_variant, clean_after_build, recursive)
-            else:
-                raise BuildError("No last build file found for dependency {} variant {}. Rebuild "
-                                 "the dependency".format(requires_name, requires_variant))
-
         try:
-            pkg_id_str = load_string(requires_last_build)
-            auto_deps.add(pkg_id_str)
+            pkg_id_str = resolve_dependency(requires_name, requires_variant)
             pkg_buildinfo = package_store.get_buildinfo(requires_name, requires_variant)
             pkg_requires = pkg_buildinfo['requires']
-            pkg_path = repository.package_path(pkg_id_str)
-            pkg_tar = pkg_id_str + '.tar.xz'
-            if not os.path.exists(package_store.get_package_cache_folder(requires_name) + '/' + pkg_tar):
-                raise BuildError(
-                    "The build tarball {} refered to by the last_build file of the dependency {} "
-                    "variant {} doesn't exist. Rebuild the dependency.".format(
-                        pkg_tar,
-                        requires_name,
-                        requires_variant))
-
             active_package_ids.add(pkg_id_str)
 
-            # Mount the package into the docker container.
-            cmd.volumes[pkg_path] = "/opt/mesosphere/packages/{}:ro".format(pkg_id_str)
-            os.makedirs(os.path.join(install_dir, "packages/{}".format(pkg_id_str)))
-
             # Add the dependencies of the package to the set which will be
             # activated.
             # TODO(cmaloney): All these 'transitive' dependencies shouldn't
@@ -1062,12 +2168,68 @@ def _build(package_store, name, variant, clean_after_build, recursive):
     final_buildinfo['name'] = name
     final_buildinfo['variant'] = variant
 
+    return BuildDescription(
+        pkg_id=pkg_id,
+        version=version,
+        final_buildinfo=final_buildinfo,
+        pkginfo=pkginfo,
+        fetchers=fetchers,
+        build_script=build_script,
+        extra_dir=extra_dir,
+        docker_name=docker_name,
+        dependencies=active_package_ids)
+
+
+def _build(package_store, name, variant, clean_after_build, recursive):
+    assert isinstance(package_store, PackageStore)
+    repository = package_store.extracted_repository
+
+    def cache_abs(filename):
+        return package_store.get_package_cache_folder(name) + '/' + filename
+
+    def resolve_dependency(requires_name, requires_variant):
+        # Figure out the last build of the dependency, add that as the
+        # fully expanded dependency.
+        requires_last_build = package_store.get_last_build_filename(requires_name, requires_variant)
+        if not os.path.exists(requires_last_build):
+            if recursive:
+                # Build the dependency
+                build(package_store, requires_name, requires_variant, clean_after_build, recursive)
+            else:
+                raise BuildError("No last build file found for dependency {} variant {}. Rebuild "
+                                 "the dependency".format(requires_name, requires_variant))
+
+        pkg_id_str = load_string(requires_last_build)
+        pkg_tar = pkg_id_str + '.tar.xz'
+        if not os.path.exists(package_store.get_package_cache_folder(requires_name) + '/' + pkg_tar):
+            raise BuildError(
+                "The build tarball {} refered to by the last_build file of the dependency {} "
+                "variant {} doesn't exist. Rebuild the dependency.".format(
+                    pkg_tar,
+                    requires_name,
+                    requires_variant))
+        return pkg_id_str
+
+    pkg_tuple = (name, variant)
+    with timer.phase('describe', pkg_tuple):
+        description = describe_build(package_store, name, variant, resolve_dependency)
+    pkg_id = description.pkg_id
+    version = description.version
+    final_buildinfo = description.final_buildinfo
+    pkginfo = description.pkginfo
+    fetchers = description.fetchers
+    build_script = description.build_script
+    extra_dir = description.extra_dir
+    auto_deps = description.dependencies
+
     # If the package is already built, don't do anything.
     pkg_path = package_store.get_package_cache_folder(name) + '/{}.tar.xz'.format(pkg_id)
 
     # Done if it exists locally
     if exists(pkg_path):
         print("Package up to date. Not re-building.")
+        # Mark it as recently used for gc_cache().
+        os.utime(pkg_path)
 
         # TODO(cmaloney): Updating / filling last_build should be moved out of
         # the build function.
@@ -1076,7 +2238,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         return pkg_path
 
     # Try downloading.
-    dl_path = package_store.try_fetch_by_id(pkg_id)
+    with timer.phase('download', pkg_tuple):
+        dl_path = package_store.try_fetch_by_id(pkg_id)
     if dl_path:
         print("Package up to date. Not re-building. Downloaded from repository-url.")
         # TODO(cmaloney): Updating / filling last_build should be moved out of
@@ -1094,16 +2257,8 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         json.dumps(final_buildinfo, indent=2, sort_keys=True)))
 
     # Clean out src, result so later steps can use them freely for building.
-    def clean():
-        # Run a docker container to remove src/ and result/
-        cmd = DockerCmd()
-        cmd.volumes = {
-            package_store.get_package_cache_folder(name): "/pkg/:rw",
-        }
-        cmd.container = "ubuntu:14.04.4"
-        cmd.run("package-cleaner", ["rm", "-rf", "/pkg/src", "/pkg/result"])
-
-    clean()
+    with timer.phase('clean', pkg_tuple):
+        package_store.clean_build(name)
 
     # Only fresh builds are allowed which don't overlap existing artifacts.
     result_dir = cache_abs("result")
@@ -1111,14 +2266,28 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         raise BuildError("result folder must not exist. It will be made when the package is "
                          "built. {}".format(result_dir))
 
-    # 'mkpanda add' all implicit dependencies since we actually need to build.
-    for dep in auto_deps:
-        print("Auto-adding dependency: {}".format(dep))
-        # NOTE: Not using the name pkg_id because that overrides the outer one.
-        id_obj = PackageId(dep)
-        add_package_file(repository, package_store.get_package_path(id_obj))
-        package = repository.load(dep)
-        active_packages.append(package)
+    # Build up the docker command arguments over time, translating fields as needed.
+    cmd = DockerCmd()
+    cmd.container = description.docker_name
+
+    # Packages need directories inside the fake install root (otherwise docker
+    # will try making the directories on a readonly filesystem), so build the
+    # install root now, and make the package directories in it as we go.
+    install_dir = tempfile.mkdtemp(prefix="pkgpanda-")
+
+    # Make sure all implicit dependencies are extracted since we actually need to build.
+    active_packages = list()
+    with timer.phase('extract dependencies', pkg_tuple):
+        for dep in auto_deps:
+            print("Auto-adding dependency: {}".format(dep))
+            # NOTE: Not using the name pkg_id because that overrides the outer one.
+            package_store.extract_package(PackageId(dep))
+            package = repository.load(dep)
+            active_packages.append(package)
+
+            # Mount the package into the docker container.
+            cmd.volumes[repository.package_path(dep)] = "/opt/mesosphere/packages/{}:ro".format(dep)
+            os.makedirs(os.path.join(install_dir, "packages/{}".format(dep)))
 
     # Checkout all the sources int their respective 'src/' folders.
     try:
@@ -1129,11 +2298,12 @@ def _build(package_store, name, variant, clean_after_build, recursive):
                 "Currently all builds must be from scratch. Support should be " +
                 "added for re-using a src directory when possible. src={}".format(src_dir))
         os.mkdir(src_dir)
-        for src_name, fetcher in sorted(fetchers.items()):
-            root = cache_abs('src/' + src_name)
-            os.mkdir(root)
+        with timer.phase('checkout sources', pkg_tuple):
+            for src_name, fetcher in sorted(fetchers.items()):
+                root = cache_abs('src/' + src_name)
+                os.mkdir(root)
 
-            fetcher.checkout_to(root)
+                fetcher.checkout_to(root)
     except ValidationError as ex:
         raise BuildError("Validation error when fetching sources for package: {}".format(ex))
 
@@ -1150,13 +2320,14 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         fake_path=True,
         manage_users=False,
         manage_state_dir=False)
-    install.activate(active_packages)
-    # Rewrite all the symlinks inside the active path because we will
-    # be mounting the folder into a docker container, and the absolute
-    # paths to the packages will change.
-    # TODO(cmaloney): This isn't very clean, it would be much nicer to
-    # just run pkgpanda inside the package.
-    rewrite_symlinks(install_dir, repository.path, "/opt/mesosphere/packages/")
+    with timer.phase('activate', pkg_tuple):
+        install.activate(active_packages)
+        # Rewrite all the symlinks inside the active path because we will
+        # be mounting the folder into a docker container, and the absolute
+        # paths to the packages will change.
+        # TODO(cmaloney): This isn't very clean, it would be much nicer to
+        # just run pkgpanda inside the package.
+        rewrite_symlinks(install_dir, repository.path, "/opt/mesosphere/packages/")
 
     print("Building package in docker")
 
@@ -1203,12 +2374,13 @@ def _build(package_store, name, variant, clean_after_build, recursive):
         # TODO(cmaloney): Run a wrapper which sources
         # /opt/mesosphere/environment then runs a build. Also should fix
         # ownership of /opt/mesosphere/packages/{pkg_id} post build.
-        cmd.run("package-builder", [
-            "/bin/bash",
-            "-o", "nounset",
-            "-o", "pipefail",
-            "-o", "errexit",
-            "/pkg/build"])
+        with timer.phase('docker build', pkg_tuple):
+            cmd.run("package-builder", [
+                "/bin/bash",
+                "-o", "nounset",
+                "-o", "pipefail",
+                "-o", "errexit",
+                "/pkg/build"])
     except CalledProcessError as ex:
         raise BuildError("docker exited non-zero: {}\nCommand: {}".format(ex.returncode, ' '.join(ex.cmd)))
 
@@ -1229,9 +2401,11 @@ def _build(package_store, name, variant, clean_after_build, recursive):
 
     # Bundle the artifacts into the pkgpanda package
     tmp_name = pkg_path + "-tmp.tar.xz"
-    make_tar(tmp_name, cache_abs("result"))
+    with timer.phase('make tar', pkg_tuple):
+        make_tar(tmp_name, cache_abs("result"), package_store.compression)
     os.rename(tmp_name, pkg_path)
     print("Package built.")
     if clean_after_build:
-        clean()
+        with timer.phase('clean', pkg_tuple):
+            package_store.clean_build(name)
     return pkg_path
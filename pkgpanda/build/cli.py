@@ -6,9 +6,53 @@ the necessary dependencies.
 
 Usage:
   mkpanda [--repository-url=<repository_url>] [--dont-clean-after-build] [--recursive] [--variant=<variant>]
-  mkpanda tree [--mkbootstrap] [--repository-url=<repository_url>] [--variant=<variant>]
+          [--compression=<codec>] [--watch] [--watch-interval=<seconds>]
+  mkpanda tree [--mkbootstrap] [--repository-url=<repository_url>] [--variant=<variant>] [--jobs=<jobs>]
+               [--prefetch] [--prefetch-jobs=<jobs>] [--max-source-cache-size=<megabytes>]
+               [--compression=<codec>]
+  mkpanda tree --plan [--plan-json=<filename>] [--repository-url=<repository_url>] [--variant=<variant>]
+  mkpanda tree --affected <path>...
+  mkpanda gc --max-size=<megabytes>
+
+Options:
+  --compression=<codec>
+                    Codec to compress newly built package and bootstrap tarballs with, xz or
+                    zstd, optionally followed by :<level>. Tarballs are read whatever codec they
+                    use, but the tar on hosts installing zstd tarballs must support zstd.
+                    [default: xz]
+  --watch           After building, keep watching the package's buildinfo, build script, extra/
+                    and local sources (plus those of its requires with --recursive) and rebuild
+                    whenever they change.
+  --watch-interval=<seconds>
+                    How often to check for changes with --watch. [default: 1]
+  --jobs=<jobs>     Number of packages to build at the same time when building a tree. The
+                    output of each build is written to its build.log in the package cache
+                    rather than the console when more than one is used. [default: 1]
+  --prefetch        Download the sources of every package in the tree concurrently before starting to build.
+  --prefetch-jobs=<jobs>
+                    Number of sources to download at the same time with --prefetch. [default: 8]
+  --plan            Print what building the tree would do without building or downloading
+                    anything: the id of every package and bootstrap, and whether it is already in
+                    the local cache (local), can be downloaded from the repository-url (remote),
+                    or needs to be built (build). Ids of packages whose docker image isn't
+                    available locally are unknown.
+  --plan-json=<filename>
+                    Also write the plan to filename as JSON.
+  --affected        List every package variant and tree bootstrap whose id changes when the given
+                    files change, including everything which requires a changed package. Paths
+                    are relative to the current directory, like the output of
+                    `git diff --name-only --relative <base>`.
+  --max-size=<megabytes>
+                    Remove the least recently used built packages and bootstraps from the cache
+                    of the tree in the current directory until it is no larger than this.
+                    Anything referenced by a complete.latest.json, bootstrap.latest or the
+                    latest build of a package is always kept.
+  --max-source-cache-size=<megabytes>
+                    After building the tree, remove the least recently used downloaded sources
+                    and git mirrors from cache/sources until it is no larger than this.
 """
 
+import json
 import sys
 from os import getcwd, umask
 from os.path import basename, normpath
@@ -17,30 +61,95 @@ from docopt import docopt
 
 import pkgpanda.build
 import pkgpanda.build.constants
+import pkgpanda.build.src_fetchers
+import pkgpanda.util
+from pkgpanda.exceptions import ValidationError
+
+
+def positive_int_arg(arguments, name):
+    try:
+        value = int(arguments[name])
+    except ValueError:
+        value = 0
+    if value < 1:
+        print("{} must be a positive integer. Got: {}".format(name, arguments[name]), file=sys.stderr)
+        sys.exit(1)
+    return value
 
 
 def main():
     try:
         arguments = docopt(__doc__, version="mkpanda {}".format(pkgpanda.build.constants.version))
         umask(0o022)
+        compression = arguments['--compression']
+        try:
+            pkgpanda.util.get_compress_program(compression)
+        except ValidationError as ex:
+            print("--compression: {}".format(ex), file=sys.stderr)
+            sys.exit(1)
         variant_arg = arguments['--variant']
         # map the keyword 'default' to None to build default as this is how default is internally
         # represented, but use the None argument (i.e. the lack of variant arguments) to trigger all variants
         target_variant = variant_arg if variant_arg != 'default' else None
         # Make a local repository for build dependencies
-        if arguments['tree']:
+        if arguments['gc']:
+            package_store = pkgpanda.build.PackageStore(getcwd(), None)
+            max_size = positive_int_arg(arguments, '--max-size') * 1024 * 1024
+            for path in pkgpanda.build.gc_cache(package_store, max_size):
+                print("Removed {}".format(path))
+            sys.exit(0)
+        if arguments['tree'] and arguments['--affected']:
+            package_store = pkgpanda.build.PackageStore(getcwd(), None)
+            affected = pkgpanda.build.get_affected_by_changes(package_store, arguments['<path>'])
+            for name, variant in affected['packages']:
+                print("package {} {}".format(name, pkgpanda.util.variant_name(variant)))
+            for variant in affected['bootstraps']:
+                print("bootstrap {}".format(pkgpanda.util.variant_name(variant)))
+            sys.exit(0)
+        if arguments['tree'] and arguments['--plan']:
             package_store = pkgpanda.build.PackageStore(getcwd(), arguments['--repository-url'])
+            plan = pkgpanda.build.plan_tree(package_store, None if variant_arg is None else [target_variant])
+            for package in plan['packages']:
+                print("{:<8} {}".format(package['status'], package['id'] or "{} (variant {})".format(
+                    package['name'], pkgpanda.util.variant_name(package['variant']))))
+            for bootstrap in plan['bootstraps']:
+                print("{:<8} bootstrap {} (tree variant {})".format(
+                    bootstrap['status'], bootstrap['id'], pkgpanda.util.variant_name(bootstrap['variant'])))
+            if arguments['--plan-json']:
+                with open(arguments['--plan-json'], 'w') as f:
+                    json.dump(plan, f, indent=2, sort_keys=True)
+            sys.exit(0)
+        if arguments['tree']:
+            jobs = positive_int_arg(arguments, '--jobs')
+            max_source_cache_size = None
+            if arguments['--max-source-cache-size'] is not None:
+                max_source_cache_size = positive_int_arg(arguments, '--max-source-cache-size') * 1024 * 1024
+
+            package_store = pkgpanda.build.PackageStore(getcwd(), arguments['--repository-url'], compression)
+            if arguments['--prefetch']:
+                # Only the sources of the packages the requested tree variants build.
+                package_sets = pkgpanda.build.get_tree_package_sets(
+                    package_store, None if variant_arg is None else [target_variant])
+                build_order = pkgpanda.build.get_build_order(package_store, package_sets)
+                pkgpanda.build.prefetch_sources(
+                    package_store, build_order, positive_int_arg(arguments, '--prefetch-jobs'))
             if variant_arg is None:
-                pkgpanda.build.build_tree_variants(package_store, arguments['--mkbootstrap'])
+                pkgpanda.build.build_tree_variants(package_store, arguments['--mkbootstrap'], jobs)
             else:
-                pkgpanda.build.build_tree(package_store, arguments['--mkbootstrap'], target_variant)
+                pkgpanda.build.build_tree(package_store, arguments['--mkbootstrap'], [target_variant], jobs)
+
+            if max_source_cache_size is not None:
+                source_cache = pkgpanda.build.src_fetchers.SourceCache(package_store.get_source_cache_dir())
+                for entry_dir in source_cache.evict(max_source_cache_size):
+                    print("Evicted source cache entry {}".format(entry_dir))
             sys.exit(0)
 
         # Package name is the folder name.
         name = basename(getcwd())
 
         # Package store is always the parent directory
-        package_store = pkgpanda.build.PackageStore(normpath(getcwd() + '/../'), arguments['--repository-url'])
+        package_store = pkgpanda.build.PackageStore(
+            normpath(getcwd() + '/../'), arguments['--repository-url'], compression)
 
         # Check that the folder is a package folder (the name was found by the package store as a
         # valid package with 1+ variants).
@@ -50,6 +159,18 @@ def main():
 
         clean_after_build = not arguments['--dont-clean-after-build']
         recursive = arguments['--recursive']
+        if arguments['--watch']:
+            try:
+                interval = float(arguments['--watch-interval'])
+            except ValueError:
+                print("--watch-interval must be a number. Got: {}".format(arguments['--watch-interval']),
+                      file=sys.stderr)
+                sys.exit(1)
+            variants = list(package_store.packages_by_name[name]) if variant_arg is None else [target_variant]
+            try:
+                pkgpanda.build.watch_package(package_store, name, variants, clean_after_build, recursive, interval)
+            except KeyboardInterrupt:
+                sys.exit(0)
         if variant_arg is None:
             # No command -> build all package variants.
             pkg_dict = pkgpanda.build.build_package_variants(
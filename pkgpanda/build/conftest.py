@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+import pkgpanda.build
+
+
+@pytest.fixture
+def make_package_store():
+    """Return a function making a PackageStore in a directory containing the given packages.
+
+    packages is a dictionary from package name to the buildinfo for its default variant.
+    """
+    def make(tmpdir, packages, repository_url=None):
+        for name, buildinfo in packages.items():
+            tmpdir.join(name, 'buildinfo.json').write(json.dumps(buildinfo), ensure=True)
+            tmpdir.join(name, 'build').write('#!/bin/bash\n')
+        tmpdir.join('treeinfo.json').write('{}')
+        return pkgpanda.build.PackageStore(str(tmpdir), repository_url)
+    return make
@@ -1,10 +1,11 @@
 import abc
 import os.path
 import shutil
-from subprocess import CalledProcessError, check_call, check_output
+from contextlib import contextmanager
+from subprocess import CalledProcessError, check_call, check_output, DEVNULL
 
 from pkgpanda.exceptions import ValidationError
-from pkgpanda.util import download_atomic, logger, sha1
+from pkgpanda.util import download_atomic, file_lock, hash_str, logger, sha1
 
 
 # Ref must be a git sha-1. We then pass it through get_sha1 to make
@@ -31,17 +32,119 @@ def fetch_git(bare_folder, git_uri):
             "set-url",
             "origin",
             git_uri])
-        check_call([
-            "git",
-            "--git-dir",
-            bare_folder,
-            "remote",
-            "update",
-            "origin"])
+        if os.path.exists(bare_folder + "/shallow"):
+            # Made by fetch_git_commit, get the rest of the history too.
+            check_call(["git", "--git-dir", bare_folder, "fetch", "--unshallow", "origin"])
+        else:
+            check_call([
+                "git",
+                "--git-dir",
+                bare_folder,
+                "remote",
+                "update",
+                "origin"])
 
     return bare_folder
 
 
+def fetch_git_commit(bare_folder, git_uri, commit, ref_origin):
+    """Fetch just commit (without its history) and ref_origin from git_uri into bare_folder.
+
+    commit is kept alive by refs/pkgpanda/<commit>, ref_origin is fetched to
+    refs/pkgpanda/origin/<ref_origin>. Raises CalledProcessError if the remote
+    doesn't allow fetching commit by sha-1, in which case fetch_git is needed.
+    """
+    if not os.path.exists(bare_folder):
+        check_call(["git", "init", "-q", "--bare", bare_folder])
+        check_call(["git", "--git-dir", bare_folder, "remote", "add", "--mirror=fetch", "origin", git_uri])
+    else:
+        check_call(["git", "--git-dir", bare_folder, "remote", "set-url", "origin", git_uri])
+    check_call([
+        "git", "--git-dir", bare_folder, "fetch", "-q", "--depth=1", "origin",
+        "+{0}:refs/pkgpanda/{0}".format(commit)])
+    try:
+        check_call([
+            "git", "--git-dir", bare_folder, "fetch", "-q", "--depth=1", "origin",
+            "+{0}:refs/pkgpanda/origin/{0}".format(ref_origin)])
+    except CalledProcessError:
+        # Reported when the ref_origin is checked at checkout.
+        pass
+
+
+class SourceCache:
+    """Store of fetched sources shared by every package.
+
+    Entries are directories addressed by what was fetched (a url and its sha1,
+    a git uri) rather than by the package using them, so a source used by
+    several packages is only downloaded / cloned once. An entry is locked
+    while in use so parallel builds and eviction can't trample each other, and
+    its mtime is bumped on every use so eviction drops the least recently used
+    entries first.
+    """
+
+    def __init__(self, path):
+        self.path = path.rstrip('/')
+
+    @contextmanager
+    def entry(self, kind, key):
+        """Lock and yield the directory of the entry for key, making it if it doesn't exist."""
+        kind_dir = '{}/{}'.format(self.path, kind)
+        entry_dir = '{}/{}'.format(kind_dir, hash_str(key))
+        lock_filename = entry_dir + '.lock'
+        check_call(['mkdir', '-p', kind_dir])
+        while True:
+            # Take the lock before making the directory so eviction can't remove it in between.
+            with file_lock(lock_filename) as lock:
+                # Eviction deletes the lock file along with the entry. If that
+                # happened while waiting, the lock held is on the deleted file.
+                if not os.path.exists(lock_filename) or \
+                        os.stat(lock_filename).st_ino != os.fstat(lock.fileno()).st_ino:
+                    continue
+                check_call(['mkdir', '-p', entry_dir])
+                os.utime(entry_dir)
+                yield entry_dir
+                return
+
+    def list_entries(self):
+        """Return (last use time, size in bytes, path) of every entry, least recently used first."""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        for kind in os.listdir(self.path):
+            kind_dir = self.path + '/' + kind
+            for name in os.listdir(kind_dir):
+                entry_dir = kind_dir + '/' + name
+                if not os.path.isdir(entry_dir):
+                    continue
+                size = 0
+                for root, dirs, files in os.walk(entry_dir):
+                    for filename in files:
+                        size += os.lstat(os.path.join(root, filename)).st_size
+                entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+        return sorted(entries)
+
+    def evict(self, max_size):
+        """Remove least recently used entries until the cache is at most max_size bytes.
+
+        Entries currently in use are skipped. Returns the paths of the removed entries.
+        """
+        entries = self.list_entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, entry_dir in entries:
+            if total <= max_size:
+                break
+            try:
+                with file_lock(entry_dir + '.lock', blocking=False):
+                    shutil.rmtree(entry_dir)
+                    os.remove(entry_dir + '.lock')
+            except BlockingIOError:
+                continue
+            total -= size
+            evicted.append(entry_dir)
+        return evicted
+
+
 class SourceFetcher(metaclass=abc.ABCMeta):
 
     def __init__(self, src_info):
@@ -57,6 +160,14 @@ class SourceFetcher(metaclass=abc.ABCMeta):
         """Makes the artifact appear in the passed directory"""
         pass
 
+    def fetch(self):
+        """Download the artifact into the source cache without checking it out.
+
+        Lets all sources be fetched up front, before any building starts.
+        checkout_to fetches anything which wasn't.
+        """
+        pass
+
 
 def get_git_sha1(bare_folder, ref):
         try:
@@ -87,22 +198,69 @@ class GitSrcFetcher(SourceFetcher):
         self.url = src_info['git']
         self.ref = src_info['ref']
         self.ref_origin = src_info['ref_origin']
-        self.bare_folder = cache_dir + "/cache.git".format()
+        self.source_cache = SourceCache(cache_dir)
 
     def get_id(self):
         return {"commit": self.ref}
 
+    def fetch(self):
+        # The bare repository is shared by everything using the same git uri and
+        # must not be updated while it is being cloned from.
+        with self.source_cache.entry('git', self.url) as entry_dir:
+            self.bare_folder = entry_dir + "/cache.git"
+            self._fetch()
+
     def checkout_to(self, directory):
-        # fetch into a bare repository so if we're on a host which has a cache we can
-        # only get the new commits.
-        fetch_git(self.bare_folder, self.url)
+        with self.source_cache.entry('git', self.url) as entry_dir:
+            self.bare_folder = entry_dir + "/cache.git"
+            updated = self._fetch()
+            self._checkout_to(directory, updated)
+
+    def _has_ref(self):
+        if not os.path.exists(self.bare_folder):
+            return False
+        try:
+            check_call(
+                ["git", "--git-dir", self.bare_folder, "cat-file", "-e", self.ref + "^{commit}"],
+                stderr=DEVNULL)
+            return True
+        except CalledProcessError:
+            return False
+
+    def _fetch(self):
+        """Make sure the bare repository contains ref. Returns True if the remote was contacted."""
+        # The ref is a full commit sha-1, so if it is already in the cache
+        # there is nothing new to fetch for this package.
+        if self._has_ref():
+            return False
 
+        # Only the commit being built is needed. Not all servers allow fetching
+        # a commit by sha-1 though, so fall back to fetching everything.
+        try:
+            fetch_git_commit(self.bare_folder, self.url, self.ref, self.ref_origin)
+        except CalledProcessError:
+            logger.warning("Unable to fetch just {} from {}, fetching all refs".format(self.ref, self.url))
+        if not self._has_ref():
+            fetch_git(self.bare_folder, self.url)
+        return True
+
+    def _get_origin_commit(self):
+        try:
+            return get_git_sha1(self.bare_folder, "refs/pkgpanda/origin/" + self.ref_origin)
+        except ValidationError:
+            return get_git_sha1(self.bare_folder, self.ref_origin)
+
+    def _checkout_to(self, directory, updated):
         # Warn if the ref_origin is set and gives a different sha1 than the
         # current ref.
         try:
-            origin_commit = get_git_sha1(self.bare_folder, self.ref_origin)
+            origin_commit = self._get_origin_commit()
         except Exception as ex:
-            raise ValidationError("Unable to find sha1 of ref_origin {}: {}".format(self.ref_origin, ex))
+            if updated:
+                raise ValidationError("Unable to find sha1 of ref_origin {}: {}".format(self.ref_origin, ex))
+            # The cache wasn't updated so the ref_origin may just be newer than it.
+            logger.warning("Unable to find sha1 of ref_origin {} in the source cache".format(self.ref_origin))
+            origin_commit = self.ref
         if self.ref != origin_commit:
             logger.warning(
                 "Current ref doesn't match the ref origin. "
@@ -111,8 +269,16 @@ class GitSrcFetcher(SourceFetcher):
                 " Current: {}, Origin: {}".format(self.ref,
                                                   origin_commit))
 
-        # Clone into `src/`.
-        check_call(["git", "clone", "-q", self.bare_folder, directory])
+        # Clone into `src/`. Local clones hardlink the objects of the cache
+        # rather than copying them. Not checking out the default branch first
+        # means the work tree is only written once.
+        if os.path.exists(self.bare_folder + "/shallow"):
+            # Local clones of shallow repositories don't hardlink and only get
+            # branches, so fetch just the commit needed instead.
+            check_call(["git", "init", "-q", directory])
+            check_call(["git", "-C", directory, "fetch", "-q", "--depth=1", self.bare_folder, self.ref])
+        else:
+            check_call(["git", "clone", "-q", "--no-checkout", self.bare_folder, directory])
 
         # Checkout from the bare repo in the cache folder at the specific sha1
         check_call([
@@ -285,8 +451,7 @@ class UrlSrcFetcher(SourceFetcher):
 
         self.url = src_info['url']
         self.extract = (self.kind == 'url_extract')
-        self.cache_dir = cache_dir
-        self.cache_filename = self._get_filename(cache_dir)
+        self.source_cache = SourceCache(cache_dir)
         self.working_directory = working_directory
         self.sha = src_info['sha1']
 
@@ -299,13 +464,25 @@ class UrlSrcFetcher(SourceFetcher):
             "downloaded_sha1": self.sha
         }
 
+    def fetch(self):
+        with self.source_cache.entry('url', self.url + '\n' + self.sha) as entry_dir:
+            self.cache_filename = self._get_filename(entry_dir)
+            self._fetch()
+
     def checkout_to(self, directory):
-        # Download file to cache if it isn't already there
+        with self.source_cache.entry('url', self.url + '\n' + self.sha) as entry_dir:
+            self.cache_filename = self._get_filename(entry_dir)
+            self._fetch()
+            self._checkout_to(directory)
+
+    def _fetch(self):
+        # Download file to cache if it isn't already there, validating its sha1 on the way in
         if not os.path.exists(self.cache_filename):
             print("Downloading source tarball {}".format(self.url))
-            download_atomic(self.cache_filename, self.url, self.working_directory)
+            download_atomic(self.cache_filename, self.url, self.working_directory, expected_sha1=self.sha)
+            return
 
-        # Validate the sha1 of the source is given and matches the sha1
+        # Validate the sha1 of the source already in the cache matches the sha1
         file_sha = sha1(self.cache_filename)
 
         if self.sha != file_sha:
@@ -316,6 +493,7 @@ class UrlSrcFetcher(SourceFetcher):
                 "Provided: {}, Download file's sha1: {}, Url: {}".format(
                     corrupt_filename, self.sha, file_sha, self.url))
 
+    def _checkout_to(self, directory):
         if self.extract:
             extract_archive(self.cache_filename, directory)
         else:
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pkgpanda.build
+
+
+def test_gc_cache(make_package_store, tmpdir):
+    package_store = make_package_store(tmpdir, {'a': {}})
+    cache = tmpdir.join('cache')
+
+    def add(path, mtime, size=100):
+        cache.join(path).write('x' * size, ensure=True)
+        os.utime(str(cache.join(path)), (mtime, mtime))
+
+    add('packages/a/a--1.tar.xz', 1)
+    add('packages/a/a--2.tar.xz', 2)
+    add('packages/a/a--3.tar.xz', 3)
+    add('packages/a/a--4.tar.xz', 4)
+    add('packages/a/a--5.tar.xz', 5)
+    add('packages/a/build.log', 0)
+    cache.join('packages', 'a', 'latest').write('a--5')
+    add('extracted/a--2/pkginfo.json', 2)
+    os.utime(str(cache.join('extracted', 'a--2')), (2, 2))
+    add('bootstrap/b1.bootstrap.tar.xz', 1)
+    add('bootstrap/b1.active.json', 1, 0)
+    add('bootstrap/b2.bootstrap.tar.xz', 6)
+    add('bootstrap/b2.active.json', 6, 0)
+    cache.join('bootstrap', 'bootstrap.latest').write('b1')
+    cache.join('bootstrap', 'b1.active.json').write(json.dumps(['a--1']))
+    cache.join('complete', 'complete.latest.json').write(json.dumps({'bootstrap': 'b1', 'packages': ['a--3']}),
+                                                         ensure=True)
+
+    assert pkgpanda.build.get_referenced_ids(package_store) == {'a--1', 'a--3', 'a--5', 'b1'}
+
+    # Least recently used first, skipping everything referenced.
+    removed = pkgpanda.build.gc_cache(package_store, 510)
+    assert removed == [
+        str(cache.join('packages', 'a', 'a--2.tar.xz')),
+        str(cache.join('extracted', 'a--2')),
+        str(cache.join('packages', 'a', 'a--4.tar.xz'))]
+    assert cache.join('packages', 'a', 'build.log').check()
+
+    # Referenced entries are kept even when over budget.
+    removed = pkgpanda.build.gc_cache(package_store, 0)
+    assert removed == [
+        str(cache.join('bootstrap', 'b2.bootstrap.tar.xz')),
+        str(cache.join('bootstrap', 'b2.active.json'))]
+    assert sorted(os.listdir(str(cache.join('packages', 'a')))) == [
+        'a--1.tar.xz', 'a--3.tar.xz', 'a--5.tar.xz', 'build.log', 'latest']
+
+    # Partial downloads are removed once nothing has written to them for a while.
+    add('packages/a/a--6.tar.xz.tmp', 7)
+    add('packages/a/a--6.tar.xz.tmp.validator', 7)
+    add('bootstrap/b3.bootstrap.tar.xz.tmp', 7)
+    cache.join('packages', 'a', 'a--7.tar.xz.tmp').write('x')
+    removed = pkgpanda.build.gc_cache(package_store, 10 ** 6)
+    assert removed == [
+        str(cache.join('bootstrap', 'b3.bootstrap.tar.xz.tmp')),
+        str(cache.join('packages', 'a', 'a--6.tar.xz.tmp')),
+        str(cache.join('packages', 'a', 'a--6.tar.xz.tmp.validator'))]
+    assert cache.join('packages', 'a', 'a--7.tar.xz.tmp').check()
@@ -0,0 +1,149 @@
+import json
+import os
+from subprocess import check_call
+
+import pytest
+
+import pkgpanda
+import pkgpanda.build
+import pkgpanda.build.src_fetchers
+import pkgpanda.util
+
+
+def test_extract_package(make_package_store, tmpdir, monkeypatch):
+    package_store = make_package_store(tmpdir.join('packages'), {'a': {}})
+    pkg_id = pkgpanda.PackageId('a--1')
+
+    contents = tmpdir.join('contents')
+    contents.join('pkginfo.json').write('{}', ensure=True)
+    pkgpanda.util.make_tar(package_store.get_package_path(pkg_id), str(contents))
+
+    extracted = []
+
+    def counting_extract_tarball(path, target):
+        extracted.append(path)
+        pkgpanda.util.extract_tarball(path, target)
+
+    monkeypatch.setattr(pkgpanda.build, 'extract_tarball', counting_extract_tarball)
+
+    path = package_store.extract_package(pkg_id)
+    assert path == str(tmpdir.join('packages', 'cache', 'extracted', 'a--1'))
+    assert os.path.exists(path + '/pkginfo.json')
+    assert package_store.extracted_repository.list() == {'a--1'}
+
+    # A second build depending on the package reuses the extracted copy.
+    assert package_store.extract_package(pkg_id) == path
+    assert extracted == [package_store.get_package_path(pkg_id)]
+
+
+def test_upstream_checkout_cached(tmpdir, monkeypatch):
+    upstream = tmpdir.join('upstream')
+    upstream.join('packages', 'u', 'buildinfo.json').write('{}', ensure=True)
+    upstream.join('packages', 'u', 'build').write('#!/bin/bash\n')
+
+    def commit():
+        check_call(['git', '-C', str(upstream), 'add', '-A'])
+        check_call(['git', '-C', str(upstream), '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                    'commit', '-q', '-m', 'commit'])
+
+    check_call(['git', 'init', '-q', str(upstream)])
+    commit()
+    packages_dir = tmpdir.join('packages')
+    packages_dir.join('upstream.json').write(json.dumps({'kind': 'git_local', 'rel_path': '../upstream'}),
+                                             ensure=True)
+
+    checkouts = []
+    checkout_to = pkgpanda.build.src_fetchers.GitLocalSrcFetcher.checkout_to
+
+    def counting_checkout_to(self, directory):
+        checkouts.append(directory)
+        checkout_to(self, directory)
+
+    monkeypatch.setattr(pkgpanda.build.src_fetchers.GitLocalSrcFetcher, 'checkout_to', counting_checkout_to)
+
+    assert ('u', None) in pkgpanda.build.PackageStore(str(packages_dir), None).packages
+    assert ('u', None) in pkgpanda.build.PackageStore(str(packages_dir), None).packages
+    assert len(checkouts) == 1
+
+    # A new upstream commit invalidates the checkout.
+    upstream.join('packages', 'v', 'buildinfo.json').write('{}', ensure=True)
+    upstream.join('packages', 'v', 'build').write('#!/bin/bash\n')
+    commit()
+    assert ('v', None) in pkgpanda.build.PackageStore(str(packages_dir), None).packages
+    assert len(checkouts) == 2
+
+
+def test_package_index(make_package_store, tmpdir, monkeypatch):
+    make_package_store(tmpdir, {'a': {}, 'b': {'requires': ['a']}})
+    tmpdir.join('b', 'buildinfo.json').write('not json')
+    # Folders modified within the last couple seconds aren't indexed.
+    for name in ['a', 'b']:
+        os.utime(str(tmpdir.join(name)), (0, 0))
+
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+    assert sorted(package_store.packages) == [('a', None), ('b', None)]
+    assert list(package_store.packages_by_name['a'].items()) == [(None, package_store.get_buildinfo('a', None))]
+    # buildinfo files are only parsed when used.
+    with pytest.raises(pkgpanda.build.BuildError):
+        package_store.get_buildinfo('b', None)
+    assert tmpdir.join('cache', 'package_index.json').check()
+
+    # Unchanged folders aren't listed again.
+    get_variants_from_filesystem = pkgpanda.build.get_variants_from_filesystem
+    listed = []
+
+    def recording_get_variants_from_filesystem(directory, extension):
+        listed.append(directory)
+        return get_variants_from_filesystem(directory, extension)
+
+    monkeypatch.setattr(pkgpanda.build, 'get_variants_from_filesystem', recording_get_variants_from_filesystem)
+    tmpdir.join('a', 'x.buildinfo.json').write('{}')
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+    assert sorted(package_store.packages, key=str) == [('a', 'x'), ('a', None), ('b', None)]
+    assert str(tmpdir.join('b')) not in listed
+    assert str(tmpdir.join('a')) in listed
+
+    # Folders which aren't packages, including cache itself, aren't indexed
+    # so the index is only rewritten when packages change.
+    os.utime(str(tmpdir.join('a')), (0, 0))
+    pkgpanda.build.PackageStore(str(tmpdir), None)
+    index = tmpdir.join('cache', 'package_index.json')
+    assert sorted(json.loads(index.read())['folders']) == [str(tmpdir.join('a')), str(tmpdir.join('b'))]
+    index_stat = os.stat(str(index))
+    os.utime(str(tmpdir.join('cache')), (0, 0))
+    pkgpanda.build.PackageStore(str(tmpdir), None)
+    assert os.stat(str(index)).st_ino == index_stat.st_ino
+
+
+def test_builder_session(make_package_store, tmpdir, monkeypatch):
+    commands = []
+
+    def fake_check_call(cmd, **kwargs):
+        if cmd[0] == 'docker':
+            commands.append(cmd)
+        else:
+            check_call(cmd, **kwargs)
+
+    monkeypatch.setattr(pkgpanda.build, 'check_call', fake_check_call)
+    docker_id_lookups = []
+    monkeypatch.setattr(pkgpanda.build, 'get_docker_id', lambda name: docker_id_lookups.append(name) or 'sha256:1')
+    package_store = make_package_store(tmpdir, {'a': {}, 'b': {}})
+
+    with package_store.builder_session():
+        package_store.clean_build('a')
+        package_store.clean_build('b')
+        assert package_store.get_docker_id('builder') == 'sha256:1'
+        assert package_store.get_docker_id('builder') == 'sha256:1'
+
+    # One container is started, used for every clean up and removed at the end.
+    assert [cmd[:3] for cmd in commands] == [
+        ['docker', 'run', '-d'],
+        ['docker', 'exec', commands[0][3][len('--name='):]],
+        ['docker', 'exec', commands[0][3][len('--name='):]],
+        ['docker', 'rm', '-f']]
+    assert commands[1][3:] == ['rm', '-rf', '/pkg/a/src', '/pkg/a/result']
+    assert docker_id_lookups == ['builder']
+
+    # Without a session a container is run for each clean up.
+    package_store.clean_build('a')
+    assert [cmd[:2] for cmd in commands[4:]] == [['docker', 'run'], ['docker', 'rm']]
@@ -0,0 +1,104 @@
+import http.server
+import os
+import socketserver
+import threading
+from subprocess import CalledProcessError
+
+import pytest
+
+import pkgpanda
+import pkgpanda.build
+
+
+@pytest.fixture
+def repository_server(tmpdir, monkeypatch):
+    """Serve tmpdir/repo over http. Yields the repo directory, its url and the list of requested paths."""
+    requested = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            requested.append(self.path)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    repo = tmpdir.join('repo')
+    repo.ensure(dir=True)
+    monkeypatch.chdir(str(repo))
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield repo, 'http://127.0.0.1:{}'.format(server.server_address[1]), requested
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_try_fetch_many(make_package_store, tmpdir, repository_server):
+    repo, url, requested = repository_server
+    repo.join('packages', 'a', 'a--1.tar.xz').write('a--1', ensure=True)
+    repo.join('bootstrap', 'b1.bootstrap.tar.xz').write('b1', ensure=True)
+    repo.join('bootstrap', 'b1.active.json').write('[]')
+    package_store = make_package_store(tmpdir.join('packages'), {'a': {}}, url)
+
+    pkg_ids = [pkgpanda.PackageId('a--1'), pkgpanda.PackageId('a--2')]
+    assert package_store.try_fetch_many(pkg_ids, ['b1', 'b2']) == {'a--1', 'b1'}
+    assert open(package_store.get_package_path(pkg_ids[0])).read() == 'a--1'
+    assert os.path.exists(package_store.get_bootstrap_cache_dir() + '/b1.active.json')
+
+    # Misses are remembered, and things already downloaded aren't requested again.
+    requested_count = len(requested)
+    assert not package_store.try_fetch_by_id(pkg_ids[1])
+    assert not package_store.try_fetch_bootstrap_and_active('b2')
+    assert package_store.try_fetch_many(pkg_ids, ['b1']) == set()
+    assert len(requested) == requested_count
+
+
+def test_get_package_ids(make_package_store, tmpdir, monkeypatch):
+    monkeypatch.setattr(pkgpanda.build, 'get_docker_id', lambda name: 'sha256:1')
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {},
+    })
+    build_order = [('a', None), ('b', None), ('c', None)]
+    pkg_ids = pkgpanda.build.get_package_ids(package_store, build_order)
+    assert [pkg_ids[pkg_tuple].name for pkg_tuple in build_order] == ['a', 'b', 'c']
+
+    # Changing a package changes the id of everything which depends on it.
+    tmpdir.join('a', 'build').write('#!/bin/bash\necho changed\n')
+    new_pkg_ids = pkgpanda.build.get_package_ids(package_store, build_order)
+    assert str(new_pkg_ids[('a', None)]) != str(pkg_ids[('a', None)])
+    assert str(new_pkg_ids[('b', None)]) != str(pkg_ids[('b', None)])
+    assert str(new_pkg_ids[('c', None)]) == str(pkg_ids[('c', None)])
+
+
+def test_plan_tree(make_package_store, tmpdir, monkeypatch, repository_server):
+    repo, url, requested = repository_server
+
+    def fake_get_docker_id(docker_name):
+        if docker_name == 'missing':
+            raise CalledProcessError(1, ['docker', 'inspect', docker_name])
+        return 'sha256:1'
+
+    monkeypatch.setattr(pkgpanda.build, 'get_docker_id', fake_get_docker_id)
+    package_store = make_package_store(tmpdir.join('packages'), {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {},
+        'd': {'docker': 'missing'},
+        'e': {'requires': ['d']},
+    }, url)
+    pkg_ids = pkgpanda.build.get_package_ids(package_store, [('a', None), ('b', None)])
+    tmpdir.join('packages', 'cache', 'packages', 'a', str(pkg_ids[('a', None)]) + '.tar.xz').write('', ensure=True)
+    repo.join('packages', 'b', str(pkg_ids[('b', None)]) + '.tar.xz').write('', ensure=True)
+
+    plan = pkgpanda.build.plan_tree(package_store, None)
+    statuses = {package['name']: package['status'] for package in plan['packages']}
+    assert statuses == {'a': 'local', 'b': 'remote', 'c': 'build', 'd': 'unknown', 'e': 'unknown'}
+    assert [package['name'] for package in plan['packages']].index('a') < \
+        [package['name'] for package in plan['packages']].index('b')
+    assert plan['bootstraps'] == [{'variant': None, 'id': None, 'status': 'unknown'}]
+    # Nothing gets downloaded.
+    assert requested == []
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+import pytest
+
+import pkgpanda.build
+import pkgpanda.util
+
+
+def test_build_packages_parallel(make_package_store, tmpdir, monkeypatch):
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {'requires': ['a']},
+        'd': {'requires': ['b', 'c']},
+    })
+
+    def fake_build(package_store, name, variant, clean_after_build, recursive=False):
+        # Every require must be completely built before a package is started.
+        for require in package_store.get_buildinfo(name, variant)['requires']:
+            assert os.path.exists(package_store.get_last_build_filename(require, None))
+        print("building", name)
+        pkgpanda.util.write_string(package_store.get_last_build_filename(name, variant), name + '--1')
+        return name + '.tar.xz'
+
+    monkeypatch.setattr(pkgpanda.build, 'build', fake_build)
+
+    build_order = [('a', None), ('b', None), ('c', None), ('d', None)]
+    assert pkgpanda.build.build_packages_parallel(package_store, build_order, 3) == {
+        'a': {None: 'a.tar.xz'},
+        'b': {None: 'b.tar.xz'},
+        'c': {None: 'c.tar.xz'},
+        'd': {None: 'd.tar.xz'},
+    }
+
+    # Output of each build is kept in its own log.
+    assert pkgpanda.util.load_string(package_store.get_build_log_filename('c', None)) == 'building c'
+
+
+def test_build_packages_parallel_variants(make_package_store, tmpdir, monkeypatch):
+    make_package_store(tmpdir, {'a': {}, 'b': {}})
+    tmpdir.join('a', 'x.buildinfo.json').write('{}')
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+
+    def fake_build(package_store, name, variant, clean_after_build, recursive=False):
+        # Variants of a package share its src and result folders.
+        building = str(tmpdir.join('building-' + name))
+        os.mkdir(building)
+        time.sleep(0.2)
+        os.rmdir(building)
+        return name + pkgpanda.util.variant_suffix(variant) + '.tar.xz'
+
+    monkeypatch.setattr(pkgpanda.build, 'build', fake_build)
+
+    build_order = [('a', None), ('a', 'x'), ('b', None)]
+    assert pkgpanda.build.build_packages_parallel(package_store, build_order, 3) == {
+        'a': {None: 'a.tar.xz', 'x': 'a.x.tar.xz'},
+        'b': {None: 'b.tar.xz'},
+    }
+
+
+def test_build_packages_parallel_failure(make_package_store, tmpdir, monkeypatch):
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {'requires': ['b']},
+    })
+
+    def fake_build(package_store, name, variant, clean_after_build, recursive=False):
+        if name == 'b':
+            raise pkgpanda.build.BuildError("b is broken")
+        pkgpanda.util.write_string(package_store.get_last_build_filename(name, variant), name + '--1')
+        return name + '.tar.xz'
+
+    monkeypatch.setattr(pkgpanda.build, 'build', fake_build)
+
+    with pytest.raises(pkgpanda.build.BuildError):
+        pkgpanda.build.build_packages_parallel(package_store, [('a', None), ('b', None), ('c', None)], 2)
+
+    # Nothing depending on the failed package is started.
+    assert os.path.exists(package_store.get_last_build_filename('a', None))
+    assert not os.path.exists(package_store.get_last_build_filename('c', None))
+
+
+def test_get_build_order_only_requested_trees(make_package_store, tmpdir):
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {},
+    })
+    tmpdir.join('a', 'x.buildinfo.json').write('{}')
+    tmpdir.join('c', 'y.buildinfo.json').write('{}')
+    tmpdir.join('treeinfo.json').write(json.dumps({'core_package_list': ['b']}))
+    tmpdir.join('big.treeinfo.json').write(json.dumps({'variants': {'a': 'x', 'c': 'y'}, 'exclude': ['b']}))
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+
+    def get_build_order(tree_variants):
+        package_sets = pkgpanda.build.get_tree_package_sets(package_store, tree_variants)
+        return pkgpanda.build.get_build_order(package_store, package_sets)
+
+    assert get_build_order([None]) == [('a', None), ('b', None)]
+    assert get_build_order(['big']) == [('a', 'x'), ('c', 'y')]
+    assert sorted(get_build_order(None), key=str) == sorted([('a', None), ('b', None), ('a', 'x'), ('c', 'y')], key=str)
@@ -0,0 +1,105 @@
+import json
+import os
+from subprocess import check_call, check_output
+
+import pytest
+
+import pkgpanda.build
+import pkgpanda.build.src_fetchers
+import pkgpanda.util
+
+
+def test_source_cache(tmpdir):
+    cache_dir = str(tmpdir.join('sources'))
+    tmpdir.join('a.tar').write('a' * 1024)
+    tmpdir.join('b.tar').write('b' * 2048)
+
+    def fetch(filename, package):
+        fetcher = pkgpanda.build.src_fetchers.UrlSrcFetcher({
+            'kind': 'url',
+            'url': 'file://' + filename,
+            'sha1': pkgpanda.util.sha1(str(tmpdir.join(filename)))
+        }, cache_dir, str(tmpdir))
+        src_dir = tmpdir.join(package, 'src')
+        src_dir.ensure(dir=True)
+        fetcher.checkout_to(str(src_dir))
+        assert src_dir.join(filename).read() == tmpdir.join(filename).read()
+
+    # Packages using the same source share one cache entry.
+    fetch('a.tar', 'p1')
+    fetch('a.tar', 'p2')
+    fetch('b.tar', 'p3')
+    source_cache = pkgpanda.build.src_fetchers.SourceCache(cache_dir)
+    entries = source_cache.list_entries()
+    assert [size for _, size, _ in entries] == [1024, 2048]
+
+    # Using a.tar again makes b.tar the least recently used entry.
+    os.utime(entries[1][2], (0, 0))
+    fetch('a.tar', 'p4')
+    assert source_cache.evict(1024) == [entries[1][2]]
+    assert [size for _, size, _ in source_cache.list_entries()] == [1024]
+    assert not os.path.exists(entries[1][2] + '.lock')
+
+    # An evicted entry is made again on its next use.
+    fetch('b.tar', 'p5')
+    assert [size for _, size, _ in source_cache.list_entries()] == [1024, 2048]
+
+
+def test_prefetch_sources(make_package_store, tmpdir):
+    tmpdir.join('a.tar').write('a')
+    a_sha1 = pkgpanda.util.sha1(str(tmpdir.join('a.tar')))
+    a_source = {'kind': 'url', 'url': 'file://' + str(tmpdir.join('a.tar')), 'sha1': a_sha1}
+    package_store = make_package_store(tmpdir.join('packages'), {
+        'a': {'single_source': a_source},
+        'b': {'sources': {'a': a_source, 'extra': dict(a_source, kind='url_extract')}},
+        'c': {},
+    })
+    # Variants outside of the build order aren't fetched, or even loaded.
+    tmpdir.join('packages', 'a', 'unused.buildinfo.json').write('{"single_source": ')
+    tmpdir.join('packages', 'c', 'unused.buildinfo.json').write(json.dumps(
+        {'single_source': dict(a_source, url='file://' + str(tmpdir.join('missing.tar')))}))
+    package_store = pkgpanda.build.PackageStore(str(tmpdir.join('packages')), None)
+    build_order = pkgpanda.build.get_build_order(
+        package_store, pkgpanda.build.get_tree_package_sets(package_store, [None]))
+
+    pkgpanda.build.prefetch_sources(package_store, build_order, 4)
+    source_cache = pkgpanda.build.src_fetchers.SourceCache(package_store.get_source_cache_dir())
+    assert len(source_cache.list_entries()) == 1
+
+    # Sources not matching their sha1 fail the prefetch.
+    tmpdir.join('a.tar').write('b')
+    package_store = make_package_store(tmpdir.join('packages2'), {'a': {'single_source': a_source}})
+    with pytest.raises(pkgpanda.build.BuildError):
+        pkgpanda.build.prefetch_sources(package_store, [('a', None)], 4)
+
+
+def test_git_src_fetcher(tmpdir):
+    repo = tmpdir.join('repo')
+    check_call(['git', 'init', '-q', '-b', 'master', str(repo)])
+
+    def commit(contents):
+        repo.join('file').write(contents)
+        check_call(['git', '-C', str(repo), 'add', '-A'])
+        check_call(['git', '-C', str(repo), '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                    'commit', '-q', '-m', contents])
+        return check_output(['git', '-C', str(repo), 'rev-parse', 'HEAD']).decode().strip()
+
+    first = commit('first')
+    commit('second')
+    cache_dir = str(tmpdir.join('sources'))
+
+    def checkout(ref, directory):
+        fetcher = pkgpanda.build.src_fetchers.GitSrcFetcher(
+            {'kind': 'git', 'git': 'file://' + str(repo), 'ref': ref, 'ref_origin': 'master'}, cache_dir)
+        fetcher.checkout_to(str(tmpdir.join(directory)))
+        return fetcher
+
+    fetcher = checkout(first, 'src1')
+    assert tmpdir.join('src1', 'file').read() == 'first'
+    # Only the commit needed was fetched, not the rest of the history.
+    assert os.path.exists(fetcher.bare_folder + '/shallow')
+
+    # A commit already in the cache doesn't touch the remote.
+    repo.remove()
+    checkout(first, 'src2')
+    assert tmpdir.join('src2', 'file').read() == 'first'
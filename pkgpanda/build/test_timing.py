@@ -0,0 +1,33 @@
+import json
+
+import pkgpanda.build
+import pkgpanda.build.timing
+
+
+def test_timing_report():
+    timer = pkgpanda.build.timing.BuildTimer()
+    with timer.phase('tree build packages'):
+        pass
+    timer.add_records([
+        {'package': ('a', None), 'phase': 'docker build', 'start': 0, 'duration': 10},
+        {'package': ('a', None), 'phase': 'make tar', 'start': 10, 'duration': 5},
+        {'package': ('b', None), 'phase': 'docker build', 'start': 15, 'duration': 1},
+        {'package': ('c', None), 'phase': 'docker build', 'start': 0, 'duration': 20},
+        {'package': ('d', None), 'phase': 'docker build', 'start': 20, 'duration': 2},
+    ])
+    records = timer.take_records()
+    assert timer.take_records() == []
+
+    requires = {('b', None): {('a', None)}, ('d', None): {('b', None), ('c', None)}}
+    build_order = [('a', None), ('b', None), ('c', None), ('d', None)]
+    report = pkgpanda.build.timing.get_report(records, requires, build_order, slowest=2)
+    assert report['phases']['docker build'] == 33
+    assert report['phases']['make tar'] == 5
+    assert 'tree build packages' in report['phases']
+    assert [package['name'] for package in report['packages']] == ['c', 'a', 'd', 'b']
+    assert report['packages'][1]['phases'] == {'docker build': 10, 'make tar': 5}
+    assert [package['name'] for package in report['slowest']] == ['c', 'a']
+    # c -> d (22s) takes longer than a -> b -> d (18s).
+    assert report['critical_path']['duration'] == 22
+    assert [package['name'] for package in report['critical_path']['packages']] == ['c', 'd']
+    json.dumps(report)
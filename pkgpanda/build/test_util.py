@@ -1,4 +1,7 @@
+import os
+
 import pkgpanda.build
+import pkgpanda.util
 
 
 def test_hash_files_in_folder(tmpdir):
@@ -84,3 +87,32 @@ def test_hash_files_in_folder(tmpdir):
             'baz/bang/new': '15bc116ce980d703d62a16531b0ef5bb42fef91c',
             'baz/bang/swish/swipe': 'e855a8aca0e15c14144901428df7042798a622d6'
         }
+
+
+def test_hash_cache(tmpdir, monkeypatch):
+    folder = tmpdir.join("folder")
+    folder.join("foo").write("foo contents", ensure=True)
+    folder.join("sub", "bar").write("bar contents", ensure=True)
+    # Make the files old enough that their hashes can be cached.
+    for path in [folder.join("foo"), folder.join("sub", "bar")]:
+        os.utime(str(path), (0, 0))
+
+    manifest = str(tmpdir.join("cache", "file_hashes.json"))
+    with tmpdir.as_cwd():
+        uncached = pkgpanda.build.hash_files_in_folder("folder")
+        assert pkgpanda.build.hash_files_in_folder("folder", pkgpanda.build.HashCache(manifest)) == uncached
+
+        # A fresh cache loaded from disk doesn't need to read the unchanged files.
+        def no_sha1(filename):
+            raise AssertionError("{} should have come from the hash cache".format(filename))
+        monkeypatch.setattr(pkgpanda.util, 'sha1', no_sha1)
+        assert pkgpanda.build.hash_files_in_folder("folder", pkgpanda.build.HashCache(manifest)) == uncached
+        monkeypatch.undo()
+
+        # Changed files are re-hashed.
+        folder.join("foo").write("new foo contents")
+        os.utime(str(folder.join("foo")), (0, 0))
+        hashes = pkgpanda.build.hash_files_in_folder("folder", pkgpanda.build.HashCache(manifest))
+        assert hashes == pkgpanda.build.hash_files_in_folder("folder")
+        assert hashes['foo'] != uncached['foo']
+        assert hashes['sub/bar'] == uncached['sub/bar']
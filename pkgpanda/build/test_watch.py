@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import pkgpanda.build
+
+
+def test_watch_package(make_package_store, tmpdir, monkeypatch):
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {},
+    })
+    assert pkgpanda.build.get_watched_packages(package_store, 'b', [None], False) == {('b', None)}
+    assert pkgpanda.build.get_watched_packages(package_store, 'b', [None], True) == {('a', None), ('b', None)}
+
+    builds = []
+
+    def fake_build(package_store, name, variant, clean_after_build, recursive=False):
+        builds.append((name, package_store.get_buildinfo('b', None).get('version')))
+        return name
+
+    edits = [
+        lambda: None,
+        lambda: tmpdir.join('c', 'build').write('#!/bin/bash\necho unrelated\n'),
+        lambda: tmpdir.join('a', 'extra', 'file').write('changed', ensure=True),
+        lambda: tmpdir.join('b', 'buildinfo.json').write(json.dumps({'requires': ['a'], 'version': '2'})),
+    ]
+
+    def fake_sleep(interval):
+        if not edits:
+            raise KeyboardInterrupt()
+        edits.pop(0)()
+
+    monkeypatch.setattr(pkgpanda.build, 'build', fake_build)
+    monkeypatch.setattr(pkgpanda.build.time, 'sleep', fake_sleep)
+    with pytest.raises(KeyboardInterrupt):
+        pkgpanda.build.watch_package(package_store, 'b', [None], True, True)
+    # Built once, then again for the changes to a and b (with b's new buildinfo).
+    assert builds == [('b', None), ('b', None), ('b', '2')]
+
+
+def test_watch_package_invalid_buildinfo(make_package_store, tmpdir, monkeypatch, capsys):
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+    })
+
+    builds = []
+
+    def fake_build(package_store, name, variant, clean_after_build, recursive=False):
+        builds.append((name, package_store.get_buildinfo('b', None).get('version')))
+        return name
+
+    edits = [
+        lambda: tmpdir.join('b', 'buildinfo.json').write('{"requires": ['),
+        lambda: None,
+        lambda: None,
+        lambda: tmpdir.join('b', 'buildinfo.json').write(json.dumps({'requires': ['a'], 'version': '2'})),
+        lambda: None,
+    ]
+
+    def fake_sleep(interval):
+        if not edits:
+            raise KeyboardInterrupt()
+        edits.pop(0)()
+
+    monkeypatch.setattr(pkgpanda.build, 'build', fake_build)
+    monkeypatch.setattr(pkgpanda.build.time, 'sleep', fake_sleep)
+    with pytest.raises(KeyboardInterrupt):
+        pkgpanda.build.watch_package(package_store, 'b', [None], True, True)
+    # The build with the half written buildinfo fails, the watcher keeps polling
+    # and rebuilds once the buildinfo is valid again.
+    assert builds == [('b', None), ('b', '2')]
+    assert capsys.readouterr()[0].count('Unable to check the inputs of b for changes') == 1
+
+
+def test_get_affected_by_changes(make_package_store, tmpdir, monkeypatch):
+    package_store = make_package_store(tmpdir, {
+        'a': {},
+        'b': {'requires': ['a']},
+        'c': {'requires': ['b']},
+        'd': {},
+    })
+    tmpdir.join('d', 'x.buildinfo.json').write('{}')
+    tmpdir.join('treeinfo.json').write(json.dumps({'bootstrap_package_list': ['d']}))
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+    monkeypatch.chdir(str(tmpdir))
+
+    def get_affected(*changed_paths):
+        return pkgpanda.build.get_affected_by_changes(package_store, changed_paths)
+
+    assert get_affected('a/build') == {
+        'packages': [('a', None), ('b', None), ('c', None)],
+        'bootstraps': []}
+    assert get_affected('b/extra/file', 'a/README.md') == {
+        'packages': [('b', None), ('c', None)],
+        'bootstraps': []}
+    assert get_affected('d/x.buildinfo.json') == {'packages': [('d', 'x')], 'bootstraps': []}
+    assert get_affected('d/buildinfo.json') == {'packages': [('d', None)], 'bootstraps': [None]}
+    assert get_affected('treeinfo.json') == {'packages': [], 'bootstraps': [None]}
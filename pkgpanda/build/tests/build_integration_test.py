@@ -7,7 +7,7 @@ import pytest
 
 import pkgpanda.build
 import pkgpanda.build.cli
-from pkgpanda.util import expect_fs
+from pkgpanda.util import expect_fs, sha1
 
 
 def get_tar_contents(filename):
@@ -33,6 +33,17 @@ def test_build(tmpdir):
     # TODO(cmaloney): Check the package exists with the right contents.
 
 
+def test_build_reproducible(tmpdir):
+    # Rebuilding a package from the same inputs gives a bit-identical tarball.
+    copytree("resources/base", str(tmpdir.join("base")))
+    package_store = pkgpanda.build.PackageStore(str(tmpdir), None)
+    pkg_path = pkgpanda.build.build(package_store, "base", None, True)
+    first_sha1 = sha1(pkg_path)
+    os.remove(pkg_path)
+    assert pkgpanda.build.build(package_store, "base", None, True) == pkg_path
+    assert sha1(pkg_path) == first_sha1
+
+
 def test_build_bad_sha1(tmpdir):
     package("resources/base", "base", tmpdir)
 
@@ -159,6 +170,7 @@ def test_bootstrap(tmpdir):
             './bin/',
             './bin/mesos-master',
             './etc/',
+            './etc/active-roles.json',
             './etc/dcos-service-configuration.json',
             './lib/',
             './lib/',
@@ -0,0 +1,116 @@
+"""Timing of the phases of package and tree builds.
+
+Phases are recorded on the module level `timer`, then summarised by
+get_report() once a tree build is done.
+"""
+import time
+from contextlib import contextmanager
+
+import pkgpanda.util
+
+
+class BuildTimer:
+
+    def __init__(self):
+        self._records = list()
+
+    @contextmanager
+    def phase(self, phase, pkg_tuple=None):
+        """Record how long the body takes as phase of building pkg_tuple (or of the tree if None)."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._records.append({
+                'package': pkg_tuple,
+                'phase': phase,
+                'start': start,
+                'duration': time.time() - start})
+
+    def take_records(self):
+        """Return everything recorded so far and forget it."""
+        records, self._records = self._records, list()
+        return records
+
+    def add_records(self, records):
+        """Add records taken from the timer of another process."""
+        self._records += records
+
+
+timer = BuildTimer()
+
+
+def get_critical_path(durations, requires, build_order):
+    """Return (duration, path) of the longest chain of packages each requiring the previous.
+
+    That is the least time the build could take however many builds run at the
+    same time. durations maps (name, variant) to seconds, requires maps them to
+    sets of (name, variant), build_order lists every package after its requires.
+    """
+    finish = dict()
+    previous = dict()
+    for pkg_tuple in build_order:
+        before = [require for require in requires.get(pkg_tuple, set()) if require in finish]
+        previous[pkg_tuple] = max(before, key=finish.get) if before else None
+        finish[pkg_tuple] = durations.get(pkg_tuple, 0) + (finish[previous[pkg_tuple]] if before else 0)
+
+    if not finish:
+        return 0, []
+    pkg_tuple = max(build_order, key=finish.get)
+    duration = finish[pkg_tuple]
+    path = list()
+    while pkg_tuple is not None:
+        path.append(pkg_tuple)
+        pkg_tuple = previous[pkg_tuple]
+    return duration, list(reversed(path))
+
+
+def get_report(records, requires, build_order, slowest=10):
+    """Summarise timer records of a tree build.
+
+    Returns a dict with the total time of each phase, the time of each package
+    (slowest first) broken down by phase, the critical path through the
+    dependency graph and the `slowest` slowest packages.
+    """
+    phases = dict()
+    packages = dict()
+    for record in records:
+        phases[record['phase']] = phases.get(record['phase'], 0) + record['duration']
+        if record['package'] is not None:
+            package_phases = packages.setdefault(tuple(record['package']), dict())
+            package_phases[record['phase']] = package_phases.get(record['phase'], 0) + record['duration']
+
+    durations = {pkg_tuple: sum(package_phases.values()) for pkg_tuple, package_phases in packages.items()}
+    critical_duration, critical_path = get_critical_path(durations, requires, build_order)
+
+    def package_json(pkg_tuple):
+        return {
+            'name': pkg_tuple[0],
+            'variant': pkg_tuple[1],
+            'duration': durations.get(pkg_tuple, 0),
+            'phases': packages.get(pkg_tuple, dict())}
+
+    by_duration = sorted(durations, key=lambda pkg_tuple: (
+        -durations[pkg_tuple], pkg_tuple[0], pkgpanda.util.variant_str(pkg_tuple[1])))
+    return {
+        'phases': phases,
+        'packages': [package_json(pkg_tuple) for pkg_tuple in by_duration],
+        'slowest': [package_json(pkg_tuple) for pkg_tuple in by_duration[:slowest]],
+        'critical_path': {
+            'duration': critical_duration,
+            'packages': [package_json(pkg_tuple) for pkg_tuple in critical_path]}}
+
+
+def log_report(report):
+    """Print a summary of report, and send the phase totals to TeamCity as build statistics."""
+    logger = pkgpanda.util.logger
+    for phase, duration in sorted(report['phases'].items()):
+        logger.statistic('pkgpanda.phase.{}'.format(phase.replace(' ', '_')), round(duration, 3))
+    logger.statistic('pkgpanda.critical_path', round(report['critical_path']['duration'], 3))
+
+    print("Critical path ({:.1f}s): {}".format(report['critical_path']['duration'], ' -> '.join(
+        package['name'] for package in report['critical_path']['packages'])))
+    print("Slowest packages:")
+    for package in report['slowest']:
+        print("  {:8.1f}s {} (variant {})".format(
+            package['duration'], package['name'], pkgpanda.util.variant_name(package['variant'])))
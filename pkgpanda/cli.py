@@ -1,7 +1,7 @@
 """Panda package management
 
 Usage:
-  pkgpanda activate <id>... [options]
+  pkgpanda activate <id>... [--incremental] [options]
   pkgpanda swap <package-id> [options]
   pkgpanda active [options]
   pkgpanda fetch --repository-url=<url> <id>... [options]
@@ -13,6 +13,8 @@ Usage:
   pkgpanda check [--list] [options]
 
 Options:
+    --incremental               Reuse the tree archived by the previous activation,
+                                only relinking the packages which differ.
     --config-dir=<conf-dir>     Use an alternate directory for finding machine
                                 configuration (roles, setup flags). [default: {default_config_dir}]
     --no-systemd                Don't try starting/stopping systemd services
@@ -168,12 +170,11 @@ def main():
             sys.exit(0)
 
         if arguments['fetch']:
-            for package_id in arguments['<id>']:
-                actions.fetch_package(
-                    repository,
-                    arguments['--repository-url'],
-                    package_id,
-                    os.getcwd())
+            actions.fetch_packages(
+                repository,
+                arguments['--repository-url'],
+                arguments['<id>'],
+                os.getcwd())
             sys.exit(0)
 
         if arguments['activate']:
@@ -182,7 +183,8 @@ def main():
                 repository,
                 arguments['<id>'],
                 not arguments['--no-systemd'],
-                not arguments['--no-block-systemd'])
+                not arguments['--no-block-systemd'],
+                arguments['--incremental'])
             sys.exit(0)
 
         if arguments['swap']:
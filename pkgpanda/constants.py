@@ -6,6 +6,8 @@ RESERVED_UNIT_NAMES = [
 
 DCOS_SERVICE_CONFIGURATION_FILE = "dcos-service-configuration.json"
 DCOS_SERVICE_CONFIGURATION_PATH = "/opt/mesosphere/etc/" + DCOS_SERVICE_CONFIGURATION_FILE
+# The roles the active tree was built with, in its etc directory.
+ACTIVE_ROLES_FILE = "active-roles.json"
 SYSCTL_SETTING_KEY = "sysctl"
 
 STATE_DIR_ROOT = '/var/lib/dcos'
@@ -1,3 +1,9 @@
+import os
+import shutil
+from subprocess import CalledProcessError
+
+import pytest
+
 from pkgpanda.util import expect_fs, resources_test_dir, run
 
 fetch_output = """\rFetching: mesos--0.22.0\rFetched: mesos--0.22.0\n"""
@@ -22,8 +28,58 @@ def test_fetch(tmpdir):
         {
             "mesos--0.22.0": ["lib", "bin_master", "bin_slave", "pkginfo.json", "bin"]
         })
-    # TODO(cmaloney): Test multiple fetches on one line.
-    # TODO(cmaloney): Test unable to fetch case.
+
+
+def make_remote_repo(path, versions):
+    os.makedirs(str(path.join('packages/mesos')))
+    for version in versions:
+        shutil.copyfile(
+            resources_test_dir('remote_repo/packages/mesos/mesos--0.22.0.tar.xz'),
+            str(path.join('packages/mesos/mesos--{}.tar.xz'.format(version))))
+
+
+def test_fetch_many(tmpdir):
+    make_remote_repo(tmpdir.join('remote'), ['0.22.0', '0.23.0', '0.24.0'])
+    repository = tmpdir.join('repository')
+    output = run([
+        "pkgpanda",
+        "fetch",
+        "mesos--0.22.0",
+        "mesos--0.23.0",
+        "mesos--0.24.0",
+        "mesos--0.23.0",
+        "--repository={0}".format(repository),
+        "--repository-url=file://{}/".format(tmpdir.join('remote'))
+    ])
+    assert sorted(output.splitlines()) == [
+        "Fetched: mesos--0.22.0",
+        "Fetched: mesos--0.23.0",
+        "Fetched: mesos--0.24.0"]
+
+    expect_fs(str(repository), {
+        "mesos--0.22.0": ["lib", "bin_master", "bin_slave", "pkginfo.json", "bin"],
+        "mesos--0.23.0": ["lib", "bin_master", "bin_slave", "pkginfo.json", "bin"],
+        "mesos--0.24.0": ["lib", "bin_master", "bin_slave", "pkginfo.json", "bin"]
+    })
+
+
+def test_fetch_many_failure(tmpdir):
+    make_remote_repo(tmpdir.join('remote'), ['0.22.0', '0.23.0'])
+    repository = tmpdir.join('repository')
+    with pytest.raises(CalledProcessError):
+        run([
+            "pkgpanda",
+            "fetch",
+            "mesos--0.22.0",
+            "mesos--0.23.0",
+            "mesos--0.24.0",
+            "--repository={0}".format(repository),
+            "--repository-url=file://{}/".format(tmpdir.join('remote'))
+        ])
+
+    # The packages which could be fetched were, and the failed one left no
+    # partial extraction behind.
+    assert sorted(os.listdir(str(repository))) == ["mesos--0.22.0", "mesos--0.23.0"]
 
 
 def test_add(tmpdir):
@@ -1,10 +1,12 @@
 """ Test reading and changing the active set of available packages"""
 
+import os
 import shutil
 
 import pytest
 
-from pkgpanda import Install, Repository
+from pkgpanda import ConflictingFile, Install, Repository, SymlinkFarm
+from pkgpanda.exceptions import ValidationError
 from pkgpanda.util import expect_fs, resources_test_dir
 
 
@@ -90,3 +92,113 @@ def test_recovery_move_new(tmpdir):
             "include": [".gitignore"],
             "lib": ["libmesos.so"]
         })
+
+
+def snapshot(root):
+    """Everything under root: the target of each symlink, the contents of each file."""
+    contents = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                contents[os.path.relpath(path, root)] = os.readlink(path)
+            elif os.path.isdir(path):
+                contents[os.path.relpath(path, root)] = None
+            else:
+                with open(path) as f:
+                    contents[os.path.relpath(path, root)] = f.read()
+    return contents
+
+
+def test_activate_incremental(tmpdir, monkeypatch):
+    shutil.copytree(resources_test_dir("packages"), str(tmpdir.join("packages")))
+    # Nested directories, one of them shared by two packages and one empty.
+    tmpdir.join("packages", "mesos--0.22.0", "lib", "python", "a.py").write("a", ensure=True)
+    tmpdir.join("packages", "mesos--0.23.0", "lib", "python", "b.py").write("b", ensure=True)
+    tmpdir.join("packages", "mesos-config--justmesos", "include", "empty").ensure(dir=True)
+    repository = Repository(str(tmpdir.join("packages")))
+
+    def make_install(name):
+        return Install(str(tmpdir.join(name)), resources_test_dir("etc-active"), True, False, True, fake_path=True)
+    full = make_install("full")
+    incremental = make_install("incremental")
+
+    linked = []
+    link_package = Install._link_package
+
+    def record_link_package(self, package, *args):
+        linked.append(str(package.id))
+        return link_package(self, package, *args)
+    monkeypatch.setattr(Install, '_link_package', record_link_package)
+
+    config = "mesos-config--ffddcfb53168d42f92e4771c6f8a8a9a818fd6b8"
+    for active, expected_linked in [
+            # Nothing to reuse the first two times.
+            ({"mesos--0.22.0", config}, {"mesos--0.22.0", config}),
+            ({"mesos--0.22.0", "mesos-config--justmesos"}, {"mesos--0.22.0", "mesos-config--justmesos"}),
+            # From here on only what differs from the set before last.
+            ({"mesos--0.22.0", config}, set()),
+            ({"mesos--0.23.0", config}, {"mesos--0.23.0", config}),
+            ({"mesos--0.22.0", config}, set()),
+            ({"mesos--0.22.0"}, {"mesos--0.22.0"}),
+            ({"mesos--0.22.0", "mesos-config--justmesos"}, {"mesos-config--justmesos"}),
+            ({"mesos--0.22.0", config}, {config}),
+            ({"mesos--0.23.0"}, {"mesos--0.23.0"})]:
+        packages = repository.load_packages(active)
+        full.activate(packages)
+        linked.clear()
+        incremental.activate(packages, incremental=True)
+        assert set(linked) == expected_linked
+        assert incremental.get_active() == active
+        assert snapshot(str(tmpdir.join("incremental"))) == snapshot(str(tmpdir.join("full")))
+
+    # A tree built with other roles, or without the roles recorded, isn't reused.
+    shutil.copytree(resources_test_dir("etc-active"), str(tmpdir.join("etc-slave")))
+    tmpdir.join("etc-slave", "roles", "master").rename(tmpdir.join("etc-slave", "roles", "slave"))
+    other_roles = Install(str(tmpdir.join("incremental")), str(tmpdir.join("etc-slave")), True, False, True,
+                          fake_path=True)
+    packages = repository.load_packages({"mesos--0.22.0", config})
+    linked.clear()
+    other_roles.activate(packages, incremental=True)
+    assert set(linked) == {"mesos--0.22.0", config}
+    tmpdir.join("incremental", "etc.old", "active-roles.json").remove()
+    linked.clear()
+    incremental.activate(packages, incremental=True)
+    assert set(linked) == {"mesos--0.22.0", config}
+
+
+def test_symlink_farm(tmpdir):
+    tmpdir.join("a", "lib", "python", "a.py").write("a", ensure=True)
+    tmpdir.join("a", "bin", "a").write("a", ensure=True)
+    tmpdir.join("b", "lib", "python", "b.py").write("b", ensure=True)
+    tmpdir.join("b", "bin", "a").write("b", ensure=True)
+    tmpdir.join("c", "lib").write("c", ensure=True)
+    dest = tmpdir.join("dest").ensure(dir=True)
+
+    farm = SymlinkFarm()
+    farm.add_tree(str(tmpdir.join("a")), str(dest))
+    # Conflicts are found before anything is written.
+    with pytest.raises(ConflictingFile):
+        farm.add_tree(str(tmpdir.join("b")), str(dest))
+    farm = SymlinkFarm()
+    farm.add_tree(str(tmpdir.join("c")), str(dest))
+    with pytest.raises(ValidationError):
+        farm.add_tree(str(tmpdir.join("a")), str(dest))
+    assert dest.listdir() == []
+
+    tmpdir.join("b", "bin", "a").remove()
+    farm = SymlinkFarm()
+    farm.add_tree(str(tmpdir.join("a")), str(dest))
+    farm.add_tree(str(tmpdir.join("b")), str(dest))
+    farm.write()
+    expect_fs(str(dest), {"bin": ["a"], "lib": {"python": ["a.py", "b.py"]}})
+    assert dest.join("lib", "python", "b.py").readlink() == str(tmpdir.join("b", "lib", "python", "b.py"))
+
+    # Merging into an existing tree checks it for conflicts too.
+    farm = SymlinkFarm()
+    farm.add_tree(str(tmpdir.join("c")), str(tmpdir.join("more")))
+    farm.add_tree(str(tmpdir.join("a")), str(dest))
+    tmpdir.join("more").ensure(dir=True)
+    with pytest.raises(ConflictingFile):
+        farm.write(merge=True)
+    assert tmpdir.join("more").listdir() == []
@@ -38,7 +38,7 @@ def test_setup(tmpdir):
                 "mesos-master",
                 "mesos-slave"],
             "lib": ["libmesos.so"],
-            "etc": ["dcos-service-configuration.json", "foobar", "some.json"],
+            "etc": ["active-roles.json", "dcos-service-configuration.json", "foobar", "some.json"],
             "include": [],
             "dcos.target.wants": ["dcos-mesos-master.service"],
             "dcos.target": None,
@@ -106,7 +106,7 @@ def test_setup(tmpdir):
                 "mesos-master",
                 "mesos-slave"],
             "lib": ["libmesos.so"],
-            "etc": ["dcos-service-configuration.json", "foobar", "some.json"],
+            "etc": ["active-roles.json", "dcos-service-configuration.json", "foobar", "some.json"],
             "include": [],
             "dcos.target": None,
             "dcos.target.wants": ["dcos-mesos-master.service"],
@@ -119,7 +119,7 @@ def test_setup(tmpdir):
                 "mesos-master",
                 "mesos-slave"],
             "lib.old": ["libmesos.so"],
-            "etc.old": ["dcos-service-configuration.json", "foobar", "some.json"],
+            "etc.old": ["active-roles.json", "dcos-service-configuration.json", "foobar", "some.json"],
             "include.old": [],
             "dcos.target.wants.old": ["dcos-mesos-master.service"],
             "environment.old": None,
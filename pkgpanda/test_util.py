@@ -1,8 +1,20 @@
+import hashlib
+import http.server
+import importlib.util
+import os
+import py_compile
+import shutil
+import socketserver
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
 import pytest
 
 import pkgpanda.util
 from pkgpanda import UserManagement
-from pkgpanda.exceptions import ValidationError
+from pkgpanda.exceptions import FetchError, ValidationError
 
 
 def test_variant_variations():
@@ -115,3 +127,293 @@ def test_split_by_token():
     assert list(split_by_token('{', '}', 'some text {token} some more text', strip_token_decoration=True)) == [
         ('some text ', False), ('token', True), (' some more text', False)
     ]
+
+
+@pytest.mark.parametrize('compression', [
+    'xz',
+    'xz:1',
+    pytest.param('zstd:3', marks=pytest.mark.skipif(not shutil.which('zstd'), reason="zstd isn't installed")),
+])
+def test_make_tar_extract_tarball(tmpdir, compression):
+    tmpdir.join('src', 'dir', 'file').write('contents', ensure=True)
+    tarball = str(tmpdir.join('package.tar.xz'))
+    pkgpanda.util.make_tar(tarball, str(tmpdir.join('src')), compression)
+    assert pkgpanda.util.sniff_compression(tarball) == compression.split(':')[0]
+
+    pkgpanda.util.extract_tarball(tarball, str(tmpdir.join('out')))
+    assert tmpdir.join('out', 'dir', 'file').read() == 'contents'
+
+
+def test_get_compress_program():
+    with pytest.raises(ValidationError):
+        pkgpanda.util.get_compress_program('lzma')
+    with pytest.raises(ValidationError):
+        pkgpanda.util.get_compress_program('xz:fast')
+
+
+def test_make_tar_reproducible(tmpdir):
+    # The same files created in a different order, at different times, give the same tarball.
+    for name, order in [('a', ['x', 'y/z']), ('b', ['y/z', 'x'])]:
+        for path in order:
+            tmpdir.join(name, path).write(path, ensure=True)
+            mtime = time.time() - len(name + path)
+            os.utime(str(tmpdir.join(name, path)), (mtime, mtime))
+        pkgpanda.util.make_tar(str(tmpdir.join(name + '.tar.xz')), str(tmpdir.join(name)))
+
+    assert pkgpanda.util.sha1(str(tmpdir.join('a.tar.xz'))) == pkgpanda.util.sha1(str(tmpdir.join('b.tar.xz')))
+
+
+def test_make_tar_pyc(tmpdir):
+    # Compiled python in a package stays valid for its source once extracted.
+    tmpdir.join('src', 'new.py').write('x = 1\n', ensure=True)
+    tmpdir.join('src', 'old.py').write('x = 2\n')
+    os.utime(str(tmpdir.join('src', 'old.py')), (1000, 1000))
+    for name in ['new', 'old']:
+        py_compile.compile(str(tmpdir.join('src', name + '.py')))
+    # The folder archived isn't changed, and may well not be ours to change.
+    src_files = {}
+    for dirpath, dirnames, filenames in os.walk(str(tmpdir.join('src'))):
+        for path in [os.path.join(dirpath, name) for name in filenames]:
+            with open(path, 'rb') as f:
+                src_files[path] = (f.read(), os.stat(path).st_mtime_ns)
+            os.chmod(path, 0o444)
+        os.chmod(dirpath, 0o555)
+    pkgpanda.util.make_tar(str(tmpdir.join('package.tar.xz')), str(tmpdir.join('src')))
+    for path, (contents, mtime_ns) in src_files.items():
+        with open(path, 'rb') as f:
+            assert f.read() == contents
+        assert os.stat(path).st_mtime_ns == mtime_ns
+    assert sorted(os.listdir(str(tmpdir))) == ['package.tar.xz', 'src']
+    pkgpanda.util.extract_tarball(str(tmpdir.join('package.tar.xz')), str(tmpdir.join('out')))
+
+    for name, mtime in [('new', pkgpanda.util.reproducible_mtime), ('old', 1000)]:
+        source = str(tmpdir.join('out', name + '.py'))
+        assert os.stat(source).st_mtime == mtime
+        pyc = importlib.util.cache_from_source(source)
+        with open(pyc, 'rb') as f:
+            header = f.read(16)
+        offset = 8 if sys.version_info >= (3, 7) else 4
+        assert int.from_bytes(header[offset:offset + 4], 'little') == mtime
+
+
+@pytest.mark.parametrize('compression', [
+    'xz',
+    pytest.param('zstd:3', marks=pytest.mark.skipif(not shutil.which('zstd'), reason="zstd isn't installed")),
+])
+def test_download_extract_tarball(tmpdir, compression):
+    tmpdir.join('src', 'dir', 'file').write('contents' * 100000, ensure=True)
+    tarball = str(tmpdir.join('package.tar.xz'))
+    pkgpanda.util.make_tar(tarball, str(tmpdir.join('src')), compression)
+    sha1 = pkgpanda.util.sha1(tarball)
+
+    out = tmpdir.join('out')
+    assert pkgpanda.util.download_extract_tarball(
+        'file://' + tarball, str(out), str(tmpdir), expected_sha1=sha1) == sha1
+    assert out.join('dir', 'file').read() == 'contents' * 100000
+
+    # A bad checksum or a truncated download leaves nothing behind.
+    shutil.rmtree(str(out))
+    with pytest.raises(FetchError):
+        pkgpanda.util.download_extract_tarball('file://' + tarball, str(out), str(tmpdir), expected_sha1='0' * 40)
+    assert not out.check()
+
+    with open(tarball, 'rb') as f:
+        tmpdir.join('truncated.tar.xz').write_binary(f.read(os.path.getsize(tarball) // 2))
+    with pytest.raises(FetchError):
+        pkgpanda.util.download_extract_tarball('file://truncated.tar.xz', str(out), str(tmpdir))
+    assert not out.check()
+
+
+@contextmanager
+def serve_files(files, drop_after=None, stall=0):
+    """Serve the bytes in files (path -> bytes) over HTTP, with Range and If-Range support.
+
+    Yields (base url, list of (path, Range header) requested). If drop_after
+    is set, the first GET of each file is cut off after that many bytes, after
+    stalling for stall seconds.
+    """
+    requested = []
+    dropped = set()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def send_body(self, send_body):
+            path = self.path.lstrip('/')
+            range_header = self.headers.get('Range')
+            if send_body:
+                requested.append((path, range_header))
+            if path not in files:
+                self.send_error(404)
+                return
+            data = files[path]
+            etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+            if self.headers.get('If-Range', etag) != etag:
+                range_header = None
+            start, end = 0, len(data) - 1
+            if range_header:
+                first, _, last = range_header[len('bytes='):].partition('-')
+                start, end = int(first), int(last) if last else len(data) - 1
+                if start >= len(data):
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(end + 1 - start))
+            self.end_headers()
+            if not send_body:
+                return
+            body = data[start:end + 1]
+            if drop_after is not None and path not in dropped:
+                dropped.add(path)
+                body = body[:drop_after]
+                self.close_connection = True
+                self.wfile.write(body)
+                self.wfile.flush()
+                time.sleep(stall)
+                return
+            self.wfile.write(body)
+
+        def do_GET(self):  # noqa: N802
+            self.send_body(True)
+
+        def do_HEAD(self):  # noqa: N802
+            self.send_body(False)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_port), requested
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(pkgpanda.util, 'download_retry_delay', 0)
+
+
+def test_download_extract_tarball_http(tmpdir, no_retry_delay):
+    tmpdir.join('src', 'file').write(os.urandom(200000), mode='wb', ensure=True)
+    tarball = str(tmpdir.join('package.tar.xz'))
+    pkgpanda.util.make_tar(tarball, str(tmpdir.join('src')))
+    with open(tarball, 'rb') as f:
+        files = {'package.tar.xz': f.read()}
+
+    with serve_files(files) as (url, requested):
+        pkgpanda.util.download_extract_tarball(url + 'package.tar.xz', str(tmpdir.join('out')), str(tmpdir))
+        assert tmpdir.join('out', 'file').read_binary() == tmpdir.join('src', 'file').read_binary()
+
+        with pytest.raises(FetchError):
+            pkgpanda.util.download_extract_tarball(url + 'missing.tar.xz', str(tmpdir.join('missing')), str(tmpdir))
+        assert not tmpdir.join('missing').check()
+
+    # A dropped connection picks up where it stopped while tar keeps extracting.
+    with serve_files(files, drop_after=1000) as (url, requested):
+        sha1 = pkgpanda.util.download_extract_tarball(url + 'package.tar.xz', str(tmpdir.join('out2')), str(tmpdir))
+        assert sha1 == pkgpanda.util.sha1(tarball)
+        assert tmpdir.join('out2', 'file').read_binary() == tmpdir.join('src', 'file').read_binary()
+        assert requested == [('package.tar.xz', None), ('package.tar.xz', 'bytes=1000-')]
+
+
+def test_download_retry_resume(tmpdir, monkeypatch, no_retry_delay):
+    data = os.urandom(100000)
+    out = str(tmpdir.join('out'))
+    with serve_files({'file': data}, drop_after=30000) as (url, requested):
+        pkgpanda.util.download(out, url + 'file', str(tmpdir))
+        assert tmpdir.join('out').read_binary() == data
+        assert requested == [('file', None), ('file', 'bytes=30000-')]
+
+    # So are connections which stall part way through the body. Only the
+    # whole chunks read before the stall are kept.
+    monkeypatch.setattr(pkgpanda.util, 'download_timeout', (5, 0.5))
+    chunk_size = pkgpanda.util.STREAM_CHUNK_SIZE
+    with serve_files({'file': data * 2}, drop_after=chunk_size + 1000, stall=2) as (url, requested):
+        pkgpanda.util.download(out, url + 'file', str(tmpdir))
+        assert tmpdir.join('out').read_binary() == data * 2
+        assert requested == [('file', None), ('file', 'bytes={}-'.format(chunk_size))]
+
+    # Errors which won't go away by retrying fail right away.
+    with serve_files({}) as (url, requested):
+        with pytest.raises(FetchError):
+            pkgpanda.util.download(out, url + 'missing', str(tmpdir))
+        assert requested == [('missing', None)]
+
+    # download_atomic keeps a partial download around and picks up from it next time.
+    etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+    tmpdir.join('atomic.tmp').write_binary(data[:40000])
+    tmpdir.join('atomic.tmp.validator').write(etag)
+    with serve_files({'file': data}) as (url, requested):
+        pkgpanda.util.download_atomic(str(tmpdir.join('atomic')), url + 'file', str(tmpdir),
+                                      expected_sha1=hashlib.sha1(data).hexdigest())
+        assert tmpdir.join('atomic').read_binary() == data
+        assert not tmpdir.join('atomic.tmp').check()
+        assert not tmpdir.join('atomic.tmp.validator').check()
+        assert requested == [('file', 'bytes=40000-')]
+
+    # Partial downloads of a file which changed since, or without a validator, start over.
+    new_data = os.urandom(100000)
+    tmpdir.join('changed.tmp').write_binary(data[:40000])
+    tmpdir.join('changed.tmp.validator').write(etag)
+    tmpdir.join('unknown.tmp').write_binary(data[:40000])
+    with serve_files({'file': new_data}) as (url, requested):
+        pkgpanda.util.download_atomic(str(tmpdir.join('changed')), url + 'file', str(tmpdir))
+        assert tmpdir.join('changed').read_binary() == new_data
+        assert requested == [('file', 'bytes=40000-'), ('file', None)]
+        pkgpanda.util.download_atomic(str(tmpdir.join('unknown')), url + 'file', str(tmpdir))
+        assert tmpdir.join('unknown').read_binary() == new_data
+        assert requested[2:] == [('file', None)]
+
+    # Only a partially received body is kept, not error responses.
+    with serve_files({}) as (url, requested):
+        with pytest.raises(FetchError) as excinfo:
+            pkgpanda.util.download_atomic(str(tmpdir.join('missing')), url + 'missing', str(tmpdir))
+        assert not tmpdir.join('missing.tmp').check()
+        assert 'Unable to remove' not in str(excinfo.value)
+    monkeypatch.setattr(pkgpanda.util, 'download_retries', 0)
+    with serve_files({'file': data}, drop_after=30000) as (url, requested):
+        with pytest.raises(FetchError):
+            pkgpanda.util.download_atomic(str(tmpdir.join('dropped')), url + 'file', str(tmpdir))
+        assert tmpdir.join('dropped.tmp').read_binary() == data[:30000]
+        assert tmpdir.join('dropped.tmp.validator').read() == etag
+        pkgpanda.util.download_atomic(str(tmpdir.join('dropped')), url + 'file', str(tmpdir))
+        assert tmpdir.join('dropped').read_binary() == data
+        assert requested == [('file', None), ('file', 'bytes=30000-')]
+
+    # A download which doesn't match is set aside rather than resumed forever.
+    tmpdir.join('bad.tmp').write_binary(b'x' * 40000)
+    tmpdir.join('bad.tmp.validator').write(etag)
+    with serve_files({'file': data}) as (url, requested):
+        with pytest.raises(ValidationError):
+            pkgpanda.util.download_atomic(str(tmpdir.join('bad')), url + 'file', str(tmpdir),
+                                          expected_sha1=hashlib.sha1(data).hexdigest())
+        assert tmpdir.join('bad.corrupt').read_binary() == b'x' * 40000 + data[40000:]
+        assert not tmpdir.join('bad.tmp').check()
+        assert not tmpdir.join('bad.tmp.validator').check()
+        pkgpanda.util.download_atomic(str(tmpdir.join('bad')), url + 'file', str(tmpdir),
+                                      expected_sha1=hashlib.sha1(data).hexdigest())
+        assert tmpdir.join('bad').read_binary() == data
+
+
+def test_download_segments(tmpdir, monkeypatch, no_retry_delay):
+    monkeypatch.setattr(pkgpanda.util, 'segment_min_size', 1000)
+    data = os.urandom(100001)
+    with serve_files({'file': data}, drop_after=1000) as (url, requested):
+        pkgpanda.util.download(str(tmpdir.join('out')), url + 'file', str(tmpdir))
+        assert tmpdir.join('out').read_binary() == data
+        segments = [(0, 25000), (25001, 50001), (50002, 75002), (75003, 100000)]
+        ranges = [range_header for _, range_header in requested]
+        for start, end in segments:
+            ranges.remove('bytes={}-{}'.format(start, end))
+        # Whichever segment was cut off is picked up where it stopped.
+        assert len(ranges) == 1
+        assert ranges[0] in ['bytes={}-{}'.format(start + 1000, end) for start, end in segments]
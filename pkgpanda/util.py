@@ -1,3 +1,4 @@
+import fcntl
 import hashlib
 import http.server
 import json
@@ -7,10 +8,14 @@ import re
 import shutil
 import socketserver
 import subprocess
-from contextlib import contextmanager, ExitStack
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager, ExitStack
 from itertools import chain
 from multiprocessing import Process
 from shutil import rmtree, which
+from stat import S_IWUSR
 from subprocess import check_call
 from typing import List
 
@@ -63,7 +68,157 @@ def variant_suffix(variant, delim='.'):
     return delim + variant
 
 
-def download(out_filename, url, work_dir, rm_on_error=True):
+# Size of the reads from a download which are written out.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Number of times a failed request is retried before a download gives up, and
+# the delay in seconds before the first retry (doubled for each retry after).
+download_retries = 5
+download_retry_delay = 1
+
+# Seconds to wait for a connection, and then for each read on it, before a
+# request fails (and is retried like any other dropped connection).
+download_timeout = (10, 60)
+
+# Files at least segment_min_size bytes long are downloaded as download_segments
+# byte ranges at the same time, when the server supports ranges.
+segment_min_size = 64 * 2**20
+download_segments = 4
+
+
+def _is_retryable(ex):
+    if isinstance(ex, requests.exceptions.HTTPError):
+        return ex.response is not None and (ex.response.status_code >= 500 or ex.response.status_code == 429)
+    return isinstance(ex, (requests.exceptions.ConnectionError,
+                           requests.exceptions.Timeout,
+                           requests.exceptions.ChunkedEncodingError))
+
+
+def _get_validator(response):
+    """Return the ETag or Last-Modified date of response, for an If-Range header, or None if it has neither."""
+    etag = response.headers.get('ETag')
+    # Weak ETags can't be used for ranges.
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def iter_download(url, session=None, start=0, end=None, retries=None, validator=None, on_response=None):
+    """Yield the body of url from byte start to byte end (inclusive, None for the end of the file) in chunks.
+
+    Connection drops, timeouts and 5xx responses are retried with backoff, up to
+    retries (default download_retries) times in a row. A retry asks for the
+    rest of the body with an HTTP Range request, so nothing is downloaded twice.
+
+    Range requests are sent with an If-Range header holding validator, or the
+    validator of the first response, so bytes from a file which changed
+    in between are never mixed. If the server answers with anything but the
+    requested range an exception is raised. on_response is called with every
+    successful response before its body is read.
+    """
+    retries = download_retries if retries is None else retries
+    offset = start
+    failures = 0
+    while True:
+        headers = {}
+        if offset != 0 or end is not None:
+            headers['Range'] = 'bytes={}-{}'.format(offset, '' if end is None else end)
+            if validator is not None:
+                headers['If-Range'] = validator
+        try:
+            with closing((session or requests).get(url, stream=True, headers=headers,
+                                                   timeout=download_timeout)) as r:
+                if r.status_code == 301:
+                    raise Exception("got a 301")
+                r.raise_for_status()
+                if headers and r.status_code != 206:
+                    raise Exception("server didn't return the requested range, either the file changed or "
+                                    "it doesn't support resuming downloads with HTTP Range requests")
+                if validator is None:
+                    validator = _get_validator(r)
+                if on_response is not None:
+                    on_response(r)
+                expected = r.headers.get('Content-Length')
+                received = 0
+                for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    received += len(chunk)
+                    offset += len(chunk)
+                    failures = 0
+                    yield chunk
+                if expected is not None and received < int(expected):
+                    raise requests.exceptions.ConnectionError(
+                        "connection closed after {} of {} bytes".format(received, expected))
+                return
+        except Exception as ex:
+            if not _is_retryable(ex) or failures >= retries:
+                raise
+            time.sleep(download_retry_delay * 2 ** failures)
+            failures += 1
+            print("Retrying download of {} from byte {} after: {}".format(url, offset, ex))
+
+
+def _get_segments(url, session):
+    """Return the byte ranges to download url as and their validator, or (None, None) to download it in one piece.
+
+    Without a validator the segments could come from different versions of the
+    file, so url is downloaded in one piece.
+    """
+    try:
+        r = (session or requests).head(url, allow_redirects=True, timeout=download_timeout)
+    except requests.exceptions.RequestException:
+        return None, None
+    if r.status_code != 200 or r.headers.get('Accept-Ranges') != 'bytes' or 'Content-Length' not in r.headers:
+        return None, None
+    validator = _get_validator(r)
+    size = int(r.headers['Content-Length'])
+    if size < segment_min_size or validator is None:
+        return None, None
+    step = -(-size // download_segments)
+    return [(offset, min(offset + step, size) - 1) for offset in range(0, size, step)], validator
+
+
+def _download_segments(out_filename, url, session, segments, validator):
+    def fetch(segment):
+        start, end = segment
+        offset = start
+        for chunk in iter_download(url, session, start, end, validator=validator):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+        if offset != end + 1:
+            raise Exception("got {} of {} bytes for range {}-{}".format(offset - start, end + 1 - start, start, end))
+
+    try:
+        with open(out_filename, 'wb') as f:
+            fd = f.fileno()
+            os.ftruncate(fd, segments[-1][1] + 1)
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                list(executor.map(fetch, segments))
+    except:
+        # The file has holes where segments are missing, so it can't be resumed.
+        os.remove(out_filename)
+        raise
+
+
+def _download_from(out_filename, url, session, offset, validator=None, on_response=None):
+    """Download url to out_filename, keeping the first offset bytes already in out_filename."""
+    with open(out_filename, "r+b" if offset else "wb") as f:
+        f.seek(offset)
+        for chunk in iter_download(url, session, offset, validator=validator, on_response=on_response):
+            f.write(chunk)
+        f.truncate()
+
+
+def download(out_filename, url, work_dir, rm_on_error=True, session=None, resume=False):
+    """Download url to out_filename.
+
+    Failed requests are retried (see iter_download). If resume is set and
+    out_filename already holds the start of the file, e.g. from an earlier
+    interrupted download, only the rest is downloaded, and a download which
+    fails part way through the body is kept to be resumed. The validator of
+    the file (see _get_validator) is kept in out_filename + '.validator' so only
+    the same version of the file is resumed. Large files are
+    downloaded as several byte ranges at the same time.
+    """
     assert os.path.isabs(out_filename)
     assert os.path.isabs(work_dir)
     work_dir = work_dir.rstrip('/')
@@ -72,6 +227,13 @@ def download(out_filename, url, work_dir, rm_on_error=True):
     # of simple user whitespace.
     url = url.strip()
 
+    validator_filename = out_filename + '.validator'
+
+    def save_validator(response):
+        validator = _get_validator(response)
+        if validator is not None and not os.path.exists(validator_filename):
+            write_string(validator_filename, validator)
+
     # Handle file:// urls specially since requests doesn't know about them.
     try:
         if url.startswith('file://'):
@@ -80,44 +242,85 @@ def download(out_filename, url, work_dir, rm_on_error=True):
                 src_filename = work_dir + '/' + src_filename
             shutil.copyfile(src_filename, out_filename)
         else:
-            # Download the file.
-            with open(out_filename, "w+b") as f:
-                r = requests.get(url, stream=True)
-                if r.status_code == 301:
-                    raise Exception("got a 301")
-                r.raise_for_status()
-                for chunk in r.iter_content(chunk_size=4096):
-                    f.write(chunk)
+            offset = 0
+            if resume and os.path.exists(out_filename) and os.path.exists(validator_filename):
+                offset = os.path.getsize(out_filename)
+            if offset:
+                try:
+                    _download_from(out_filename, url, session, offset, load_string(validator_filename))
+                except Exception as ex:
+                    if _is_retryable(ex):
+                        raise
+                    # e.g. the file changed, the server doesn't do ranges, or the partial file is already complete.
+                    print("Unable to resume download of {}, starting over: {}".format(url, ex))
+                    offset = 0
+            if not offset:
+                if os.path.exists(validator_filename):
+                    os.remove(validator_filename)
+                segments, validator = _get_segments(url, session) if download_segments > 1 else (None, None)
+                if segments:
+                    _download_segments(out_filename, url, session, segments, validator)
+                else:
+                    _download_from(out_filename, url, session, 0, on_response=save_validator if resume else None)
+            if os.path.exists(validator_filename):
+                os.remove(validator_filename)
     except Exception as fetch_exception:
-        if rm_on_error:
-            rm_passed = False
-
+        rm_failed = False
+        keep = resume and os.path.exists(validator_filename) and _is_partial_download(out_filename, fetch_exception)
+        if rm_on_error and not keep:
             # try / except so if remove fails we don't get an exception during an exception.
-            # Sets rm_passed to true so if this fails we can include a special error message in the
+            # Sets rm_failed so if this fails we can include a special error message in the
             # FetchError
             try:
                 os.remove(out_filename)
-                rm_passed = True
-            except Exception:
+            except FileNotFoundError:
                 pass
-        else:
-            rm_passed = True
+            except Exception:
+                rm_failed = True
+            if resume:
+                try:
+                    os.remove(validator_filename)
+                except OSError:
+                    pass
+
+        raise FetchError(url, out_filename, fetch_exception, rm_failed) from fetch_exception
+
+
+def _is_partial_download(filename, ex):
+    """Return whether filename holds part of a body received before the download failed with ex."""
+    if isinstance(ex, requests.exceptions.HTTPError):
+        # The server answered with an error rather than (the rest of) the file.
+        return False
+    try:
+        return os.path.getsize(filename) > 0
+    except OSError:
+        return False
 
-        raise FetchError(url, out_filename, fetch_exception, rm_passed) from fetch_exception
 
+def download_atomic(out_filename, url, work_dir, session=None, expected_sha1=None):
+    """Download url to out_filename, which only appears once the download is complete.
 
-def download_atomic(out_filename, url, work_dir):
+    The download goes to out_filename + '.tmp'. If the download fails part
+    way through, the .tmp file is kept so the next download_atomic of the same
+    file picks up where this one stopped.
+
+    If expected_sha1 is given and the download doesn't match it, the download
+    is moved to out_filename + '.corrupt' (so it is never resumed) and a
+    ValidationError is raised.
+    """
     assert os.path.isabs(out_filename)
     tmp_filename = out_filename + '.tmp'
-    try:
-        download(tmp_filename, url, work_dir)
-        os.rename(tmp_filename, out_filename)
-    except FetchError:
-        try:
-            os.remove(tmp_filename)
-        except:
-            pass
-        raise
+    download(tmp_filename, url, work_dir, session=session, resume=True)
+    if expected_sha1 is not None:
+        file_sha1 = sha1(tmp_filename)
+        if file_sha1 != expected_sha1:
+            corrupt_filename = out_filename + '.corrupt'
+            os.rename(tmp_filename, corrupt_filename)
+            raise ValidationError(
+                "Provided sha1 didn't match sha1 of downloaded file, corrupt download saved as {}. "
+                "Provided: {}, Download file's sha1: {}, Url: {}".format(
+                    corrupt_filename, expected_sha1, file_sha1, url))
+    os.rename(tmp_filename, out_filename)
 
 
 def extract_tarball(path, target):
@@ -131,13 +334,98 @@ def extract_tarball(path, target):
     try:
         assert os.path.exists(path), "Path doesn't exist but should: {}".format(path)
         check_call(['mkdir', '-p', target])
-        check_call(['tar', '-xf', path, '-C', target])
+        tar_cmd = ['tar']
+        compression = sniff_compression(path)
+        if compression is not None:
+            # Not all tars know about every codec, so always say which one to use.
+            tar_cmd.append('--use-compress-program=' + compression)
+        check_call(tar_cmd + ['-xf', path, '-C', target])
     except:
         # If there are errors, we can't really cope since we are already in an error state.
         rmtree(target, ignore_errors=True)
         raise
 
 
+def download_extract_tarball(url, target, work_dir, session=None, expected_sha1=None):
+    """Download the tarball at url and extract it into target as it arrives.
+
+    The body is piped straight into tar, so the tarball is never written to
+    disk and extraction overlaps the download. Dropped connections are resumed
+    (see iter_download). Returns the sha1 of the tarball. If expected_sha1 is
+    given and doesn't match, or anything fails, target is
+    deleted and a FetchError is raised.
+    """
+    assert os.path.isabs(work_dir)
+    url = url.strip()
+    hasher = hashlib.sha1()
+    try:
+        with ExitStack() as stack:
+            # Handle file:// urls specially since requests doesn't know about them.
+            if url.startswith('file://'):
+                src_filename = url[len('file://'):]
+                if not os.path.isabs(src_filename):
+                    src_filename = work_dir.rstrip('/') + '/' + src_filename
+                src = stack.enter_context(open(src_filename, 'rb'))
+                chunks = iter(lambda: src.read(STREAM_CHUNK_SIZE), b'')
+            else:
+                chunks = iter_download(url, session)
+                stack.callback(chunks.close)
+
+            # The codec can only be told from the first bytes of the body.
+            header = b''
+            for chunk in chunks:
+                header += chunk
+                if len(header) >= max(len(magic) for magic in compression_magic):
+                    break
+            compression = compression_from_header(header)
+
+            check_call(['mkdir', '-p', target])
+            tar_cmd = ['tar']
+            if compression is not None:
+                tar_cmd.append('--use-compress-program=' + compression)
+            tar = subprocess.Popen(tar_cmd + ['-xf', '-', '-C', target], stdin=subprocess.PIPE)
+            try:
+                for chunk in chain([header], chunks):
+                    hasher.update(chunk)
+                    tar.stdin.write(chunk)
+            except BrokenPipeError:
+                # tar exited early, its return code says why.
+                pass
+            finally:
+                try:
+                    tar.stdin.close()
+                except BrokenPipeError:
+                    pass
+                returncode = tar.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, tar_cmd)
+
+        if expected_sha1 is not None and hasher.hexdigest() != expected_sha1:
+            raise ValidationError("sha1 mismatch, expected {} got {}".format(expected_sha1, hasher.hexdigest()))
+    except Exception as fetch_exception:
+        rmtree(target, ignore_errors=True)
+        raise FetchError(url, target, fetch_exception, os.path.exists(target)) from fetch_exception
+
+    return hasher.hexdigest()
+
+
+@contextmanager
+def file_lock(filename, blocking=True):
+    """Hold an exclusive flock on filename (created if missing) for the duration of the context.
+
+    Used to serialize concurrent pkgpanda processes (e.g. parallel package
+    builds) touching the same cache entry. If blocking is False and the lock is
+    held elsewhere, BlockingIOError is raised instead of waiting. Yields the
+    open lock file.
+    """
+    with open(filename, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
 def load_json(filename):
     try:
         with open(filename) as f:
@@ -194,19 +482,44 @@ def if_exists(fn, *args, **kwargs):
         return None
 
 
+# Large reads mean few, big hasher.update() calls. hashlib releases the GIL
+# while hashing big buffers, so hashing in multiple threads scales.
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
 def sha1(filename):
     hasher = hashlib.sha1()
+    buf = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buf)
 
-    with open(filename, 'rb') as fh:
+    with open(filename, 'rb', buffering=0) as fh:
         while 1:
-            buf = fh.read(4096)
-            if not buf:
+            size = fh.readinto(buf)
+            if not size:
                 break
-            hasher.update(buf)
+            hasher.update(view[:size])
 
     return hasher.hexdigest()
 
 
+def sha1_files(filenames, workers=None):
+    """Return a dictionary from filename to the sha1 of each file in filenames.
+
+    The files are hashed concurrently by up to `workers` threads, defaulting to
+    the number of CPUs.
+    """
+    filenames = list(filenames)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(filenames))
+
+    if workers <= 1:
+        return {filename: sha1(filename) for filename in filenames}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(filenames, executor.map(sha1, filenames)))
+
+
 def expect_folder(path, files):
     path_contents = os.listdir(path)
     assert set(path_contents) == set(files)
@@ -225,12 +538,170 @@ def expect_fs(folder, contents):
         raise ValueError("Invalid type {0} passed to expect_fs".format(type(contents)))
 
 
-def make_tar(result_filename, change_folder):
-    tar_cmd = ["tar", "--numeric-owner", "--owner=0", "--group=0"]
-    if which("pxz"):
-        tar_cmd += ["--use-compress-program=pxz", "-cf"]
+# Leading bytes of a compressed file -> name of the program which decompresses it.
+compression_magic = {
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+    b'\x1f\x8b': 'gzip',
+}
+
+# Codecs package and bootstrap tarballs can be written with. Readers detect the
+# codec from the file contents, so tarballs keep the `.tar.xz` extension
+# whichever is used.
+compression_codecs = ['xz', 'zstd']
+
+
+def sniff_compression(filename):
+    """Return the codec filename is compressed with by looking at its magic bytes.
+
+    Returns None if the codec isn't recognized (e.g. an uncompressed tar).
+    """
+    with open(filename, 'rb') as f:
+        return compression_from_header(f.read(max(len(magic) for magic in compression_magic)))
+
+
+def compression_from_header(header):
+    """Return the codec for a file starting with the bytes header, None if unrecognized."""
+    for magic, codec in compression_magic.items():
+        if header.startswith(magic):
+            return codec
+    return None
+
+
+def get_compress_program(compression):
+    """Return the command tar should pipe a new archive through for compression.
+
+    compression is a codec name, optionally followed by `:<level>` (e.g. `zstd:19`).
+    Both codecs use every available core, and give the same output for the
+    same input on any machine.
+    """
+    codec, _, level = compression.partition(':')
+    if codec == 'xz':
+        # Always use xz's multi-threaded mode (2+ threads) even on a single
+        # core. Its output depends only on the block size, not on the number
+        # of threads, while single-threaded mode (and pxz) write a different
+        # stream, so the same package would come out differently on
+        # different machines.
+        cmd = ['xz', '-T{}'.format(max(2, os.cpu_count() or 1))]
+    elif codec == 'zstd':
+        # zstd's multi-threaded output is the same for any number of threads.
+        # Decompressing is fast at any level, so trade compression time for size.
+        cmd = ['zstd', '-T0']
+        level = level or '19'
     else:
-        tar_cmd += ["-cJf"]
+        raise ValidationError("Unknown compression {}. Must be one of: {}".format(
+            compression, ', '.join(compression_codecs)))
+    if not which(cmd[0]):
+        raise ValidationError("{} compression requires `{}` to be installed".format(codec, cmd[0]))
+    if level:
+        if not level.isdigit():
+            raise ValidationError("Compression level must be a number. Got: {}".format(level))
+        cmd.append('-' + level)
+    return ' '.join(cmd)
+
+
+# Modification time of everything newer in a package tarball. Files older than
+# it (e.g. from an upstream tarball) keep their own. Honors SOURCE_DATE_EPOCH
+# (https://reproducible-builds.org/specs/source-date-epoch/).
+reproducible_mtime = int(os.environ.get('SOURCE_DATE_EPOCH', 1451606400))
+
+# Make tar's output depend only on the names, contents and permissions of the
+# files being archived: members in a fixed order, no owners, timestamps or
+# pax header names which vary from one build to the next.
+reproducible_tar_args = [
+    "--sort=name",
+    "--mtime=@{}".format(reproducible_mtime),
+    "--clamp-mtime",
+    "--numeric-owner",
+    "--owner=0",
+    "--group=0",
+    "--pax-option=exthdr.name=%d/PaxHeaders/%f,delete=atime,delete=ctime",
+]
+
+
+def _get_pyc_source(pyc_path):
+    """Return the .py a .pyc was compiled from (in the same folder, or the parent of __pycache__)."""
+    folder, name = os.path.split(pyc_path)
+    if os.path.basename(folder) == '__pycache__':
+        folder = os.path.dirname(folder)
+    return os.path.join(folder, name.split('.')[0] + '.py')
+
+
+def find_pycs_to_clamp(root, mtime):
+    """Return the .pyc files under root which make_tar has to change to keep them valid, and where.
+
+    A .pyc records the modification time of its .py, and is ignored (or
+    rewritten) when the two don't match. make_tar stores files newer than
+    mtime with mtime, so every .pyc whose .py is newer than mtime needs mtime
+    recorded instead. Returns a list of (path relative to root, offset of the
+    recorded time in the file).
+    """
+    pycs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith('.pyc'):
+                continue
+            pyc_path = os.path.join(dirpath, filename)
+            source_path = _get_pyc_source(pyc_path)
+            if os.path.islink(pyc_path) or not os.path.isfile(source_path):
+                continue
+            source_mtime = int(os.stat(source_path).st_mtime)
+            if source_mtime <= mtime:
+                continue
+            with open(pyc_path, 'rb') as f:
+                header = f.read(16)
+            if len(header) < 8 or header[2:4] != b'\r\n':
+                continue
+            # Python 3.7+ (PEP 552) has a flags word before the time, and
+            # doesn't record the time at all for hash based .pycs.
+            magic = int.from_bytes(header[:2], 'little')
+            offset = 4
+            if 3390 <= magic < 20000:
+                if len(header) < 12 or int.from_bytes(header[4:8], 'little') != 0:
+                    continue
+                offset = 8
+            # Only touch .pycs which are up to date with their .py.
+            if int.from_bytes(header[offset:offset + 4], 'little') != source_mtime & 0xFFFFFFFF:
+                continue
+            pycs.append((os.path.relpath(pyc_path, root), offset))
+    return pycs
+
+
+def _set_pyc_mtime(pyc_path, offset, mtime):
+    """Record mtime as the source time of a .pyc we own, whatever its permissions."""
+    stat = os.stat(pyc_path)
+    os.chmod(pyc_path, stat.st_mode | S_IWUSR)
+    with open(pyc_path, 'r+b') as f:
+        f.seek(offset)
+        f.write(mtime.to_bytes(4, 'little'))
+    os.chmod(pyc_path, stat.st_mode)
+    os.utime(pyc_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def make_tar(result_filename, change_folder, compression='xz'):
+    """Archive the contents of change_folder into result_filename.
+
+    The same files always give a bit-identical tarball, so rebuilding a
+    package gives the same artifact. change_folder isn't changed: if any
+    .pyc files in it need their source time clamped (see find_pycs_to_clamp)
+    a copy of it, made next to result_filename, is archived instead.
+    """
+    pycs = find_pycs_to_clamp(change_folder, reproducible_mtime)
+    if not pycs:
+        _make_tar(result_filename, change_folder, compression)
+        return
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(result_filename))) as staging:
+        staged_folder = os.path.join(staging, 'contents')
+        check_call(['cp', '-a', change_folder, staged_folder])
+        for path, offset in pycs:
+            _set_pyc_mtime(os.path.join(staged_folder, path), offset, reproducible_mtime)
+        _make_tar(result_filename, staged_folder, compression)
+
+
+def _make_tar(result_filename, change_folder, compression):
+    tar_cmd = ["tar"] + reproducible_tar_args
+    tar_cmd += ["--use-compress-program=" + get_compress_program(compression), "-cf"]
     tar_cmd += [result_filename, "-C", change_folder, "."]
     check_call(tar_cmd)
 
@@ -373,6 +844,14 @@ class MessageLogger:
     def failure(self, text, flow_id=None):
         self._custom_message(text=text, status='FAILURE', flow_id=flow_id)
 
+    def statistic(self, key, value):
+        """Report a build statistic, which TeamCity can chart across builds."""
+        for log in self.loggers:
+            if isinstance(log, TeamcityServiceMessages):
+                log.message('buildStatisticValue', key=key, value=str(value))
+            else:
+                log.statisticValue(key, value)
+
 
 class PrintLogger:
     def customMessage(self, text, status, errorDetails='', flowId=None):  # noqa: N802, N803
@@ -387,6 +866,9 @@ class PrintLogger:
     def blockClosed(self, name, flowId=None):  # noqa: N802, N803
         print("completed: {}".format(name))
 
+    def statisticValue(self, key, value):  # noqa: N802, N803
+        print("statistic: {} = {}".format(key, value))
+
 
 logger = MessageLogger()
 
@@ -307,7 +307,7 @@ def make_bootstrap_artifacts(bootstrap_id, package_ids, variant_name, artifact_p
     }
 
 
-def make_stable_artifacts(cache_repository_url):
+def make_stable_artifacts(cache_repository_url, cache_storage=None, cache_storage_prefix=''):
     metadata = {
         "commit": util.dcos_image_commit,
         "core_artifacts": [],
@@ -318,7 +318,7 @@ def make_stable_artifacts(cache_repository_url):
     # have do_build_packages get them directly from pkgpanda
     with logger.scope("Building packages"):
         try:
-            all_completes = do_build_packages(cache_repository_url)
+            all_completes = do_build_packages(cache_repository_url, cache_storage, cache_storage_prefix)
         except pkgpanda.build.BuildError as ex:
             logger.error("Failure building package(s): {}".format(ex))
             raise
@@ -471,13 +471,13 @@ def make_abs(path):
     return os.getcwd() + '/' + path
 
 
-def do_build_docker(name, path):
+def do_build_docker(name, path, hash_cache=None):
     with logger.scope("dcos/dcos-builder ({})".format(name)):
-        return _do_build_docker(name, path)
+        return _do_build_docker(name, path, hash_cache)
 
 
-def _do_build_docker(name, path):
-    path_sha = pkgpanda.build.hash_folder_abs(path, os.path.dirname(path))
+def _do_build_docker(name, path, hash_cache):
+    path_sha = pkgpanda.build.hash_folder_abs(path, os.path.dirname(path), hash_cache)
     container_name = 'dcos/dcos-builder:{}_dockerdir-{}'.format(name, path_sha)
 
     print("Attempting to pull docker:", container_name)
@@ -555,12 +555,14 @@ def _build_builders(package_store):
     all_builders = global_builders.copy()
     all_builders.update(pkg_builders)
     for name, path in all_builders.items():
-        do_build_docker(name, path)
+        do_build_docker(name, path, package_store.hash_cache)
 
 
-def do_build_packages(cache_repository_url):
+def do_build_packages(cache_repository_url, cache_storage=None, cache_storage_prefix=''):
     package_store = pkgpanda.build.PackageStore(os.getcwd() + '/packages',
-                                                cache_repository_url)
+                                                cache_repository_url,
+                                                cache_storage=cache_storage,
+                                                cache_storage_prefix=cache_storage_prefix)
 
     _build_builders(package_store)
 
@@ -807,7 +809,15 @@ class ReleaseManager():
 
         # TOOD(cmaloney): Figure out why the cached version hasn't been working right
         # here from the TeamCity agents. For now hardcoding the non-cached s3 download locatoin.
-        metadata = make_stable_artifacts(self.__config['options']['cloudformation_s3_url'] + '/' + repository_path)
+        # With build_cache_write_back set, packages and bootstraps are uploaded to the
+        # preferred storage as soon as they're built so concurrent builders can use them.
+        cache_storage = None
+        if self.__config['options'].get('build_cache_write_back', False) and not self.__noop:
+            cache_storage = self.__preferred_provider
+        metadata = make_stable_artifacts(
+            self.__config['options']['cloudformation_s3_url'] + '/' + repository_path,
+            cache_storage,
+            repository_path + '/')
 
         # Metadata should already have things like bootstrap_id in it.
         assert 'bootstrap_dict' in metadata
@@ -26,10 +26,13 @@ class LocalStorageProvider(AbstractStorageProvider):
     def download_inner(self, path, local_path):
         subprocess.check_call(['cp', self.__full_path(path), local_path])
 
-    # Copy between fully qualified paths
+    # Copy between fully qualified paths. The file is copied next to the
+    # destination then renamed into place so readers never see a partial file.
     def __copy(self, full_source_path, full_destination_path):
         subprocess.check_call(['mkdir', '-p', os.path.dirname(full_destination_path)])
-        subprocess.check_call(['cp', full_source_path, full_destination_path])
+        tmp_path = full_destination_path + '.tmp-' + str(os.getpid())
+        subprocess.check_call(['cp', full_source_path, tmp_path])
+        os.rename(tmp_path, full_destination_path)
 
     def copy(self, source_path, destination_path):
         self.__copy(self.__full_path(source_path), self.__full_path(destination_path))
@@ -51,8 +54,10 @@ class LocalStorageProvider(AbstractStorageProvider):
             self.__copy(local_path, destination_full_path)
         else:
             assert isinstance(blob, bytes)
-            with open(destination_full_path, 'wb') as f:
+            tmp_path = destination_full_path + '.tmp-' + str(os.getpid())
+            with open(tmp_path, 'wb') as f:
                 f.write(blob)
+            os.rename(tmp_path, destination_full_path)
 
     def exists(self, path):
         assert path[0] != '/'
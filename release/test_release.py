@@ -7,8 +7,11 @@ import uuid
 import pytest
 
 import gen.build_deploy.aws
+import pkgpanda
+import pkgpanda.build
 import release
 import release.storage.aws
+import release.storage.local
 from pkgpanda.build import BuildError
 from pkgpanda.util import variant_prefix, write_json, write_string
 
@@ -243,6 +246,39 @@ def test_storage_provider_local(tmpdir):
     exercise_storage_provider(work_dir, 'local_path', {'path': str(repo_dir)})
 
 
+def test_build_cache_write_back(tmpdir):
+    storage = release.storage.local.LocalStorageProvider(str(tmpdir.join('storage')))
+
+    def make_package_store(path, **kwargs):
+        tmpdir.join(path, 'a', 'buildinfo.json').write('{}', ensure=True)
+        return pkgpanda.build.PackageStore(str(tmpdir.join(path)), **kwargs)
+
+    # A builder publishes what it built.
+    builder = make_package_store('builder', repository_url=None, cache_storage=storage, cache_storage_prefix='repo/')
+    pkg_id = pkgpanda.PackageId('a--1')
+    write_string(builder.get_package_path(pkg_id), 'package')
+    write_string(builder.get_last_build_filename('a', None), str(pkg_id))
+    builder.publish_package('a', None)
+    assert storage.list_recursive('repo') == {'repo/packages/a/a--1.tar.xz', 'repo/packages/a/latest'}
+
+    bootstrap_dir = builder.get_bootstrap_cache_dir()
+    os.makedirs(bootstrap_dir)
+    write_string(bootstrap_dir + '/b.bootstrap.tar.xz', 'bootstrap')
+    write_string(bootstrap_dir + '/b.active.json', '["a--1"]')
+    write_string(bootstrap_dir + '/bootstrap.latest', 'b')
+    builder.publish_bootstrap(None, 'b')
+    assert storage.list_recursive('repo/bootstrap') == {
+        'repo/bootstrap/b.bootstrap.tar.xz',
+        'repo/bootstrap/b.active.json',
+        'repo/bootstrap/bootstrap.latest'}
+
+    # Another builder using the storage as its repository url gets them instead of building.
+    other = make_package_store('other', repository_url=storage.url + 'repo')
+    assert other.try_fetch_by_id(pkg_id) == other.get_package_path(pkg_id)
+    assert open(other.get_package_path(pkg_id)).read() == 'package'
+    assert other.try_fetch_bootstrap_and_active('b')
+
+
 copy_make_commands_result = {'stage1': [
     {
         'if_not_exists': True,
@@ -467,7 +503,7 @@ def test_get_package_artifact(tmpdir):
     }
 
 
-def mock_do_build_packages(cache_repository_url):
+def mock_do_build_packages(cache_repository_url, cache_storage=None, cache_storage_prefix=''):
     subprocess.check_call(['mkdir', '-p', 'packages/cache/bootstrap'])
     write_string("packages/cache/bootstrap/bootstrap_id.bootstrap.tar.xz", "bootstrap_contents")
     write_json("packages/cache/bootstrap/bootstrap_id.active.json", ['a--b', 'c--d'])
@@ -554,7 +590,7 @@ stable_artifacts_metadata = {
 }
 
 
-def mock_failed_build_packages(_):
+def mock_failed_build_packages(*args):
     raise BuildError('This build failed!')
 
 